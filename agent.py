@@ -1,26 +1,112 @@
 # agent.py
+import threading
+from concurrent.futures import Future
+
+import metrics
+from executors import llm_slot
+from streaming import current_sink
 from config import openai_client, OPENAI_MODEL, OPENAI_TEMPERATURE
 
 client = openai_client()
 
-def call_ai(user_id: int, prompt: str, system: str = None, temperature: float | None = None) -> dict:
+# Single-flight: одинаковые детерминированные (temperature=0) запросы, пришедшие
+# одновременно от разных пользователей («кофе», «банан»), ждут один вызов API.
+_inflight_lock = threading.Lock()
+_inflight: dict[tuple, Future] = {}
+
+
+def _messages(prompt: str, system: str | None) -> list[dict]:
+    sysmsg = system or "Отвечай кратко и по делу."
+    return [
+        {"role": "system", "content": sysmsg},
+        {"role": "user", "content": prompt},
+    ]
+
+
+def _flight_key(prompt: str, system: str | None, temp: float, json_mode: bool = False) -> tuple | None:
+    if temp != 0:
+        return None  # недетерминированные ответы не склеиваем
+    return (system or "", prompt, temp, OPENAI_MODEL, json_mode)
+
+
+def _extra(json_mode: bool) -> dict:
+    # JSON mode: модель обязана вернуть валидный JSON-объект
+    return {"response_format": {"type": "json_object"}} if json_mode else {}
+
+
+def call_ai(user_id: int, prompt: str, system: str = None, temperature: float | None = None,
+            json_mode: bool = False, stream: bool = False) -> dict:
     """
     Универсальный вызов LLM.
     Возвращает {"response": <str>}.
     Логирует запрос/ответ.
+    stream=True: если у сообщения есть приёмник (streaming.MessageStreamer), токены
+    показываются пользователю по мере генерации; результат тот же.
     """
-    sysmsg = system or "Отвечай кратко и по делу."
     temp = OPENAI_TEMPERATURE if temperature is None else float(temperature)
+    sink = current_sink() if stream else None
+    if sink is not None:
+        return _call_ai_stream(user_id, prompt, system, temp, sink)
+    key = _flight_key(prompt, system, temp, json_mode)
+    if key is None:
+        return _call_ai(user_id, prompt, system, temp, json_mode)
+
+    with _inflight_lock:
+        fut = _inflight.get(key)
+        leader = fut is None
+        if leader:
+            fut = _inflight[key] = Future()
+    if not leader:
+        metrics.inc("llm_singleflight_shared")
+        print(f"[LLM=] uid={user_id} ждёт такой же запрос")
+        return dict(fut.result())
+
+    metrics.inc("llm_singleflight_leaders")
+    try:
+        result = _call_ai(user_id, prompt, system, temp, json_mode)
+        fut.set_result(result)
+        return result
+    except BaseException as e:
+        fut.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            _inflight.pop(key, None)
 
+
+def _call_ai(user_id: int, prompt: str, system: str | None, temp: float, json_mode: bool = False) -> dict:
     print(f"[LLM→] uid={user_id} prompt={prompt[:400]}")
-    resp = client.chat.completions.create(
-        model=OPENAI_MODEL,
-        temperature=temp,
-        messages=[
-            {"role": "system", "content": sysmsg},
-            {"role": "user", "content": prompt},
-        ],
-    )
+    with llm_slot():
+        resp = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            temperature=temp,
+            messages=_messages(prompt, system),
+            **_extra(json_mode),
+        )
     text = (resp.choices[0].message.content or "").strip()
     print(f"[LLM←] {text[:400]}")
     return {"response": text}
+
+
+def _call_ai_stream(user_id: int, prompt: str, system: str | None, temp: float, sink) -> dict:
+    print(f"[LLM→] uid={user_id} stream prompt={prompt[:400]}")
+    parts = []
+    with llm_slot():  # поток ответа держит соединение — слот до последнего токена
+        resp = client.chat.completions.create(
+            model=OPENAI_MODEL,
+            temperature=temp,
+            messages=_messages(prompt, system),
+            stream=True,
+        )
+        for chunk in resp:
+            if not chunk.choices:
+                continue
+            delta = chunk.choices[0].delta.content or ""
+            if delta:
+                parts.append(delta)
+                sink.push(delta)
+    text = "".join(parts).strip()
+    metrics.inc("llm_streamed")
+    print(f"[LLM←] {text[:400]}")
+    return {"response": text}
+
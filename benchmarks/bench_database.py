@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк слоя БД: запросы в секунду до/после менеджера соединений.
+
+legacy  — как было: новое sqlite3-соединение на каждую функцию, commit + close, журнал по умолчанию.
+managed — database.py: соединение на поток, WAL, synchronous=NORMAL, кэш выражений.
+
+Сценарий «log_meal»: create_user_if_not_exists → save_meal_entry → get_user_data
+(с вложенным get_today_calories) → get_today_calories. Считаем каждую функцию как один запрос.
+
+    python benchmarks/bench_database.py [--ops 2000] [--users 200]
+"""
+
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import database  # noqa: E402
+
+
+# ---------- legacy: копия старого поведения get_conn() ----------
+
+def _legacy_conn(path):
+    return sqlite3.connect(path, check_same_thread=False)
+
+
+def legacy_create_user(path, user_id):
+    conn = _legacy_conn(path)
+    c = conn.cursor()
+    c.execute("SELECT user_id FROM users WHERE user_id=?", (user_id,))
+    if not c.fetchone():
+        c.execute("INSERT INTO users (user_id, created_at) VALUES (?, ?)", (user_id, datetime.now().isoformat()))
+    c.execute("INSERT OR IGNORE INTO settings (user_id, remind_weekly, last_weighin_reminder_at) VALUES (?, 1, NULL)", (user_id,))
+    conn.commit()
+    conn.close()
+
+
+def legacy_save_meal(path, user_id, description, calories):
+    conn = _legacy_conn(path)
+    c = conn.cursor()
+    c.execute("INSERT INTO meals (user_id, description, calories, created_at) VALUES (?, ?, ?, ?)",
+              (user_id, description, calories, datetime.now().isoformat()))
+    conn.commit()
+    conn.close()
+
+
+def legacy_today(path, user_id):
+    conn = _legacy_conn(path)
+    c = conn.cursor()
+    c.execute("SELECT SUM(calories) FROM meals WHERE user_id=? AND created_at LIKE ?",
+              (user_id, f"{datetime.now().date().isoformat()}%"))
+    res = c.fetchone()
+    conn.close()
+    return int(res[0] or 0)
+
+
+def legacy_user_data(path, user_id):
+    conn = _legacy_conn(path)
+    c = conn.cursor()
+    c.execute("SELECT name, age, weight, height, goal_calories FROM users WHERE user_id=?", (user_id,))
+    c.fetchone()
+    legacy_today(path, user_id)
+    conn.close()
+
+
+def run_legacy(path, ops, users):
+    for i in range(ops):
+        uid = i % users
+        legacy_create_user(path, uid)
+        legacy_save_meal(path, uid, "2 яйца", 156)
+        legacy_user_data(path, uid)
+        legacy_today(path, uid)
+
+
+def run_managed(ops, users):
+    for i in range(ops):
+        uid = i % users
+        database.create_user_if_not_exists(uid)
+        database.save_meal_entry(uid, "2 яйца", 156)
+        database.get_user_data(uid)
+        database.get_today_calories(uid)
+
+
+def _quiet(fn, *args):
+    # database.py печатает каждую запись — в замерах это шум
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        t0 = time.perf_counter()
+        fn(*args)
+        return time.perf_counter() - t0
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ops", type=int, default=2000, help="сколько раз повторить сценарий log_meal")
+    ap.add_argument("--users", type=int, default=200)
+    args = ap.parse_args()
+    queries = args.ops * 5  # 4 функции + вложенный get_today_calories
+
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        database.DB_PATH = legacy_path
+        _quiet(database.init_db)
+        database.close_conn()
+        conn = sqlite3.connect(legacy_path)
+        conn.execute("PRAGMA journal_mode=DELETE")  # как до WAL
+        conn.close()
+        t_legacy = _quiet(run_legacy, legacy_path, args.ops, args.users)
+
+        database.DB_PATH = os.path.join(tmp, "managed.db")
+        _quiet(database.init_db)
+        t_managed = _quiet(run_managed, args.ops, args.users)
+        database.close_conn()
+
+    print(f"scenario: log_meal × {args.ops} ({queries} queries, {args.users} users)")
+    print(f"legacy : {t_legacy:8.3f} s  {queries / t_legacy:10.0f} q/s")
+    print(f"managed: {t_managed:8.3f} s  {queries / t_managed:10.0f} q/s")
+    print(f"speedup: {t_legacy / t_managed:.1f}×")
+
+
+if __name__ == "__main__":
+    main()
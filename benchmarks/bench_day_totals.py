@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+"""
+Бенчмарк дневной суммы калорий по мере роста meals.
+
+legacy  — created_at LIKE 'YYYY-MM-DD%' без индекса (полный скан).
+indexed — SUM по диапазону created_at через idx_meals_user_created.
+rollup  — database.get_today_calories: точечный поиск в daily_totals.
+
+    python benchmarks/bench_day_totals.py [--sizes 10000,100000,1000000] [--queries 500]
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import database  # noqa: E402
+
+USERS = 1000
+
+
+def _fill(rows: int):
+    now = datetime.now()
+    data = [
+        (random.randrange(USERS), "еда", random.randint(50, 800),
+         (now - timedelta(days=random.randrange(365), seconds=random.randrange(86400))).isoformat())
+        for _ in range(rows)
+    ]
+    with database.transaction() as c:
+        c.executemany("INSERT INTO meals (user_id, description, calories, created_at) VALUES (?, ?, ?, ?)", data)
+
+
+def _legacy_today(user_id: int) -> int:
+    with database.cursor() as c:
+        c.execute(
+            "SELECT SUM(calories) FROM meals NOT INDEXED WHERE user_id=? AND created_at LIKE ?",
+            (user_id, f"{datetime.now().date().isoformat()}%")
+        )
+        return int(c.fetchone()[0] or 0)
+
+
+def _indexed_today(user_id: int) -> int:
+    start, end = database._day_bounds()
+    with database.cursor() as c:
+        c.execute(
+            "SELECT SUM(calories) FROM meals WHERE user_id=? AND created_at >= ? AND created_at < ?",
+            (user_id, start, end)
+        )
+        return int(c.fetchone()[0] or 0)
+
+
+def _avg_us(fn, queries: int) -> float:
+    t0 = time.perf_counter()
+    for _ in range(queries):
+        fn(random.randrange(USERS))
+    return (time.perf_counter() - t0) / queries * 1e6
+
+
+def _quiet(fn, *args):
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, "w")
+    try:
+        return fn(*args)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--sizes", default="10000,100000,1000000")
+    ap.add_argument("--queries", type=int, default=500)
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        _quiet(database.init_db)
+        total = 0
+        print(f"{'rows':>10} {'legacy µs':>12} {'indexed µs':>12} {'rollup µs':>12}")
+        for size in sorted(int(x) for x in args.sizes.split(",")):
+            _fill(size - total)
+            total = size
+            _quiet(database.rebuild_daily_totals)
+            legacy = _avg_us(_legacy_today, max(args.queries // 10, 10))
+            indexed = _avg_us(_indexed_today, args.queries)
+            rollup = _avg_us(database.get_today_calories, args.queries)
+            print(f"{size:>10} {legacy:>12.1f} {indexed:>12.1f} {rollup:>12.1f}")
+        database.close_conn()
+
+
+if __name__ == "__main__":
+    main()
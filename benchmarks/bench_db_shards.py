@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Шардирование SQLite (DB_SHARDS): записи/с в зависимости от числа файлов БД.
+
+Все записи — repository.submit(insert_meal_entry) (групповой commit, synchronous=FULL),
+пользователи разложены по шардам по hash(user_id).
+
+1 процесс    — --threads потоков одного процесса; писателей столько, сколько файлов.
+K процессов  — как BOT_SHARDS=K: процесс k обслуживает пользователей hash(user_id) % K == k
+               и пишет своим писателем. «1 файл» — все процессы делят fitness.db и его
+               блокировку записи; «K файлов» — DB_SHARDS=K, у каждого процесса свой файл.
+
+    python benchmarks/bench_db_shards.py [--ops 8000] [--threads 16] [--shards 1,2,4,8] [--dir /var/tmp]
+"""
+
+import argparse
+import contextlib
+import io
+import multiprocessing as mp
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import database  # noqa: E402
+from repository import GroupCommitRepository  # noqa: E402
+
+USERS = 1000
+
+
+def _setup(db_path: str, shards: int):
+    database.DB_PATH = db_path
+    database.DB_SHARDS = shards
+
+
+def _write(users: list[int], ops: int, threads: int) -> float:
+    """ops записей от users через групповой писатель; возвращает секунды."""
+    repo = GroupCommitRepository()
+    with contextlib.redirect_stdout(io.StringIO()):  # [DB]/[REPO]-логи не меряем
+        repo.start()
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(
+                lambda i: repo.submit(database.insert_meal_entry, users[i % len(users)], f"блюдо {i}", 100).result(),
+                range(ops),
+            ))
+        elapsed = time.perf_counter() - t0
+        repo.stop()
+    database.close_conn()
+    return elapsed
+
+
+def _proc_main(db_path: str, db_shards: int, k: int, n: int, ops: int, threads: int, start, results):
+    _setup(db_path, db_shards)
+    users = [u for u in range(1, USERS + 1) if hash(u) % n == k]
+    start.wait()
+    results.put(_write(users, ops, threads))
+
+
+def _fresh(tmp: str, name: str, shards: int) -> str:
+    path = os.path.join(tmp, name, "fitness.db")
+    os.makedirs(os.path.dirname(path))
+    _setup(path, shards)
+    with contextlib.redirect_stdout(io.StringIO()):
+        database.init_db()
+    database.close_conn()
+    return path
+
+
+def _one_process(tmp: str, shards: int, ops: int, threads: int) -> float:
+    _fresh(tmp, f"t{shards}", shards)
+    return ops / _write(list(range(1, USERS + 1)), ops, threads)
+
+
+def _processes(tmp: str, n: int, db_shards: int, ops: int, threads: int) -> float:
+    path = _fresh(tmp, f"p{n}x{db_shards}", db_shards)
+    ctx = mp.get_context("spawn")
+    start, results = ctx.Event(), ctx.Queue()
+    per_proc = ops // n
+    procs = [
+        ctx.Process(target=_proc_main, args=(path, db_shards, k, n, per_proc, max(1, threads // n), start, results))
+        for k in range(n)
+    ]
+    for p in procs:
+        p.start()
+    time.sleep(1.0)  # дать процессам импортировать модули
+    start.set()
+    slowest = max(results.get() for _ in procs)
+    for p in procs:
+        p.join()
+    return per_proc * n / slowest
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ops", type=int, default=8000)
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--shards", default="1,2,4,8")
+    ap.add_argument("--dir", default=None, help="каталог для временных БД")
+    args = ap.parse_args()
+
+    print(f"{'шардов':>6} {'1 процесс':>12} {'K проц., 1 файл':>16} {'K проц., K файлов':>18}   (записей/с)")
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        for n in (int(x) for x in args.shards.split(",")):
+            single = _one_process(tmp, n, args.ops, args.threads)
+            shared = _processes(tmp, n, 1, args.ops, args.threads)
+            split = _processes(tmp, n, n, args.ops, args.threads) if n > 1 else shared
+            print(f"{n:>6} {single:>12.0f} {shared:>16.0f} {split:>18.0f}")
+
+
+if __name__ == "__main__":
+    main()
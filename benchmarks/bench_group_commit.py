@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Групповая запись (repository.py) против commit на каждую операцию.
+
+Сценарий: --threads потоков (как DB/LLM-пулы бота) параллельно пишут save_meal_entry
+разным пользователям, всего --ops записей. Меряем записи/с и задержку одной записи.
+
+normal — database.save_meal_entry: своя транзакция, synchronous=NORMAL (WAL без fsync на commit).
+full   — то же с synchronous=FULL: каждая запись долговечна, fsync на каждый commit.
+group  — repository.submit(insert_meal_entry).result(): synchronous=FULL, один commit на пачку.
+
+    python benchmarks/bench_group_commit.py [--ops 4000] [--threads 16]
+"""
+
+import argparse
+import contextlib
+import io
+import os
+import sys
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+import database  # noqa: E402
+from repository import GroupCommitRepository  # noqa: E402
+
+
+def _pct(values, p):
+    s = sorted(values)
+    return s[min(len(s) - 1, int(len(s) * p))]
+
+
+def _run(name, write, ops, threads, users=500):
+    latencies = []
+    lock = threading.Lock()
+
+    def one(i):
+        t0 = time.perf_counter()
+        write(1 + i % users, f"блюдо {i}", 100 + i % 400)
+        dt = time.perf_counter() - t0
+        with lock:
+            latencies.append(dt)
+
+    with contextlib.redirect_stdout(io.StringIO()):  # [DB]-логи не меряем
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(threads) as pool:
+            list(pool.map(one, range(ops)))
+        elapsed = time.perf_counter() - t0
+    print(f"{name:<7} {ops / elapsed:8.0f} записей/с   p50={_pct(latencies, 0.5) * 1000:6.2f} мс"
+          f"   p99={_pct(latencies, 0.99) * 1000:6.2f} мс")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--ops", type=int, default=4000)
+    ap.add_argument("--threads", type=int, default=16)
+    ap.add_argument("--batch", type=int, default=64)
+    ap.add_argument("--interval-ms", type=float, default=0.0)
+    ap.add_argument("--dir", default=None, help="каталог для временной БД (диск, а не tmpfs)")
+    args = ap.parse_args()
+
+    with tempfile.TemporaryDirectory(dir=args.dir) as tmp:
+        database.DB_PATH = os.path.join(tmp, "bench.db")
+        with contextlib.redirect_stdout(io.StringIO()):
+            database.init_db()
+
+        _run("normal", database.save_meal_entry, args.ops, args.threads)
+
+        def full(user_id, description, calories):
+            conn = database.get_conn()
+            conn.execute("PRAGMA synchronous=FULL")
+            database.save_meal_entry(user_id, description, calories)
+
+        _run("full", full, args.ops, args.threads)
+
+        repo = GroupCommitRepository(args.batch, args.interval_ms)
+        with contextlib.redirect_stdout(io.StringIO()):
+            repo.start()
+
+        def group(user_id, description, calories):
+            repo.submit(database.insert_meal_entry, user_id, description, calories).result()
+
+        _run("group", group, args.ops, args.threads)
+        repo.stop()
+
+        with database.cursor() as c:
+            c.execute("SELECT COUNT(*) FROM meals")
+            print(f"meals: {c.fetchone()[0]} (ожидали {3 * args.ops})")
+
+
+if __name__ == "__main__":
+    main()
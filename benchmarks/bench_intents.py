@@ -0,0 +1,109 @@
+#!/usr/bin/env python3
+"""
+Точность и скорость быстрого роутинга намерений на размеченном корпусе.
+
+legacy   — прежний линейный обход INTENT_RULES подстроками + отдельная проверка цели.
+cold     — intents.IntentMatcher без кэша: одна регулярка с приоритетами.
+compiled — intents.classify: то же + кэш повторяющихся текстов (установившийся режим).
+hybrid   — как в router.llm_route: правила с confidence ≥ RULE_CONFIDENCE, затем классификатор
+           intent_classifier (обучен только на intent_seed.tsv) с порогом INTENT_CONFIDENCE;
+           ниже порогов — «none» (ушло бы агенту).
+
+Корпус — tests/test_intents.CORPUS (там же проверяется точность).
+
+    python benchmarks/bench_intents.py [--rounds 2000]
+"""
+
+import argparse
+import os
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+
+from intents import RULES, IntentMatcher, classify  # noqa: E402
+from intent_classifier import NaiveBayesIntentClassifier, load_seed  # noqa: E402
+from config import INTENT_CONFIDENCE, RULE_CONFIDENCE  # noqa: E402
+from tests.test_intents import CORPUS  # noqa: E402
+
+LEGACY_RULES = [
+    ("трениров", "workout"), ("прогресс", "progress"), ("остаток", "get_remaining_calories"),
+    ("за неделю", "calorie_summary"), ("за месяц", "calorie_summary"), ("сводк", "calorie_summary"),
+    ("мой вес", "show_weight"), ("вес?", "show_weight"), ("моя цель", "show_goal"),
+    ("текущая цель", "show_goal"), ("я съел", "log_meal"), ("съел", "log_meal"),
+    ("я выпил", "log_meal"), ("выпил", "log_meal"), ("завтрак", "log_meal"), ("обед", "log_meal"),
+    ("ужин", "log_meal"), ("перекус", "log_meal"), ("взвес", "log_weight"), ("вес ", "log_weight"),
+]
+
+
+def legacy(text: str) -> str:
+    t = (text or "").lower().strip()
+    if t in {"да", "ок", "окей", "согласен", "подтверждаю"}:
+        return "confirm"
+    if t in {"нет", "не", "отмена", "отменить"}:
+        return "cancel"
+    if ("цель" in t and re.search(r"(\d+(?:[.,]\d+)?)", t)) or \
+       ("похуд" in t and "кг" in t and re.search(r"(\d+(?:[.,]\d+)?)", t)):
+        return "goal"
+    for needle, tool in LEGACY_RULES:
+        if needle in t:
+            return tool
+    return "none"
+
+
+_cold = IntentMatcher(RULES, cache_size=0)
+
+
+def cold(text: str) -> str:
+    m = classify(text, _cold)
+    return m.intent if m else "none"
+
+
+def compiled(text: str) -> str:
+    m = classify(text)
+    return m.intent if m else "none"
+
+
+_nb = NaiveBayesIntentClassifier.fit(load_seed())
+_NB_TO_RULE = {"create_plan": "goal", "chat": "none"}
+
+
+def hybrid(text: str) -> str:
+    m = classify(text)
+    if m and m.confidence >= RULE_CONFIDENCE:
+        return m.intent
+    label, confidence = _nb.predict(text)
+    if label and confidence >= INTENT_CONFIDENCE:
+        return _NB_TO_RULE.get(label, label)
+    return "none"
+
+
+def _report(name: str, fn, corpus, rounds: int):
+    errors = [(t, want, fn(t)) for t, want in corpus if fn(t) != want]
+    acc = 1 - len(errors) / len(corpus)
+    t0 = time.perf_counter()
+    for _ in range(rounds):
+        for t, _ in corpus:
+            fn(t)
+    us = (time.perf_counter() - t0) / (rounds * len(corpus)) * 1e6
+    print(f"{name:<9} accuracy={acc:6.1%}  {us:6.2f} µs/msg")
+    for t, want, got in errors:
+        print(f"    ✗ {t!r}: ожидали {want}, получили {got}")
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("--rounds", type=int, default=2000)
+    args = ap.parse_args()
+
+    corpus = CORPUS
+    print(f"corpus: {len(corpus)} messages")
+    _report("legacy", legacy, corpus, args.rounds)
+    _report("cold", cold, corpus, args.rounds)
+    _report("compiled", compiled, corpus, args.rounds)
+    _report("hybrid", hybrid, corpus, max(1, args.rounds // 10))
+
+
+if __name__ == "__main__":
+    main()
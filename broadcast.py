@@ -0,0 +1,183 @@
+# broadcast.py - Массовая рассылка с учётом лимитов Telegram
+
+import asyncio
+import time
+from dataclasses import dataclass
+
+from aiogram import Bot
+from aiogram.exceptions import TelegramRetryAfter, TelegramForbiddenError, TelegramNotFound
+
+import metrics
+from executors import run_db
+
+
+class TokenBucket:
+    """Асинхронное ведро токенов: rate токенов в секунду, не больше capacity подряд."""
+
+    def __init__(self, rate: float, capacity: float | None = None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else rate
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._paused_until = 0.0
+        self._lock = asyncio.Lock()
+
+    def pause(self, seconds: float):
+        """RetryAfter: останавливаем выдачу токенов всем отправителям."""
+        self._paused_until = max(self._paused_until, time.monotonic() + seconds)
+        self._tokens = 0.0
+
+    async def acquire(self):
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                if now < self._paused_until:
+                    await asyncio.sleep(self._paused_until - now)
+                    self._updated = time.monotonic()
+                    continue
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+@dataclass
+class BroadcastStats:
+    total: int = 0
+    sent: int = 0
+    failed: int = 0
+    blocked: int = 0
+    retries: int = 0
+    started: float = 0.0
+    finished: float = 0.0
+
+    @property
+    def elapsed(self) -> float:
+        return (self.finished or time.monotonic()) - self.started
+
+    @property
+    def rate(self) -> float:
+        return self.sent / self.elapsed if self.elapsed > 0 else 0.0
+
+    def __str__(self):
+        done = self.sent + self.failed + self.blocked
+        return (f"{done}/{self.total} sent={self.sent} failed={self.failed} blocked={self.blocked} "
+                f"retries={self.retries} {self.rate:.1f} msg/s in {self.elapsed:.1f}s")
+
+
+class Broadcaster:
+    """
+    Рассылка одного текста многим чатам:
+    - не больше concurrency одновременных запросов;
+    - глобальный лимит global_rate сообщений/с (у Telegram ~30/с на бота);
+    - не чаще одного сообщения в чат раз в per_chat_interval секунд;
+    - RetryAfter останавливает всю рассылку на указанное время, сообщение повторяется;
+    - успешные отправки и заблокировавшие бота пользователи сбрасываются в БД пачками.
+    """
+
+    def __init__(self, bot: Bot, global_rate: float, concurrency: int,
+                 per_chat_interval: float = 1.0, batch_size: int = 200,
+                 flush_interval: float = 2.0, max_retries: int = 3, progress_every: float = 10.0):
+        self.bot = bot
+        self.bucket = TokenBucket(global_rate)
+        self.concurrency = concurrency
+        self.per_chat_interval = per_chat_interval
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_retries = max_retries
+        self.progress_every = progress_every
+        self._last_sent: dict[int, float] = {}
+
+    async def _wait_chat(self, chat_id: int):
+        last = self._last_sent.get(chat_id)
+        if last is not None:
+            delay = last + self.per_chat_interval - time.monotonic()
+            if delay > 0:
+                await asyncio.sleep(delay)
+
+    async def _send_one(self, chat_id: int, text: str, stats: BroadcastStats) -> str:
+        for attempt in range(self.max_retries + 1):
+            await self._wait_chat(chat_id)
+            await self.bucket.acquire()
+            try:
+                await self.bot.send_message(chat_id, text)
+                self._last_sent[chat_id] = time.monotonic()
+                return "sent"
+            except TelegramRetryAfter as e:
+                stats.retries += 1
+                metrics.inc("broadcast_retry_after")
+                print(f"[broadcast] RetryAfter {e.retry_after}s (chat {chat_id})")
+                self.bucket.pause(e.retry_after)
+            except (TelegramForbiddenError, TelegramNotFound):
+                return "blocked"
+            except Exception as e:
+                print(f"[broadcast] send failed for {chat_id}: {e}")
+                return "failed"
+        return "failed"
+
+    async def send_all(self, chat_ids: list[int], text: str, on_sent=None, on_blocked=None) -> BroadcastStats:
+        """
+        on_sent(list[int]) / on_blocked(list[int]) — синхронные функции БД,
+        вызываются пачками через пул run_db (одна транзакция на пачку).
+        """
+        stats = BroadcastStats(total=len(chat_ids), started=time.monotonic())
+        queue: asyncio.Queue[int] = asyncio.Queue()
+        for cid in chat_ids:
+            queue.put_nowait(cid)
+        sent_buf: list[int] = []
+        blocked_buf: list[int] = []
+        last_flush = time.monotonic()
+
+        async def flush(force: bool = False):
+            nonlocal last_flush, sent_buf, blocked_buf
+            due = len(sent_buf) >= self.batch_size or time.monotonic() - last_flush >= self.flush_interval
+            if not (force or due):
+                return
+            sent, sent_buf = sent_buf, []
+            blocked, blocked_buf = blocked_buf, []
+            last_flush = time.monotonic()
+            if sent and on_sent:
+                await run_db(on_sent, sent)
+            if blocked and on_blocked:
+                await run_db(on_blocked, blocked)
+
+        async def worker():
+            while True:
+                try:
+                    cid = queue.get_nowait()
+                except asyncio.QueueEmpty:
+                    return
+                result = await self._send_one(cid, text, stats)
+                if result == "sent":
+                    stats.sent += 1
+                    sent_buf.append(cid)
+                elif result == "blocked":
+                    stats.blocked += 1
+                    blocked_buf.append(cid)
+                else:
+                    stats.failed += 1
+                await flush()
+
+        async def progress():
+            while True:
+                await asyncio.sleep(self.progress_every)
+                print(f"[broadcast] {stats}")
+                metrics.set_gauge("broadcast_rate", stats.rate)
+
+        reporter = asyncio.create_task(progress())
+        try:
+            await asyncio.gather(*(worker() for _ in range(min(self.concurrency, len(chat_ids)) or 1)))
+        finally:
+            reporter.cancel()
+            await flush(force=True)
+            stats.finished = time.monotonic()
+            self._last_sent.clear()
+
+        metrics.inc("broadcast_sent", stats.sent)
+        metrics.inc("broadcast_failed", stats.failed)
+        metrics.inc("broadcast_blocked", stats.blocked)
+        metrics.set_gauge("broadcast_rate", stats.rate)
+        print(f"[broadcast] done: {stats}")
+        return stats
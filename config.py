@@ -1,4 +1,5 @@
 import os
+from functools import lru_cache
 from dotenv import load_dotenv
 from openai import OpenAI
 from langchain_openai import ChatOpenAI
@@ -8,12 +9,118 @@ load_dotenv()
 
 # === Telegram ===
 TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+# Другой Bot API сервер (локальный telegram-bot-api или fake_telegram.py); пусто — api.telegram.org
+TELEGRAM_API_BASE = os.getenv("TELEGRAM_API_BASE", "")
 
 # === OpenAI / Router ===
 OPENAI_API_KEY = os.getenv("OPENAI_API_KEY")
 OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-4o-mini")
 OPENAI_TEMPERATURE = float(os.getenv("OPENAI_TEMPERATURE", 0.7))
+# structured — один вызов LLM с JSON-выбором инструмента (ReAct только как фолбэк), react — агент всегда
+ROUTER_MODE = os.getenv("ROUTER_MODE", "structured").lower()
+
+# === Пулы потоков для блокирующей работы (LLM / SQLite) ===
+LLM_WORKERS = int(os.getenv("LLM_WORKERS", 16))
+DB_WORKERS = int(os.getenv("DB_WORKERS", 4))
+
+# === Конкурентность обработки сообщений ===
+# одновременно к LLM API идут не более LLM_CONCURRENCY запросов (по всем пользователям,
+# включая фоновые); остальные потоки LLM-пула в это время заняты SQLite/парсингом или ждут слот
+LLM_CONCURRENCY = int(os.getenv("LLM_CONCURRENCY", max(1, LLM_WORKERS // 2)))
+# сообщения одного пользователя обрабатываются по очереди; USER_QUEUE_LIMIT > 0 —
+# сверх лимита сообщение отбрасывается с ответом «подожди», 0 — не теряем ничего
+USER_QUEUE_LIMIT = int(os.getenv("USER_QUEUE_LIMIT", 0))
+
+# === Администраторы (служебные команды) ===
+ADMIN_IDS = {int(x) for x in os.getenv("ADMIN_IDS", "").replace(" ", "").split(",") if x}
+
+# === Кэш оценок калорий ===
+KCAL_CACHE_SIZE = int(os.getenv("KCAL_CACHE_SIZE", 5000))
+KCAL_CACHE_TTL_DAYS = float(os.getenv("KCAL_CACHE_TTL_DAYS", 30))
+
+# === Модель плотности калорий (ккал/100 г, ккал/шт) ===
+FOOD_DENSITY_MIN_SAMPLES = int(os.getenv("FOOD_DENSITY_MIN_SAMPLES", 1))
+FOOD_DENSITY_MAX_SAMPLES = int(os.getenv("FOOD_DENSITY_MAX_SAMPLES", 50))
+
+# === Кэш пользовательских сессий ===
+SESSION_CACHE_SIZE = int(os.getenv("SESSION_CACHE_SIZE", 10000))
+SESSION_TTL_SECONDS = float(os.getenv("SESSION_TTL_SECONDS", 1800))
+
+# === Память диалогов ===
+MEMORY_MAX_USERS = int(os.getenv("MEMORY_MAX_USERS", 5000))
+MEMORY_TTL_SECONDS = float(os.getenv("MEMORY_TTL_SECONDS", 3600))
+MEMORY_MAX_MESSAGES = int(os.getenv("MEMORY_MAX_MESSAGES", 20))
+MEMORY_MAX_CHARS = int(os.getenv("MEMORY_MAX_CHARS", 8000))
+MEMORY_SWEEP_SECONDS = float(os.getenv("MEMORY_SWEEP_SECONDS", 60))  # как часто выгружать простаивающих
+
+# === История диалога в промпте агента (бюджет токенов) ===
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", 600))
+CONTEXT_MESSAGE_TOKENS = int(os.getenv("CONTEXT_MESSAGE_TOKENS", 150))
+CONTEXT_SUMMARY_TOKENS = int(os.getenv("CONTEXT_SUMMARY_TOKENS", 120))
+CONTEXT_SUMMARY_BATCH = int(os.getenv("CONTEXT_SUMMARY_BATCH", 6))
+CONTEXT_SUMMARIZE = os.getenv("CONTEXT_SUMMARIZE", "true").lower() == "true"
+
+# === Действия на подтверждении (план похудения и т.п.) ===
+PENDING_TTL_SECONDS = float(os.getenv("PENDING_TTL_SECONDS", 1800))
+PENDING_CACHE_SIZE = int(os.getenv("PENDING_CACHE_SIZE", 10000))
+PENDING_SWEEP_SECONDS = float(os.getenv("PENDING_SWEEP_SECONDS", 300))
+
+# === Рассылки (лимиты Telegram: ~30 сообщений/с на бота, 1/с в один чат) ===
+BROADCAST_RATE = float(os.getenv("BROADCAST_RATE", 25))
+BROADCAST_CONCURRENCY = int(os.getenv("BROADCAST_CONCURRENCY", 20))
+BROADCAST_BATCH = int(os.getenv("BROADCAST_BATCH", 200))
+
+# === Планировщик напоминаний: окно подгрузки из БД и период обновления (сек) ===
+REMINDER_HORIZON_SECONDS = int(os.getenv("REMINDER_HORIZON_SECONDS", 3600))
+REMINDER_REFRESH_SECONDS = int(os.getenv("REMINDER_REFRESH_SECONDS", 300))
+
+# === Локальный классификатор намерений (до ReAct-агента) ===
+INTENT_MODEL_PATH = os.getenv("INTENT_MODEL_PATH", "intent_model.json")
+INTENT_CONFIDENCE = float(os.getenv("INTENT_CONFIDENCE", 0.7))
+# ручные правила intents.RULES: совпадение с confidence ниже порога (слабое «обед …») не решает само
+RULE_CONFIDENCE = float(os.getenv("RULE_CONFIDENCE", 0.7))
+# журнал «текст → намерение» для переобучения: по умолчанию выключен (лишняя запись на каждое
+# сообщение); включённый пишет долю INTENT_LOG_SAMPLE сообщений и хранит INTENT_LOG_RETENTION_DAYS дней
+INTENT_LOG = os.getenv("INTENT_LOG", "false").lower() == "true"
+INTENT_LOG_SAMPLE = float(os.getenv("INTENT_LOG_SAMPLE", 0.2))
+INTENT_LOG_RETENTION_DAYS = float(os.getenv("INTENT_LOG_RETENTION_DAYS", 90))
+
+# === Кэш тренировок: вариантов на (длительность, уровень, цель) и срок свежести ===
+WORKOUT_POOL_SIZE = int(os.getenv("WORKOUT_POOL_SIZE", 3))
+WORKOUT_TTL_DAYS = float(os.getenv("WORKOUT_TTL_DAYS", 14))
+
+# === Потоковые ответы (правка сообщения по мере генерации) ===
+STREAM_REPLIES = os.getenv("STREAM_REPLIES", "true").lower() == "true"
+# Telegram ограничивает частоту edit_message_text — не чаще раза в STREAM_EDIT_INTERVAL секунд
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+# Заглушка «Думаю…», если первый токен не пришёл за это время
+STREAM_PLACEHOLDER_DELAY = float(os.getenv("STREAM_PLACEHOLDER_DELAY", "0.5"))
+
+# === Приём обновлений: polling (разработка) или webhook (приёмник + процессы-воркеры) ===
+BOT_MODE = os.getenv("BOT_MODE", "polling").lower()
+# публичный https-адрес для setWebhook; пусто — webhook не регистрируем (уже настроен / тесты)
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram/webhook")
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", 8080))
+WEBHOOK_WORKERS = int(os.getenv("WEBHOOK_WORKERS", 4))
+# очередь на воркер; при переполнении отвечаем 503 — Telegram повторит доставку позже
+WEBHOOK_QUEUE_SIZE = int(os.getenv("WEBHOOK_QUEUE_SIZE", 1000))
+
+# === Шарды: процессы-воркеры по hash(user_id) % BOT_SHARDS (polling; 1 — всё в одном процессе) ===
+BOT_SHARDS = int(os.getenv("BOT_SHARDS", 1))
+SHARD_QUEUE_SIZE = int(os.getenv("SHARD_QUEUE_SIZE", 1000))
+# как часто супервизор проверяет, живы ли воркеры (сек)
+SHARD_CHECK_SECONDS = float(os.getenv("SHARD_CHECK_SECONDS", "1.0"))
+
+# === Групповая запись в SQLite (repository.py): один писатель, commit пачками ===
+REPO_GROUP_COMMIT = os.getenv("REPO_GROUP_COMMIT", "true").lower() == "true"
+REPO_BATCH_MAX = int(os.getenv("REPO_BATCH_MAX", 64))
+# сколько ждать попутчиков после первой записи в пачке; 0 — берём только то, что накопилось,
+# пока шёл предыдущий commit (при 16 потоках-писателях это быстрее и ровнее фиксированного окна)
+REPO_COMMIT_INTERVAL_MS = float(os.getenv("REPO_COMMIT_INTERVAL_MS", "0"))
 
 # === LangSmith (опционально для трейсинга) ===
 LANGSMITH_TRACING = os.getenv("LANGSMITH_TRACING", "false").lower() == "true"
@@ -24,6 +131,21 @@ if LANGSMITH_TRACING and LANGSMITH_API_KEY:
     os.environ["LANGSMITH_TRACING"] = "true"
     os.environ["LANGSMITH_API_KEY"] = LANGSMITH_API_KEY
 
+# Бот Telegram (при TELEGRAM_API_BASE — через указанный Bot API сервер)
+def create_bot():
+    from aiogram import Bot
+    from aiogram.client.default import DefaultBotProperties
+    from aiogram.client.session.aiohttp import AiohttpSession
+    from aiogram.client.telegram import TelegramAPIServer
+    from aiogram.enums import ParseMode
+
+    session = AiohttpSession(api=TelegramAPIServer.from_base(TELEGRAM_API_BASE)) if TELEGRAM_API_BASE else None
+    return Bot(
+        token=TELEGRAM_BOT_TOKEN,
+        session=session,
+        default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN),
+    )
+
 # Клиент OpenAI (старый способ для совместимости)
 def openai_client():
     return OpenAI(
@@ -32,11 +154,14 @@ def openai_client():
     )
 
 # LangChain LLM (новый способ)
-def get_llm():
-    """Создает и возвращает экземпляр LangChain LLM"""
+@lru_cache(maxsize=2)
+def get_llm(streaming: bool = False):
+    """Возвращает общий экземпляр LangChain LLM (один HTTP-клиент, соединения переиспользуются).
+    streaming=True — отдельный экземпляр, отдающий токены в callbacks (on_llm_new_token)."""
     return ChatOpenAI(
         api_key=OPENAI_API_KEY,
         base_url=OPENAI_BASE_URL,
         model=OPENAI_MODEL,
         temperature=OPENAI_TEMPERATURE,
+        streaming=streaming,
     )
\ No newline at end of file
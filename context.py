@@ -0,0 +1,232 @@
+# context.py - Сборка истории диалога для промпта агента в рамках бюджета токенов
+
+import hashlib
+import threading
+from collections import OrderedDict
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+import metrics
+from agent import call_ai
+from config import (
+    OPENAI_MODEL,
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_MESSAGE_TOKENS,
+    CONTEXT_SUMMARY_TOKENS,
+    CONTEXT_SUMMARY_BATCH,
+    CONTEXT_SUMMARIZE,
+)
+
+try:
+    import tiktoken
+except ImportError:  # tiktoken ставится вместе с langchain-openai, но не обязателен
+    tiktoken = None
+
+_enc = None
+_enc_loaded = False
+
+
+def _encoding():
+    """Токенизатор грузится лениво: tiktoken скачивает словарь при первом обращении и может быть недоступен."""
+    global _enc, _enc_loaded
+    if not _enc_loaded:
+        _enc_loaded = True
+        if tiktoken is not None:
+            try:
+                try:
+                    _enc = tiktoken.encoding_for_model(OPENAI_MODEL)
+                except KeyError:
+                    _enc = tiktoken.get_encoding("cl100k_base")
+            except Exception as e:
+                print(f"[CONTEXT] tiktoken unavailable, using len/4 estimate: {e}")
+    return _enc
+
+
+def count_tokens(text: str) -> int:
+    if not text:
+        return 0
+    enc = _encoding()
+    if enc is not None:
+        return len(enc.encode(text, disallowed_special=()))
+    return max(1, len(text) // 4)
+
+
+def _truncate(text: str, max_tokens: int) -> str:
+    if count_tokens(text) <= max_tokens:
+        return text
+    enc = _encoding()
+    if enc is not None:
+        return enc.decode(enc.encode(text, disallowed_special=())[:max_tokens]) + "…"
+    return text[: max_tokens * 4] + "…"
+
+
+def _line(message) -> str:
+    who = "Пользователь" if message.type == "human" else "Ассистент"
+    return f"{who}: {message.content}"
+
+
+def _fingerprint(message) -> str:
+    return hashlib.blake2b(f"{message.type}:{message.content}".encode("utf-8"), digest_size=8).hexdigest()
+
+
+class ContextAssembler:
+    """
+    Последние реплики — целиком (каждая не длиннее message_tokens), пока влезают в бюджет.
+    Всё, что старше, — в краткое резюме: оно накапливается инкрементально
+    (прошлое резюме + вытесненные реплики) и кэшируется на пользователя,
+    поэтому LLM для сжатия вызывается не чаще раза в summary_batch вытесненных сообщений.
+    """
+
+    def __init__(self, budget: int, message_tokens: int, summary_tokens: int,
+                 summary_batch: int, summarize: bool, max_users: int = 10000):
+        self.budget = budget
+        self.message_tokens = message_tokens
+        self.summary_tokens = summary_tokens
+        self.summary_batch = summary_batch
+        self.summarize = summarize
+        self.max_users = max_users
+        # user_id -> (резюме, отпечаток последнего учтённого сообщения)
+        self._summaries: OrderedDict[int, tuple[str, str]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _summarize(self, user_id: int, previous: str, messages: list) -> str:
+        text = "\n".join(_truncate(_line(m), self.message_tokens) for m in messages)
+        prompt = (
+            (f"Текущее резюме:\n{previous}\n\n" if previous else "")
+            + f"Новые реплики:\n{text}\n\n"
+            "Обнови резюме: факты о пользователе, его цели, что он ел и о чём договорились."
+        )
+        try:
+            resp = call_ai(
+                user_id, prompt,
+                system=f"Ты сжимаешь историю диалога фитнес-бота. Не больше {self.summary_tokens} токенов, без вступлений.",
+                temperature=0,
+            )
+            metrics.inc("context_summaries")
+            return _truncate(resp.get("response", ""), self.summary_tokens)
+        except Exception as e:
+            print(f"[CONTEXT] summary failed: {e}")
+            return _truncate(f"{previous}\n{text}".strip(), self.summary_tokens)
+
+    @staticmethod
+    def _unsummarized(messages: list, cut: int, last_fp: str) -> int:
+        """
+        Индекс первого вытесненного сообщения, ещё не вошедшего в резюме.
+        Последнее учтённое ищется по всей истории, а не только среди вытесненных:
+        - оно среди вытесненных — новое всё, что после него;
+        - оно в свежем окне (окно выросло) — всё вытесненное уже в резюме, нового нет;
+        - его нет вовсе — история обрезана с головы (memory_store._trim), и всё
+          оставшееся новее него.
+        """
+        if not last_fp:
+            return 0
+        fps = [_fingerprint(m) for m in messages]
+        for i in range(cut - 1, -1, -1):
+            if fps[i] == last_fp:
+                return i + 1
+        return cut if last_fp in fps[cut:] else 0
+
+    def _older_summary(self, user_id: int, messages: list, cut: int) -> tuple[str, list]:
+        """Резюме для вытесненных messages[:cut] + хвост, ещё не вошедший в резюме."""
+        with self._lock:
+            summary, last_fp = self._summaries.get(user_id, ("", ""))
+        pending = messages[self._unsummarized(messages, cut, last_fp):cut]
+        if not pending:
+            return summary, []
+        if not self.summarize or len(pending) < self.summary_batch:
+            return summary, pending
+        summary = self._summarize(user_id, summary, pending)
+        with self._lock:
+            self._summaries[user_id] = (summary, _fingerprint(pending[-1]))
+            self._summaries.move_to_end(user_id)
+            while len(self._summaries) > self.max_users:
+                self._summaries.popitem(last=False)
+        return summary, []
+
+    def build(self, user_id: int, messages: list) -> tuple[str, int]:
+        """Возвращает (текст истории для промпта, его размер в токенах)."""
+        # место под строку «Ранее (кратко): …» резервируем заранее
+        recent_budget = self.budget - (self.summary_tokens + 8 if len(messages) > 2 else 0)
+        recent: list[str] = []
+        used = 0
+        cut = len(messages)
+        for m in reversed(messages):
+            line = _truncate(_line(m), self.message_tokens)
+            n = count_tokens(line)
+            if used + n > recent_budget:
+                break
+            recent.append(line)
+            used += n
+            cut -= 1
+        recent.reverse()
+
+        parts = []
+        if cut > 0:
+            summary, tail = self._older_summary(user_id, messages, cut)
+            if summary:
+                parts.append(f"Ранее (кратко): {summary}")
+                used += count_tokens(parts[-1])
+            # вытесненные, но ещё не сжатые — в усечённом виде, если осталось место
+            for m in tail:
+                line = _truncate(_line(m), max(self.message_tokens // 4, 16))
+                n = count_tokens(line)
+                if used + n > self.budget:
+                    break
+                parts.append(line)
+                used += n
+        parts.extend(recent)
+
+        text = "\n".join(parts)
+        tokens = count_tokens(text)
+        metrics.observe("context_history_tokens", tokens)
+        return text, tokens
+
+    def forget(self, user_id: int):
+        with self._lock:
+            self._summaries.pop(user_id, None)
+
+
+class PromptTokenCounter(BaseCallbackHandler):
+    """
+    Считает prompt/completion токены по ответам LLM за один вызов агента.
+    Потоковый LLM (get_llm(streaming=True), путь по умолчанию) не отдаёт token_usage —
+    тогда токены считаются локально по тексту промпта и ответа (count_tokens).
+    """
+
+    def __init__(self):
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+        self.calls = 0
+        self._prompts: dict = {}  # run_id → локальная оценка промпта
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._prompts[run_id] = sum(count_tokens(str(m.content)) for batch in messages for m in batch)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._prompts[run_id] = sum(count_tokens(p) for p in prompts)
+
+    def on_llm_end(self, response, *, run_id=None, **kwargs):
+        prompt_estimate = self._prompts.pop(run_id, 0)
+        usage = (response.llm_output or {}).get("token_usage") or {}
+        if usage:
+            self.prompt_tokens += int(usage.get("prompt_tokens") or 0)
+            self.completion_tokens += int(usage.get("completion_tokens") or 0)
+        else:
+            metrics.inc("agent_tokens_estimated")
+            self.prompt_tokens += prompt_estimate
+            self.completion_tokens += sum(count_tokens(g.text) for gens in response.generations for g in gens)
+        self.calls += 1
+
+    def report(self):
+        metrics.observe("agent_prompt_tokens", self.prompt_tokens)
+        metrics.observe("agent_completion_tokens", self.completion_tokens)
+        metrics.observe("agent_llm_calls", self.calls)
+
+
+context_assembler = ContextAssembler(
+    CONTEXT_TOKEN_BUDGET,
+    CONTEXT_MESSAGE_TOKENS,
+    CONTEXT_SUMMARY_TOKENS,
+    CONTEXT_SUMMARY_BATCH,
+    CONTEXT_SUMMARIZE,
+)
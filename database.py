@@ -1,19 +1,166 @@
+import heapq
+import os
 import sqlite3
-from datetime import datetime
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from itertools import chain
 
 DB_PATH = "fitness.db"
 
+# Данные пользователей раскладываются по DB_SHARDS файлам по hash(user_id) % DB_SHARDS:
+# шард 0 — сам DB_PATH, остальные — fitness.1.db, fitness.2.db, ... У каждого файла свой
+# писатель, поэтому записи разных пользователей не ждут одну блокировку. Общие таблицы
+# (kcal_cache, food_density, workout_cache) живут только в DB_PATH.
+# Читается здесь, а не в config.py: database.py не тянет LangChain (утилиты, бенчмарки).
+DB_SHARDS = max(1, int(os.getenv("DB_SHARDS", 1)))
+
+# Таблицы с данными пользователя (лежат в его шарде)
+USER_TABLES = ["users", "weights", "meals", "daily_totals", "goals", "settings",
+               "conversation_memory", "pending_actions", "intent_log"]
+
+# Кэш подготовленных выражений на соединение (sqlite3 держит его по тексту SQL)
+STATEMENT_CACHE_SIZE = 256
+
+_local = threading.local()
+
 
 # ---------- базовые функции ----------
 
-def get_conn():
-    return sqlite3.connect(DB_PATH, check_same_thread=False)
+def _open_conn(path: str) -> sqlite3.Connection:
+    conn = sqlite3.connect(
+        path,
+        check_same_thread=False,
+        timeout=30.0,
+        cached_statements=STATEMENT_CACHE_SIZE,
+    )
+    # WAL: читатели не блокируют писателя; NORMAL: fsync на checkpoint, а не на каждый commit
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA temp_store=MEMORY")
+    conn.execute("PRAGMA cache_size=-16000")
+    return conn
 
 
-def init_db():
-    conn = get_conn()
+def shard_of_user(user_id: int) -> int:
+    """Номер шарда БД; при BOT_SHARDS == DB_SHARDS совпадает с процессом-шардом (shards.shard_of)."""
+    return hash(user_id) % DB_SHARDS if DB_SHARDS > 1 else 0
+
+
+def shard_path(shard: int) -> str:
+    if shard == 0:
+        return DB_PATH
+    root, ext = os.path.splitext(DB_PATH)
+    return f"{root}.{shard}{ext}"
+
+
+def user_db(user_id: int) -> str:
+    """Файл БД, в котором лежат данные пользователя."""
+    return shard_path(shard_of_user(user_id))
+
+
+def all_db_paths() -> list[str]:
+    return [shard_path(i) for i in range(DB_SHARDS)]
+
+
+def group_by_db(user_ids) -> dict[str, list[int]]:
+    groups: dict[str, list[int]] = {}
+    for uid in user_ids:
+        groups.setdefault(user_db(uid), []).append(uid)
+    return groups
+
+
+def open_writer_conn(path: str | None = None) -> sqlite3.Connection:
+    """
+    Соединение группового писателя (repository.py): транзакции открываются вручную
+    (BEGIN IMMEDIATE), synchronous=FULL — commit переживает сбой питания, а fsync
+    делится на всю пачку записей.
+    """
+    conn = _open_conn(path or DB_PATH)
+    conn.isolation_level = None
+    conn.execute("PRAGMA synchronous=FULL")
+    return conn
+
+
+def get_conn(path: str | None = None) -> sqlite3.Connection:
+    """
+    Долгоживущее соединение текущего потока (отдельное на каждый файл БД, по умолчанию DB_PATH).
+    Не закрывать вручную — см. close_conn().
+    """
+    path = path or DB_PATH
+    conns = getattr(_local, "conns", None)
+    if conns is None:
+        conns = _local.conns = {}
+    conn = conns.get(path)
+    if conn is None:
+        conn = conns[path] = _open_conn(path)
+    return conn
+
+
+def close_conn():
+    """Закрывает соединения текущего потока (например, при остановке воркера)."""
+    for conn in getattr(_local, "conns", {}).values():
+        conn.close()
+    _local.conns = {}
+
+
+@contextmanager
+def transaction(path: str | None = None):
+    """
+    Транзакция на соединении потока к файлу path (по умолчанию DB_PATH; данные
+    пользователя — transaction(user_db(user_id))): commit при выходе, rollback при ошибке.
+    Вложенные вызовы на тот же файл входят во внешнюю транзакцию и коммитятся вместе с ней.
+    """
+    path = path or DB_PATH
+    conn = get_conn(path)
+    depth = getattr(_local, "depth", None)
+    if depth is None:
+        depth = _local.depth = {}
+    level = depth.get(path, 0)
+    depth[path] = level + 1
     c = conn.cursor()
+    try:
+        yield c
+        if level == 0:
+            conn.commit()
+    except BaseException:
+        if level == 0:
+            conn.rollback()
+        raise
+    finally:
+        depth[path] = level
+        c.close()
+
+
+def in_transaction(path: str | None = None) -> bool:
+    """Открыта ли в текущем потоке transaction() на path (записи внутри неё коммитятся вместе с ней)."""
+    return getattr(_local, "depth", {}).get(path or DB_PATH, 0) > 0
+
+
+@contextmanager
+def cursor(path: str | None = None):
+    """Курсор для чтения на соединении потока (по умолчанию к DB_PATH)."""
+    c = get_conn(path).cursor()
+    try:
+        yield c
+    finally:
+        c.close()
+
+
+def init_db():
+    """Схема и миграции — в каждом шарде; общие таблицы — только в DB_PATH."""
+    for path in all_db_paths():
+        with transaction(path) as c:
+            _init_user_tables(c)
+            if path == DB_PATH:
+                _init_shared_tables(c)
+    _reshard_if_needed()
+    if DB_SHARDS > 1:
+        print(f"✓ БД: {DB_SHARDS} шардов ({', '.join(all_db_paths())})")
+    print("✓ Инициализирую БД...")
+
 
+def _init_user_tables(c):
     # Пользователи
     c.execute("""
         CREATE TABLE IF NOT EXISTS users (
@@ -72,16 +219,186 @@ def init_db():
         )
     """)
 
-    conn.commit()
-    conn.close()
-    print("✓ Инициализирую БД...")
+    # Когда пользователю пора напомнить о взвешивании (поддерживается при записи веса/напоминания)
+    c.execute("PRAGMA table_info(settings)")
+    if "next_reminder_due" not in {row[1] for row in c.fetchall()}:
+        c.execute("ALTER TABLE settings ADD COLUMN next_reminder_due TEXT")
+    c.execute("SELECT user_id FROM settings WHERE next_reminder_due IS NULL")
+    for (uid,) in c.fetchall():
+        _refresh_reminder_due(c, uid)
+    c.execute("""
+        CREATE INDEX IF NOT EXISTS idx_settings_reminder_due
+        ON settings(next_reminder_due) WHERE remind_weekly = 1
+    """)
+
+    # Индексы для выборок «пользователь + период» (дневные суммы, последний вес)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_meals_user_created ON meals(user_id, created_at)")
+    c.execute("CREATE INDEX IF NOT EXISTS idx_weights_user_created ON weights(user_id, created_at)")
+
+    # Дневные итоги по питанию (обновляются вместе с meals в одной транзакции)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS daily_totals (
+            user_id INTEGER,
+            day TEXT,
+            kcal INTEGER DEFAULT 0,
+            meal_count INTEGER DEFAULT 0,
+            updated_at TEXT,
+            PRIMARY KEY (user_id, day)
+        ) WITHOUT ROWID
+    """)
+    c.execute("SELECT EXISTS(SELECT 1 FROM daily_totals), EXISTS(SELECT 1 FROM meals)")
+    has_totals, has_meals = c.fetchone()
+    if has_meals and not has_totals:
+        # первый запуск после миграции — заполняем итоги из истории
+        _rebuild_daily_totals(c)
+
+    # Действия, ждущие подтверждения пользователя
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS pending_actions (
+            user_id INTEGER PRIMARY KEY,
+            type TEXT,
+            payload TEXT,
+            expires_at TEXT
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_pending_expires ON pending_actions(expires_at)")
+
+    # Выгруженная память диалогов (JSON сообщений LangChain)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS conversation_memory (
+            user_id INTEGER PRIMARY KEY,
+            messages TEXT,
+            updated_at TEXT
+        )
+    """)
+
+    # Журнал маршрутизации: текст → намерение (правила / выбор инструмента агентом),
+    # обучающие данные для локального классификатора намерений
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS intent_log (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            text TEXT,
+            intent TEXT,
+            source TEXT,
+            created_at TEXT
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_intent_log_created ON intent_log(created_at)")
+
+
+def _init_shared_tables(c):
+    # Пул готовых тренировок по (длительность, уровень, цель)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS workout_cache (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            cache_key TEXT NOT NULL,
+            workout TEXT NOT NULL,
+            created_at TEXT NOT NULL
+        )
+    """)
+    c.execute("CREATE INDEX IF NOT EXISTS idx_workout_cache_key ON workout_cache(cache_key, created_at)")
+
+    # Кэш AI-оценок калорий (ключ: нормализованное описание + количество)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS kcal_cache (
+            cache_key TEXT PRIMARY KEY,
+            calories INTEGER,
+            created_at TEXT
+        )
+    """)
+
+    # Плотность калорий по продуктам (обучается на ответах LLM и истории meals)
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS food_density (
+            food TEXT PRIMARY KEY,
+            kcal_100g REAL,
+            n_g INTEGER DEFAULT 0,
+            kcal_100ml REAL,
+            n_ml INTEGER DEFAULT 0,
+            kcal_pc REAL,
+            n_pc INTEGER DEFAULT 0,
+            updated_at TEXT
+        )
+    """)
+
+    # Служебные значения (число шардов при прошлом запуске)
+    c.execute("CREATE TABLE IF NOT EXISTS db_meta (key TEXT PRIMARY KEY, value TEXT)")
+
+
+def _reshard_if_needed():
+    """
+    DB_SHARDS изменился с прошлого запуска — переносит пользователей в их новые шарды
+    (в том числе из файлов, которых при новом DB_SHARDS уже нет).
+    """
+    with cursor() as c:
+        c.execute("SELECT value FROM db_meta WHERE key='shards'")
+        row = c.fetchone()
+    prev = int(row[0]) if row else 1
+    if row and prev == DB_SHARDS:
+        return
+    if prev != DB_SHARDS:
+        moved = 0
+        for i in range(max(prev, DB_SHARDS)):
+            if os.path.exists(shard_path(i)):
+                moved += _move_foreign_users(shard_path(i))
+        print(f"[DB] reshard {prev} → {DB_SHARDS}: moved {moved} users")
+    with transaction() as c:
+        c.execute("INSERT OR REPLACE INTO db_meta (key, value) VALUES ('shards', ?)", (str(DB_SHARDS),))
+
+
+def _move_foreign_users(src: str, chunk: int = 500) -> int:
+    """
+    Переносит из файла src пользователей, чей шард теперь другой. Возвращает их число.
+    Пачка пишется в целевой файл и удаляется из src одной транзакцией через ATTACH;
+    в WAL такой commit атомарен по каждому файлу, но не по двум сразу — после сбоя
+    посреди переноса стоит запустить check_daily_totals(repair=True).
+    """
+    conn = _open_conn(src)
+    try:
+        rows = conn.execute(" UNION ".join(f"SELECT user_id FROM {t}" for t in USER_TABLES)).fetchall()
+        foreign = [uid for (uid,) in rows if uid is not None and user_db(uid) != src]
+        columns = {
+            t: [r[1] for r in conn.execute(f"PRAGMA table_info({t})") if r[1] != "id"]
+            for t in USER_TABLES
+        }
+        for dst, uids in group_by_db(foreign).items():
+            conn.execute("ATTACH DATABASE ? AS dst", (dst,))
+            try:
+                for i in range(0, len(uids), chunk):
+                    part = uids[i:i + chunk]
+                    marks = ",".join("?" * len(part))
+                    with conn:
+                        for t in USER_TABLES:
+                            cols = ", ".join(columns[t])
+                            conn.execute(
+                                f"INSERT OR REPLACE INTO dst.{t} ({cols}) "
+                                f"SELECT {cols} FROM main.{t} WHERE user_id IN ({marks})", part
+                            )
+                            conn.execute(f"DELETE FROM main.{t} WHERE user_id IN ({marks})", part)
+            finally:
+                conn.execute("DETACH DATABASE dst")
+        return len(foreign)
+    finally:
+        conn.close()
+
+
+def _day_bounds(day=None) -> tuple[str, str]:
+    """
+    Границы дня для created_at (ISO-строки сравниваются лексикографически):
+    [«2024-05-01», «2024-05-02») — вместо LIKE '2024-05-01%', чтобы работал индекс.
+    """
+    d = day or datetime.now().date()
+    return d.isoformat(), (d + timedelta(days=1)).isoformat()
 
 
 # ---------- операции с пользователями ----------
 
-def create_user_if_not_exists(user_id: int, name=None, age=None, weight=None, height=None):
-    conn = get_conn()
-    c = conn.cursor()
+# Запись разбита на два уровня: insert_*/upsert_*/touch_*/take_*(c, ...) выполняют SQL
+# на курсоре внутри чужой транзакции (их же пачками коммитит repository.py), а
+# save_*/put_*/set_*/update_* оборачивают их в собственную transaction() для синхронных вызовов.
+
+def insert_user_if_not_exists(c, user_id: int, name=None, age=None, weight=None, height=None):
     c.execute("SELECT user_id FROM users WHERE user_id=?", (user_id,))
     exists = c.fetchone()
     if not exists:
@@ -90,34 +407,31 @@ def create_user_if_not_exists(user_id: int, name=None, age=None, weight=None, he
             (user_id, name, age, weight, height, datetime.now().isoformat())
         )
         # настройки по умолчанию
-        c.execute("INSERT OR IGNORE INTO settings (user_id, remind_weekly, last_weighin_reminder_at) VALUES (?, 1, NULL)", (user_id,))
-        conn.commit()
+        c.execute("INSERT OR IGNORE INTO settings (user_id, remind_weekly, last_weighin_reminder_at, next_reminder_due) VALUES (?, 1, NULL, ?)", (user_id, datetime.now().isoformat()))
         print(f"[DB] created user {user_id}")
     else:
         # гарантируем наличие настроек
-        c.execute("INSERT OR IGNORE INTO settings (user_id, remind_weekly, last_weighin_reminder_at) VALUES (?, 1, NULL)", (user_id,))
-        conn.commit()
-    conn.close()
+        c.execute("INSERT OR IGNORE INTO settings (user_id, remind_weekly, last_weighin_reminder_at, next_reminder_due) VALUES (?, 1, NULL, ?)", (user_id, datetime.now().isoformat()))
+
+
+def create_user_if_not_exists(user_id: int, name=None, age=None, weight=None, height=None):
+    with transaction(user_db(user_id)) as c:
+        insert_user_if_not_exists(c, user_id, name=name, age=age, weight=weight, height=height)
 
 
 def delete_user_by_id(user_id: int):
-    conn = get_conn()
-    c = conn.cursor()
-    for table in ["users", "weights", "meals", "goals", "settings"]:
-        c.execute(f"DELETE FROM {table} WHERE user_id=?", (user_id,))
-    conn.commit()
-    conn.close()
+    with transaction(user_db(user_id)) as c:
+        for table in USER_TABLES:
+            c.execute(f"DELETE FROM {table} WHERE user_id=?", (user_id,))
     print(f"[DB] deleted user {user_id} and related data")
 
 
 def get_user_data(user_id: int) -> dict:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT name, age, weight, height, goal_calories FROM users WHERE user_id=?", (user_id,))
-    row = c.fetchone()
-    # калории за сегодня
-    today_cals = get_today_calories(user_id)
-    conn.close()
+    with cursor(user_db(user_id)) as c:
+        c.execute("SELECT name, age, weight, height, goal_calories FROM users WHERE user_id=?", (user_id,))
+        row = c.fetchone()
+        # калории за сегодня
+        today_cals = get_today_calories(user_id)
     if not row:
         return {}
     return {
@@ -132,115 +446,546 @@ def get_user_data(user_id: int) -> dict:
 
 # ---------- вес ----------
 
-def save_user_weight(user_id: int, weight: float):
-    conn = get_conn()
-    c = conn.cursor()
+def insert_user_weight(c, user_id: int, weight: float):
     c.execute("INSERT INTO weights (user_id, weight, created_at) VALUES (?, ?, ?)",
               (user_id, weight, datetime.now().isoformat()))
     c.execute("UPDATE users SET weight=? WHERE user_id=?", (weight, user_id))
-    conn.commit()
-    conn.close()
+    _refresh_reminder_due(c, user_id)
     print(f"[DB] saved weight {weight} for {user_id}")
 
 
-def get_last_weight_dt(user_id: int) -> str | None:
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("SELECT MAX(created_at) FROM weights WHERE user_id=?", (user_id,))
-    row = c.fetchone()
-    conn.close()
-    return row[0] if row and row[0] else None
+def save_user_weight(user_id: int, weight: float):
+    with transaction(user_db(user_id)) as c:
+        insert_user_weight(c, user_id, weight)
 
 
 # ---------- приёмы пищи ----------
 
-def save_meal_entry(user_id: int, description: str, calories: int):
-    conn = get_conn()
-    c = conn.cursor()
+_UPSERT_DAILY_TOTAL = """
+    INSERT INTO daily_totals (user_id, day, kcal, meal_count, updated_at) VALUES (?, ?, ?, ?, ?)
+    ON CONFLICT (user_id, day) DO UPDATE SET
+        kcal = kcal + excluded.kcal,
+        meal_count = meal_count + excluded.meal_count,
+        updated_at = excluded.updated_at
+"""
+
+
+def insert_meal_entry(c, user_id: int, description: str, calories: int):
+    now = datetime.now().isoformat()
     c.execute(
         "INSERT INTO meals (user_id, description, calories, created_at) VALUES (?, ?, ?, ?)",
-        (user_id, description, calories, datetime.now().isoformat())
+        (user_id, description, calories, now)
     )
-    conn.commit()
-    conn.close()
+    c.execute(_UPSERT_DAILY_TOTAL, (user_id, now[:10], calories, 1, now))
     print(f"[DB] meal logged {description} ({calories} ккал) for {user_id}")
 
 
-def get_today_calories(user_id: int) -> int:
-    conn = get_conn()
-    c = conn.cursor()
-    today = datetime.now().date().isoformat()
-    c.execute(
-        "SELECT SUM(calories) FROM meals WHERE user_id=? AND created_at LIKE ?",
-        (user_id, f"{today}%")
+def save_meal_entry(user_id: int, description: str, calories: int):
+    with transaction(user_db(user_id)) as c:
+        insert_meal_entry(c, user_id, description, calories)
+
+
+def insert_meal_entries(c, user_id: int, items: list[tuple[str, int]]):
+    """Несколько позиций одного приёма пищи: executemany + одно обновление daily_totals."""
+    if not items:
+        return
+    now = datetime.now().isoformat()
+    c.executemany(
+        "INSERT INTO meals (user_id, description, calories, created_at) VALUES (?, ?, ?, ?)",
+        [(user_id, description, calories, now) for description, calories in items]
     )
-    res = c.fetchone()
-    conn.close()
-    return int(res[0] or 0)
+    total = sum(int(calories) for _, calories in items)
+    c.execute(_UPSERT_DAILY_TOTAL, (user_id, now[:10], total, len(items), now))
+    print(f"[DB] meal logged {len(items)} items ({total} ккал) for {user_id}")
+
+
+def save_meal_entries(user_id: int, items: list[tuple[str, int]]):
+    """Несколько позиций одного приёма пищи — одна транзакция."""
+    if not items:
+        return
+    with transaction(user_db(user_id)) as c:
+        insert_meal_entries(c, user_id, items)
+
+
+def get_today_calories(user_id: int) -> int:
+    """Сумма за сегодня — точечный поиск по первичному ключу daily_totals."""
+    with cursor(user_db(user_id)) as c:
+        c.execute(
+            "SELECT kcal FROM daily_totals WHERE user_id=? AND day=?",
+            (user_id, datetime.now().date().isoformat())
+        )
+        res = c.fetchone()
+    return int(res[0] or 0) if res else 0
+
+
+def get_calorie_summary(user_id: int, days: int) -> dict:
+    """
+    Сводка за последние days дней (включая сегодня) по daily_totals:
+    {"days": [(day, kcal, meal_count), ...], "total": ..., "meals": ..., "logged_days": ...}
+    """
+    start = (datetime.now().date() - timedelta(days=days - 1)).isoformat()
+    with cursor(user_db(user_id)) as c:
+        c.execute(
+            "SELECT day, kcal, meal_count FROM daily_totals WHERE user_id=? AND day >= ? ORDER BY day",
+            (user_id, start)
+        )
+        rows = c.fetchall()
+    return {
+        "days": rows,
+        "total": sum(r[1] for r in rows),
+        "meals": sum(r[2] for r in rows),
+        "logged_days": sum(1 for r in rows if r[2]),
+    }
+
+
+def _rebuild_daily_totals(c, user_id: int | None = None):
+    where, args = ("WHERE user_id=?", (user_id,)) if user_id is not None else ("", ())
+    c.execute(f"DELETE FROM daily_totals {where}", args)
+    c.execute(f"""
+        INSERT INTO daily_totals (user_id, day, kcal, meal_count, updated_at)
+        SELECT user_id, substr(created_at, 1, 10), COALESCE(SUM(calories), 0), COUNT(*), ?
+        FROM meals {where}
+        GROUP BY user_id, substr(created_at, 1, 10)
+    """, (datetime.now().isoformat(), *args))
+
+
+def rebuild_daily_totals(user_id: int | None = None):
+    """Пересобирает daily_totals из meals (для всех — по каждому шарду — или одного пользователя)."""
+    paths = [user_db(user_id)] if user_id is not None else all_db_paths()
+    for path in paths:
+        with transaction(path) as c:
+            _rebuild_daily_totals(c, user_id)
+    print(f"[DB] daily_totals rebuilt (user={user_id if user_id is not None else 'all'})")
+
+
+def check_daily_totals(repair: bool = False) -> list[tuple[int, str]]:
+    """
+    Сверяет daily_totals с агрегатами по meals (в каждом шарде). Возвращает расхождения
+    (user_id, day); при repair=True пересобирает итоги затронутых пользователей.
+    """
+    bad = []
+    for path in all_db_paths():
+        bad.extend(_check_daily_totals(path))
+    if bad:
+        print(f"[DB] daily_totals mismatches: {len(bad)}")
+    if repair:
+        for path, uids in group_by_db(sorted({u for u, _ in bad})).items():
+            with transaction(path) as c:
+                for uid in uids:
+                    _rebuild_daily_totals(c, uid)
+            print(f"[DB] daily_totals rebuilt for {len(uids)} users in {path}")
+    return bad
+
+
+def _check_daily_totals(path: str) -> list[tuple[int, str]]:
+    with cursor(path) as c:
+        c.execute("""
+            WITH m AS (
+                SELECT user_id, substr(created_at, 1, 10) AS day,
+                       COALESCE(SUM(calories), 0) AS kcal, COUNT(*) AS n
+                FROM meals
+                GROUP BY user_id, day
+            )
+            SELECT m.user_id, m.day FROM m
+            LEFT JOIN daily_totals d ON d.user_id = m.user_id AND d.day = m.day
+            WHERE d.user_id IS NULL OR d.kcal != m.kcal OR d.meal_count != m.n
+            UNION
+            SELECT d.user_id, d.day FROM daily_totals d
+            WHERE NOT EXISTS (SELECT 1 FROM m WHERE m.user_id = d.user_id AND m.day = d.day)
+        """)
+        return c.fetchall()
 
 
 # ---------- цели ----------
 
-def save_goal(user_id: int, goal_text: str, calories: int, proteins: int, carbs: int, fats: int, weeks: int):
-    conn = get_conn()
-    c = conn.cursor()
+def insert_goal(c, user_id: int, goal_text: str, calories: int, proteins: int, carbs: int, fats: int, weeks: int):
     c.execute(
         """INSERT INTO goals (user_id, goal_text, calories, proteins, carbs, fats, weeks, created_at)
            VALUES (?, ?, ?, ?, ?, ?, ?, ?)""",
         (user_id, goal_text, calories, proteins, carbs, fats, weeks, datetime.now().isoformat())
     )
     c.execute("UPDATE users SET goal_calories=? WHERE user_id=?", (calories, user_id))
-    conn.commit()
-    conn.close()
     print(f"[DB] saved goal for {user_id}: {goal_text}")
 
 
+def save_goal(user_id: int, goal_text: str, calories: int, proteins: int, carbs: int, fats: int, weeks: int):
+    with transaction(user_db(user_id)) as c:
+        insert_goal(c, user_id, goal_text, calories, proteins, carbs, fats, weeks)
+
+
 # ---------- напоминания раз в неделю ----------
 
-def set_remind_weekly(user_id: int, enabled: bool):
-    conn = get_conn()
-    c = conn.cursor()
+REMIND_AFTER_WEIGHT = timedelta(days=7)
+REMIND_AFTER_REMINDER = timedelta(days=6.5)
+
+
+def _refresh_reminder_due(c, user_id: int):
+    """
+    next_reminder_due = max(последний вес + 7 дней, последнее напоминание + 6.5 дней);
+    без веса и напоминаний — сразу. Вызывается внутри транзакции записи.
+    """
+    c.execute(
+        "SELECT created_at FROM weights WHERE user_id=? ORDER BY created_at DESC LIMIT 1",
+        (user_id,)
+    )
+    row = c.fetchone()
+    last_weight = row[0] if row else None
+    c.execute("SELECT last_weighin_reminder_at FROM settings WHERE user_id=?", (user_id,))
+    row = c.fetchone()
+    last_reminder = row[0] if row else None
+
+    due = datetime.now()
+    candidates = []
+    if last_weight:
+        candidates.append(datetime.fromisoformat(last_weight) + REMIND_AFTER_WEIGHT)
+    if last_reminder:
+        candidates.append(datetime.fromisoformat(last_reminder) + REMIND_AFTER_REMINDER)
+    if candidates:
+        due = max(candidates)
+    c.execute("UPDATE settings SET next_reminder_due=? WHERE user_id=?", (due.isoformat(), user_id))
+
+
+def upsert_remind_weekly(c, user_id: int, enabled: bool):
     c.execute("INSERT OR IGNORE INTO settings (user_id, remind_weekly, last_weighin_reminder_at) VALUES (?, ?, NULL)", (user_id, 1 if enabled else 0))
     c.execute("UPDATE settings SET remind_weekly=? WHERE user_id=?", (1 if enabled else 0, user_id))
-    conn.commit()
-    conn.close()
+    _refresh_reminder_due(c, user_id)
     print(f"[DB] remind_weekly set to {enabled} for {user_id}")
 
-def update_last_weighin_reminder(user_id: int):
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("UPDATE settings SET last_weighin_reminder_at=? WHERE user_id=?", (datetime.now().isoformat(), user_id))
-    conn.commit()
-    conn.close()
+def set_remind_weekly(user_id: int, enabled: bool):
+    with transaction(user_db(user_id)) as c:
+        upsert_remind_weekly(c, user_id, enabled)
+
+def touch_weighin_reminders(c, user_ids: list[int]):
+    """Отмечает отправленные напоминания пользователям одного шарда."""
+    now = datetime.now().isoformat()
+    c.executemany(
+        "UPDATE settings SET last_weighin_reminder_at=? WHERE user_id=?",
+        [(now, uid) for uid in user_ids]
+    )
+    for uid in user_ids:
+        _refresh_reminder_due(c, uid)
+
+def mark_weighin_reminders_sent(user_ids: list[int]):
+    """Пачкой отмечает отправленные напоминания — одна транзакция на шард."""
+    for path, uids in group_by_db(user_ids).items():
+        with transaction(path) as c:
+            touch_weighin_reminders(c, uids)
+    print(f"[DB] weigh-in reminders marked for {len(user_ids)} users")
+
+def disable_weekly_reminders(user_ids: list[int]):
+    """Отключает напоминания тем, кто заблокировал бота."""
+    for path, uids in group_by_db(user_ids).items():
+        with transaction(path) as c:
+            c.executemany("UPDATE settings SET remind_weekly=0 WHERE user_id=?", [(uid,) for uid in uids])
+    print(f"[DB] remind_weekly disabled for {len(user_ids)} unreachable users")
+
+def list_reminders_due(until: str, limit: int | None = None) -> list[tuple[int, str]]:
+    """
+    (user_id, next_reminder_due) с due ≤ until, по возрастанию due — через idx_settings_reminder_due
+    в каждом шарде; упорядоченные выборки шардов сливаются.
+    """
+    sql = """
+        SELECT user_id, next_reminder_due FROM settings
+        WHERE remind_weekly = 1 AND next_reminder_due <= ?
+        ORDER BY next_reminder_due
+    """
+    args: tuple = (until,)
+    if limit:
+        sql += " LIMIT ?"
+        args += (limit,)
+    per_shard = []
+    for path in all_db_paths():
+        with cursor(path) as c:
+            c.execute(sql, args)
+            per_shard.append(c.fetchall())
+    if len(per_shard) == 1:
+        return per_shard[0]
+    merged = list(heapq.merge(*per_shard, key=lambda r: r[1]))
+    return merged[:limit] if limit else merged
+
+
+def filter_reminders_due(user_ids: list[int], now: str) -> list[int]:
+    """Из кандидатов оставляет тех, кому напоминание всё ещё положено (вес мог прийти после планирования)."""
+    due: list[int] = []
+    for path, uids in group_by_db(user_ids).items():
+        with cursor(path) as c:
+            for i in range(0, len(uids), 500):
+                chunk = uids[i:i + 500]
+                marks = ",".join("?" * len(chunk))
+                c.execute(
+                    f"SELECT user_id FROM settings WHERE remind_weekly = 1 AND next_reminder_due <= ? AND user_id IN ({marks})",
+                    (now, *chunk)
+                )
+                due.extend(r[0] for r in c.fetchall())
+    return due
+
+
+
+# ---------- действия на подтверждении ----------
+
+def upsert_pending_action(c, user_id: int, type_: str, payload_json: str, expires_at: str):
+    c.execute(
+        "INSERT OR REPLACE INTO pending_actions (user_id, type, payload, expires_at) VALUES (?, ?, ?, ?)",
+        (user_id, type_, payload_json, expires_at)
+    )
+
+
+def put_pending_action(user_id: int, type_: str, payload_json: str, expires_at: str):
+    with transaction(user_db(user_id)) as c:
+        upsert_pending_action(c, user_id, type_, payload_json, expires_at)
+
+
+def get_pending_action(user_id: int, now: str) -> tuple | None:
+    """(type, payload, expires_at) для неистёкшего действия."""
+    with cursor(user_db(user_id)) as c:
+        c.execute(
+            "SELECT type, payload, expires_at FROM pending_actions WHERE user_id=? AND expires_at > ?",
+            (user_id, now)
+        )
+        return c.fetchone()
+
+
+def take_pending_action(c, user_id: int, now: str) -> tuple | None:
+    c.execute(
+        "DELETE FROM pending_actions WHERE user_id=? AND expires_at > ? RETURNING type, payload",
+        (user_id, now)
+    )
+    return c.fetchone()
+
+
+def pop_pending_action(user_id: int, now: str) -> tuple | None:
+    """Атомарно забирает неистёкшее действие: (type, payload) или None."""
+    with transaction(user_db(user_id)) as c:
+        return take_pending_action(c, user_id, now)
+
+
+def purge_pending_actions(now: str) -> int:
+    n = 0
+    for path in all_db_paths():
+        with transaction(path) as c:
+            c.execute("DELETE FROM pending_actions WHERE expires_at <= ?", (now,))
+            n += c.rowcount
+    return n
+
+
+# ---------- память диалогов ----------
+
+def load_conversation(user_id: int) -> str | None:
+    with cursor(user_db(user_id)) as c:
+        c.execute("SELECT messages FROM conversation_memory WHERE user_id=?", (user_id,))
+        row = c.fetchone()
+    return row[0] if row else None
+
+
+def upsert_conversation(c, user_id: int, messages_json: str):
+    c.execute(
+        "INSERT OR REPLACE INTO conversation_memory (user_id, messages, updated_at) VALUES (?, ?, ?)",
+        (user_id, messages_json, datetime.now().isoformat())
+    )
+
+
+def save_conversation(user_id: int, messages_json: str):
+    with transaction(user_db(user_id)) as c:
+        upsert_conversation(c, user_id, messages_json)
+
+
+def delete_conversation(user_id: int):
+    with transaction(user_db(user_id)) as c:
+        c.execute("DELETE FROM conversation_memory WHERE user_id=?", (user_id,))
+
+
+# ---------- кэш оценок калорий ----------
 
-def list_users_for_weekly_reminder() -> list[int]:
+def get_kcal_cache(cache_key: str, min_created_at: str) -> int | None:
+    """Калории из кэша, если запись не старше min_created_at (ISO)."""
+    with cursor() as c:
+        c.execute(
+            "SELECT calories FROM kcal_cache WHERE cache_key=? AND created_at >= ?",
+            (cache_key, min_created_at)
+        )
+        row = c.fetchone()
+    return int(row[0]) if row else None
+
+
+def upsert_kcal_cache(c, cache_key: str, calories: int):
+    c.execute(
+        "INSERT OR REPLACE INTO kcal_cache (cache_key, calories, created_at) VALUES (?, ?, ?)",
+        (cache_key, calories, datetime.now().isoformat())
+    )
+
+
+def put_kcal_cache(cache_key: str, calories: int):
+    with transaction() as c:
+        upsert_kcal_cache(c, cache_key, calories)
+
+
+def delete_kcal_cache(substring: str | None = None) -> int:
+    """Удаляет записи кэша (все или содержащие substring). Возвращает число удалённых."""
+    with transaction() as c:
+        if substring:
+            c.execute("DELETE FROM kcal_cache WHERE instr(cache_key, ?) > 0", (substring,))
+        else:
+            c.execute("DELETE FROM kcal_cache")
+        n = c.rowcount
+    print(f"[DB] kcal_cache invalidated {n} rows (filter={substring!r})")
+    return n
+
+
+def purge_kcal_cache(older_than: str) -> int:
+    """Удаляет протухшие записи кэша (created_at < older_than)."""
+    with transaction() as c:
+        c.execute("DELETE FROM kcal_cache WHERE created_at < ?", (older_than,))
+        n = c.rowcount
+    return n
+
+
+def count_kcal_cache() -> int:
+    with cursor() as c:
+        c.execute("SELECT COUNT(*) FROM kcal_cache")
+        n = c.fetchone()[0]
+    return int(n)
+
+
+# ---------- плотность калорий по продуктам ----------
+
+def get_food_density(food: str) -> dict | None:
+    with cursor() as c:
+        c.execute(
+            "SELECT kcal_100g, n_g, kcal_100ml, n_ml, kcal_pc, n_pc FROM food_density WHERE food=?",
+            (food,)
+        )
+        row = c.fetchone()
+    if not row:
+        return None
+    return {
+        "kcal_100g": row[0], "n_g": row[1],
+        "kcal_100ml": row[2], "n_ml": row[3],
+        "kcal_pc": row[4], "n_pc": row[5],
+    }
+
+
+def insert_food_density_sample(c, food: str, unit: str, value: float, max_samples: int):
     """
-    Возвращает user_id, кому пора напомнить:
-    - remind_weekly=1
-    - нет веса никогда ИЛИ последний вес был ≥ 7 дней назад
-    - и мы не слали напоминание за последние ~6.5 дней
+    Обновляет скользящее среднее для одной единицы (unit: 'g' | 'ml' | 'pc').
+    Число учтённых образцов ограничено max_samples, чтобы оценка подстраивалась.
     """
-    conn = get_conn()
-    c = conn.cursor()
-    c.execute("""
-        WITH last_w AS (
-            SELECT user_id, MAX(created_at) AS last_weight
-            FROM weights
-            GROUP BY user_id
-        )
-        SELECT s.user_id
-        FROM settings s
-        LEFT JOIN last_w w ON w.user_id = s.user_id
-        WHERE s.remind_weekly = 1
-          AND (
-                w.last_weight IS NULL
-                OR (julianday('now') - julianday(w.last_weight)) >= 7.0
-              )
-          AND (
-                s.last_weighin_reminder_at IS NULL
-                OR (julianday('now') - julianday(s.last_weighin_reminder_at)) >= 6.5
-              )
-    """)
-    rows = c.fetchall()
-    conn.close()
-    return [r[0] for r in rows]
+    col, n = {"g": ("kcal_100g", "n_g"), "ml": ("kcal_100ml", "n_ml"), "pc": ("kcal_pc", "n_pc")}[unit]
+    c.execute("INSERT OR IGNORE INTO food_density (food, updated_at) VALUES (?, ?)",
+              (food, datetime.now().isoformat()))
+    c.execute(
+        f"""UPDATE food_density
+            SET {col} = (COALESCE({col}, 0) * MIN({n}, ?) + ?) / (MIN({n}, ?) + 1),
+                {n} = {n} + 1,
+                updated_at = ?
+            WHERE food = ?""",
+        (max_samples, value, max_samples, datetime.now().isoformat(), food)
+    )
+
+
+def upsert_food_density(food: str, unit: str, value: float, max_samples: int):
+    with transaction() as c:
+        insert_food_density_sample(c, food, unit, value, max_samples)
+
+
+def clear_food_density():
+    with transaction() as c:
+        c.execute("DELETE FROM food_density")
+
+
+def count_food_density() -> int:
+    with cursor() as c:
+        c.execute("SELECT COUNT(*) FROM food_density")
+        n = c.fetchone()[0]
+    return int(n)
+
+
+def iter_meal_history(batch_size: int = 1000):
+    """Все записи meals (description, calories) по всем шардам — для обучения модели плотности."""
+    return chain.from_iterable(
+        _iter_rows(path, "SELECT description, calories FROM meals WHERE calories IS NOT NULL", batch_size)
+        for path in all_db_paths()
+    )
+
+
+def _iter_rows(path: str, sql: str, batch_size: int):
+    with cursor(path) as c:
+        c.execute(sql)
+        while True:
+            rows = c.fetchmany(batch_size)
+            if not rows:
+                break
+            yield from rows
+
+
+# ---------- журнал намерений ----------
+
+def insert_intent(c, user_id: int, text: str, intent: str, source: str):
+    c.execute(
+        "INSERT INTO intent_log (user_id, text, intent, source, created_at) VALUES (?, ?, ?, ?, ?)",
+        (user_id, text, intent, source, datetime.now().isoformat())
+    )
+
+
+def log_intent(user_id: int, text: str, intent: str, source: str):
+    with transaction(user_db(user_id)) as c:
+        insert_intent(c, user_id, text, intent, source)
+
+
+def purge_intent_log(older_than: str) -> int:
+    """Удаляет записи журнала старше older_than (ISO) во всех шардах — по idx_intent_log_created."""
+    n = 0
+    for path in all_db_paths():
+        with transaction(path) as c:
+            c.execute("DELETE FROM intent_log WHERE created_at < ?", (older_than,))
+            n += c.rowcount
+    return n
+
+
+def iter_intent_log(batch_size: int = 1000):
+    """(text, intent, source) из журнала (шард за шардом) — для обучения классификатора намерений."""
+    return chain.from_iterable(
+        _iter_rows(path, "SELECT text, intent, source FROM intent_log ORDER BY id", batch_size)
+        for path in all_db_paths()
+    )
+
+
+# ---------- кэш тренировок ----------
+
+def get_workouts(cache_key: str) -> list[tuple[str, str]]:
+    """(текст, created_at) вариантов по ключу, новые первыми."""
+    with cursor() as c:
+        c.execute(
+            "SELECT workout, created_at FROM workout_cache WHERE cache_key=? ORDER BY created_at DESC",
+            (cache_key,)
+        )
+        return c.fetchall()
+
+
+def add_workout(cache_key: str, workout: str, pool_size: int) -> str:
+    """Добавляет вариант и оставляет по ключу только pool_size самых свежих."""
+    now = datetime.now().isoformat()
+    with transaction() as c:
+        c.execute(
+            "INSERT INTO workout_cache (cache_key, workout, created_at) VALUES (?, ?, ?)",
+            (cache_key, workout, now)
+        )
+        c.execute("""
+            DELETE FROM workout_cache WHERE cache_key=? AND id NOT IN (
+                SELECT id FROM workout_cache WHERE cache_key=? ORDER BY created_at DESC, id DESC LIMIT ?
+            )
+        """, (cache_key, cache_key, pool_size))
+    return now
+
+
+def clear_workouts() -> int:
+    with transaction() as c:
+        c.execute("DELETE FROM workout_cache")
+        return c.rowcount
+
+
+def count_workouts() -> tuple[int, int]:
+    """(вариантов, ключей)."""
+    with cursor() as c:
+        c.execute("SELECT COUNT(*), COUNT(DISTINCT cache_key) FROM workout_cache")
+        n, keys = c.fetchone()
+    return int(n or 0), int(keys or 0)
@@ -0,0 +1,124 @@
+# executors.py - Ограниченные пулы потоков для блокирующей работы
+
+import asyncio
+import contextvars
+import functools
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+import metrics
+from config import LLM_WORKERS, DB_WORKERS, LLM_CONCURRENCY
+
+# LLM / LangChain: долгие сетевые вызовы, потоков побольше
+LLM_EXECUTOR = ThreadPoolExecutor(max_workers=LLM_WORKERS, thread_name_prefix="llm")
+
+# SQLite: короткие запросы, один писатель — много потоков не нужно
+DB_EXECUTOR = ThreadPoolExecutor(max_workers=DB_WORKERS, thread_name_prefix="db")
+
+
+# Глобальный лимит одновременных вызовов LLM API: тысяча пользователей не должна
+# разом навалиться на API. Слот берётся вокруг самого запроса (call_ai, шаг
+# агента), а не всей обработки сообщения: быстрые пути и SQLite его не держат,
+# фоновые догенерации (workout_cache) ждут в той же очереди.
+_llm_slots = threading.BoundedSemaphore(LLM_CONCURRENCY)
+_llm_gauge_lock = threading.Lock()
+_llm_waiting = 0
+_llm_inflight = 0
+
+
+def _llm_gauge(name: str, delta: int):
+    global _llm_waiting, _llm_inflight
+    with _llm_gauge_lock:
+        if name == "llm_waiting":
+            _llm_waiting += delta
+            value = _llm_waiting
+        else:
+            _llm_inflight += delta
+            value = _llm_inflight
+    metrics.set_gauge(name, value)
+
+
+def acquire_llm_slot():
+    _llm_gauge("llm_waiting", 1)
+    t0 = time.perf_counter()
+    try:
+        _llm_slots.acquire()
+    finally:
+        _llm_gauge("llm_waiting", -1)
+    metrics.observe("llm_slot_wait_seconds", time.perf_counter() - t0)
+    _llm_gauge("llm_inflight", 1)
+
+
+def release_llm_slot():
+    _llm_gauge("llm_inflight", -1)
+    _llm_slots.release()
+
+
+@contextmanager
+def llm_slot():
+    """Слот LLM_CONCURRENCY на время одного запроса к API (блокирует поток, не event loop)."""
+    acquire_llm_slot()
+    try:
+        yield
+    finally:
+        release_llm_slot()
+
+
+class LLMSlotCallback(BaseCallbackHandler):
+    """Тот же слот для вызовов LLM внутри LangChain-агента: берётся на старте, отдаётся по завершении."""
+
+    def __init__(self):
+        self._held: set = set()
+        self._lock = threading.Lock()
+
+    def _start(self, run_id):
+        acquire_llm_slot()
+        with self._lock:
+            self._held.add(run_id)
+
+    def _finish(self, run_id):
+        with self._lock:
+            held = run_id in self._held
+            self._held.discard(run_id)
+        if held:
+            release_llm_slot()
+
+    def on_chat_model_start(self, serialized, messages, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_start(self, serialized, prompts, *, run_id, **kwargs):
+        self._start(run_id)
+
+    def on_llm_end(self, response, *, run_id, **kwargs):
+        self._finish(run_id)
+
+    def on_llm_error(self, error, *, run_id, **kwargs):
+        self._finish(run_id)
+
+
+async def _run_in(executor: ThreadPoolExecutor, func, *args, **kwargs):
+    # как asyncio.to_thread: переносим contextvars в поток
+    loop = asyncio.get_running_loop()
+    ctx = contextvars.copy_context()
+    call = functools.partial(ctx.run, func, *args, **kwargs)
+    return await loop.run_in_executor(executor, call)
+
+
+async def run_llm(func, *args, **kwargs):
+    """Выполняет синхронную LLM-работу (call_ai, AgentExecutor.invoke) вне event loop."""
+    return await _run_in(LLM_EXECUTOR, func, *args, **kwargs)
+
+
+async def run_db(func, *args, **kwargs):
+    """Выполняет синхронный запрос к SQLite вне event loop."""
+    return await _run_in(DB_EXECUTOR, func, *args, **kwargs)
+
+
+def shutdown():
+    """При остановке процесса: очередь пулов (фоновые догенерации и т.п.) отменяется, начатое дорабатывает."""
+    LLM_EXECUTOR.shutdown(wait=True, cancel_futures=True)
+    DB_EXECUTOR.shutdown(wait=True, cancel_futures=True)
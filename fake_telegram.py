@@ -0,0 +1,221 @@
+#!/usr/bin/env python3
+# fake_telegram.py - Фальшивый Bot API + генератор нагрузки для webhook-режима (без сети)
+"""
+Поднимает на --port минимальный Bot API (getMe, getUpdates, setWebhook,
+sendMessage, editMessageText, ...) и шлёт боту обновления от --users пользователей:
+POST в webhook (--webhook) или через getUpdates (--polling). Каждый пользователь
+пишет --messages сообщений подряд и ждёт ответа на каждое — так меряется сквозная
+задержка «обновление отправлено → sendMessage от бота».
+
+Сообщения — только быстрые пути (профиль, вес, остаток, справка): без LLM.
+
+    # терминал 1: бот через фальшивый API
+    TELEGRAM_BOT_TOKEN=123:fake TELEGRAM_API_BASE=http://127.0.0.1:8081 \\
+        BOT_MODE=webhook WEBHOOK_SECRET=s3cret python main.py
+    # терминал 2
+    python fake_telegram.py --webhook http://127.0.0.1:8080/telegram/webhook --secret s3cret --users 200
+
+    # polling с шардами
+    TELEGRAM_BOT_TOKEN=123:fake TELEGRAM_API_BASE=http://127.0.0.1:8081 BOT_SHARDS=4 python main.py
+    python fake_telegram.py --polling --users 200
+"""
+
+import argparse
+import asyncio
+import json
+import time
+
+import aiohttp
+from aiohttp import web
+
+SCRIPT = [
+    "взвесился {w}",
+    "мой вес",
+    "остаток калорий",
+    "/help",
+    "вес {w}",
+]
+PLACEHOLDER_PREFIX = "⏳"
+
+
+def _pct(values: list[float], p: float) -> float:
+    if not values:
+        return 0.0
+    s = sorted(values)
+    return s[min(len(s) - 1, int(len(s) * p))]
+
+
+class FakeBotAPI:
+    """Отвечает как api.telegram.org; ответ бота в чат будит ожидающего пользователя."""
+
+    def __init__(self):
+        self._message_id = 0
+        self._waiters: dict[int, asyncio.Future] = {}
+        self._updates: list[dict] = []  # ещё не подтверждённые ботом (offset)
+        self._new_updates = asyncio.Event()
+        self.calls: dict[str, int] = {}
+
+    def push_update(self, update: dict):
+        self._updates.append(update)
+        self._new_updates.set()
+
+    def expect_reply(self, chat_id: int) -> asyncio.Future:
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters[chat_id] = fut
+        return fut
+
+    async def handle(self, request: web.Request) -> web.Response:
+        method = request.match_info["method"]
+        self.calls[method] = self.calls.get(method, 0) + 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        if method.lower() == "getupdates":
+            return web.json_response({"ok": True, "result": await self._get_updates(params)})
+        return web.json_response({"ok": True, "result": self._result(method, params)})
+
+    async def _get_updates(self, params: dict) -> list[dict]:
+        offset = int(params.get("offset") or 0)
+        self._updates = [u for u in self._updates if u["update_id"] >= offset]
+        if not self._updates:
+            self._new_updates.clear()
+            try:
+                await asyncio.wait_for(self._new_updates.wait(), min(float(params.get("timeout") or 0), 25.0))
+            except asyncio.TimeoutError:
+                pass
+        return self._updates[:int(params.get("limit") or 100)]
+
+    def _result(self, method: str, params: dict):
+        m = method.lower()
+        if m == "getme":
+            return {"id": 1, "is_bot": True, "first_name": "Fake", "username": "fake_bot"}
+        if m in ("sendmessage", "editmessagetext"):
+            chat_id = int(params.get("chat_id") or 0)
+            text = str(params.get("text") or "")
+            if not text.startswith(PLACEHOLDER_PREFIX):  # заглушку «Думаю…» ответом не считаем
+                fut = self._waiters.pop(chat_id, None)
+                if fut and not fut.done():
+                    fut.set_result(text)
+            if m == "editmessagetext":
+                message_id = int(params.get("message_id") or 0)
+            else:
+                self._message_id += 1
+                message_id = self._message_id
+            return {
+                "message_id": message_id,
+                "date": int(time.time()),
+                "chat": {"id": chat_id, "type": "private"},
+                "text": text,
+            }
+        return True  # setWebhook, deleteWebhook, sendChatAction и т.п.
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        return app
+
+
+class LoadGenerator:
+    def __init__(self, api: FakeBotAPI, webhook: str, secret: str, timeout: float):
+        self.api = api
+        self.webhook = webhook
+        self.secret = secret
+        self.timeout = timeout
+        # update_id растут между запусками, как у Telegram: иначе offset работающего бота их отбросит
+        self._update_id = int(time.time() * 1000)
+        self.latencies: list[float] = []
+        self.post_latencies: list[float] = []
+        self.rejected = 0
+        self.timeouts = 0
+
+    def _update(self, user_id: int, text: str) -> dict:
+        self._update_id += 1
+        return {
+            "update_id": self._update_id,
+            "message": {
+                "message_id": self._update_id,
+                "date": int(time.time()),
+                "chat": {"id": user_id, "type": "private"},
+                "from": {"id": user_id, "is_bot": False, "first_name": "Load"},
+                "text": text,
+            },
+        }
+
+    async def _send(self, http: aiohttp.ClientSession, user_id: int, text: str):
+        reply = self.api.expect_reply(user_id)
+        body = json.dumps(self._update(user_id, text))
+        headers = {"Content-Type": "application/json", "X-Telegram-Bot-Api-Secret-Token": self.secret}
+        t0 = time.perf_counter()
+        if self.webhook:
+            while True:
+                async with http.post(self.webhook, data=body, headers=headers) as resp:
+                    status = resp.status
+                if status != 503:
+                    break
+                self.rejected += 1  # как Telegram: повторяем доставку
+                await asyncio.sleep(0.5)
+            self.post_latencies.append(time.perf_counter() - t0)
+            if status != 200:
+                raise RuntimeError(f"webhook HTTP {status}")
+        else:
+            self.api.push_update(json.loads(body))
+        try:
+            await asyncio.wait_for(reply, self.timeout)
+            self.latencies.append(time.perf_counter() - t0)
+        except asyncio.TimeoutError:
+            self.timeouts += 1
+
+    async def user(self, http: aiohttp.ClientSession, user_id: int, messages: int):
+        weight = 70 + user_id % 30
+        await self._send(http, user_id, f"Нагрузка, 30, {weight}, 175")
+        for i in range(messages):
+            await self._send(http, user_id, SCRIPT[i % len(SCRIPT)].format(w=weight - i * 0.1))
+
+
+async def run(args):
+    api = FakeBotAPI()
+    runner = web.AppRunner(api.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "127.0.0.1", args.port).start()
+    print(f"fake Bot API: http://127.0.0.1:{args.port}")
+    if not args.webhook and not args.polling:
+        await asyncio.Event().wait()
+
+    gen = LoadGenerator(api, args.webhook, args.secret, args.timeout)
+    connector = aiohttp.TCPConnector(limit=args.connections)
+    async with aiohttp.ClientSession(connector=connector) as http:
+        t0 = time.perf_counter()
+        await asyncio.gather(*(
+            gen.user(http, args.first_user + i, args.messages) for i in range(args.users)
+        ))
+        elapsed = time.perf_counter() - t0
+    await runner.cleanup()
+
+    total = len(gen.latencies)
+    print(f"users={args.users} replies={total} timeouts={gen.timeouts} 503={gen.rejected} "
+          f"elapsed={elapsed:.1f}s throughput={total / elapsed:.1f} msg/s")
+    print("end-to-end ms: p50={:.0f} p95={:.0f} p99={:.0f}".format(
+        *(1000 * _pct(gen.latencies, p) for p in (0.5, 0.95, 0.99))))
+    if gen.post_latencies:
+        print("webhook POST ms: p50={:.1f} p99={:.1f}".format(
+            *(1000 * _pct(gen.post_latencies, p) for p in (0.5, 0.99))))
+    print(f"Bot API calls: {api.calls}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Фальшивый Bot API и нагрузка на webhook")
+    ap.add_argument("--port", type=int, default=8081)
+    ap.add_argument("--webhook", default="", help="URL webhook бота")
+    ap.add_argument("--polling", action="store_true", help="отдавать обновления через getUpdates")
+    ap.add_argument("--secret", default="")
+    ap.add_argument("--users", type=int, default=100)
+    ap.add_argument("--messages", type=int, default=5, help="сообщений на пользователя (после профиля)")
+    ap.add_argument("--first-user", type=int, default=900_000_000)
+    ap.add_argument("--connections", type=int, default=100)
+    ap.add_argument("--timeout", type=float, default=30.0, help="ожидание ответа бота, сек")
+    asyncio.run(run(ap.parse_args()))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# food_density.py - Модель «ккал на 100 г / 100 мл / штуку» по продуктам
+
+import metrics
+from config import FOOD_DENSITY_MIN_SAMPLES, FOOD_DENSITY_MAX_SAMPLES
+from database import (
+    transaction,
+    get_food_density,
+    upsert_food_density,
+    insert_food_density_sample,
+    clear_food_density,
+    count_food_density,
+    iter_meal_history,
+)
+from repository import repository
+from utils import extract_qty, normalize_food_text
+
+# Ответы, упёршиеся в границы ai_estimate_calories, для обучения не годятся
+KCAL_MIN, KCAL_MAX = 5, 1200
+
+# Калории позиции, которую не удалось оценить (tools.log_meal): в meals это не оценка,
+# а заглушка — учить на ней нельзя, иначе любая еда «весит» 150 ккал
+FALLBACK_KCAL = 150
+
+
+def _single_unit(qty: dict) -> tuple[str, float] | None:
+    """
+    Единица измерения, если она ровно одна: ('g', 40.0), ('ml', 300.0), ('pc', 2.0).
+    «2 шт по 50 г» неоднозначно — такие порции не учим и не считаем.
+    """
+    units = [(u, qty.get(k)) for u, k in (("g", "grams"), ("ml", "ml"), ("pc", "pcs"))]
+    units = [(u, float(v)) for u, v in units if v]
+    if len(units) != 1 or units[0][1] <= 0:
+        return None
+    return units[0]
+
+
+class FoodDensityModel:
+    """
+    Учит плотность калорий по продукту из ответов LLM и истории meals,
+    чтобы новая порция известного продукта считалась локально:
+    «халва 40 г» → 216 ккал ⇒ «халва 100 г» = 540 ккал без запроса к LLM.
+    """
+
+    def learn(self, description: str, qty: dict, kcal: int) -> bool:
+        food = normalize_food_text(description)
+        unit = _single_unit(qty)
+        if not food or not unit or not (KCAL_MIN < kcal < KCAL_MAX) or kcal == FALLBACK_KCAL:
+            return False
+        u, amount = unit
+        value = kcal / amount * (1 if u == "pc" else 100)
+        repository.write_shared(insert_food_density_sample, upsert_food_density, food, u, value, FOOD_DENSITY_MAX_SAMPLES)
+        metrics.inc("kcal_density_learned")
+        return True
+
+    def estimate(self, description: str, qty: dict) -> int | None:
+        food = normalize_food_text(description)
+        unit = _single_unit(qty)
+        if not food or not unit:
+            return None
+        d = get_food_density(food)
+        if not d:
+            return None
+        u, amount = unit
+        density, samples = {
+            "g": (d["kcal_100g"], d["n_g"]),
+            "ml": (d["kcal_100ml"], d["n_ml"]),
+            "pc": (d["kcal_pc"], d["n_pc"]),
+        }[u]
+        if density is None or samples < FOOD_DENSITY_MIN_SAMPLES:
+            return None
+        val = density * amount / (1 if u == "pc" else 100)
+        metrics.inc("kcal_density_hits")
+        return int(round(min(max(val, KCAL_MIN), KCAL_MAX)))
+
+    def rebuild_from_meals(self) -> int:
+        """
+        Переобучает модель с нуля по таблице meals. Возвращает число учтённых записей.
+        Записи с FALLBACK_KCAL пропускаются (learn): оценка для них не удалась.
+        """
+        learned = 0
+        with transaction():  # один commit на весь пересчёт
+            clear_food_density()
+            for description, calories in iter_meal_history():
+                if self.learn(description, extract_qty(description), int(calories)):
+                    learned += 1
+        print(f"[DENSITY] rebuilt from meals: {learned} samples, {count_food_density()} foods")
+        return learned
+
+    def bootstrap_if_empty(self) -> int:
+        """На старте: если модель пустая — учимся на накопленной истории meals."""
+        if count_food_density() > 0:
+            return 0
+        return self.rebuild_from_meals()
+
+
+food_density = FoodDensityModel()
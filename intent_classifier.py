@@ -0,0 +1,226 @@
+#!/usr/bin/env python3
+# intent_classifier.py - Локальный классификатор намерений (наивный Байес по символьным n-граммам)
+"""
+Маршрутизация без ReAct-агента для типовых сообщений, которые не поймали правила.
+Модель — мультиномиальный наивный Байес по символьным 2–4-граммам и словам:
+обучается офлайн за секунды, предсказывает примерно за 0.1 мс, без GPU.
+
+Обучение — затравка intent_seed.tsv + журнал intent_log (метки правил и выбор
+инструмента агентом; журнал пишется только при INTENT_LOG=true, выборкой INTENT_LOG_SAMPLE):
+
+    python intent_classifier.py train [--out intent_model.json] [--eval]
+"""
+
+import argparse
+import json
+import math
+import os
+import random
+import re
+import threading
+from collections import Counter, defaultdict
+from typing import Iterable, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+from config import INTENT_MODEL_PATH
+
+SEED_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "intent_seed.tsv")
+
+# намерения правил (intents.RULES) → метки классификатора (имена инструментов агента)
+RULE_LABELS = {"goal": "create_plan"}
+SKIP_LABELS = {"confirm", "cancel"}
+
+_WS_RE = re.compile(r"\s+")
+_DIGITS_RE = re.compile(r"\d+(?:[.,]\d+)?")
+_WORD_RE = re.compile(r"\w+")
+
+
+def _features(text: str) -> Counter:
+    t = (text or "").lower().replace("ё", "е")
+    t = _DIGITS_RE.sub("0", t)  # конкретные числа не важны, важен факт числа
+    t = " " + _WS_RE.sub(" ", t).strip() + " "
+    feats = Counter()
+    for n in (2, 3, 4):
+        for i in range(len(t) - n + 1):
+            feats[t[i:i + n]] += 1
+    for w in _WORD_RE.findall(t):
+        feats["w:" + w] += 1
+    return feats
+
+
+class NaiveBayesIntentClassifier:
+    def __init__(self, labels: list[str], priors: list[float], weights: dict[str, list[float]],
+                 scale: float = 10.0):
+        self.labels = labels
+        self.priors = priors      # log P(label)
+        self.weights = weights    # признак → log P(признак | label) по меткам
+        # n-граммы сильно коррелируют, и «честный» Байес даёт 0.9999 на всё подряд:
+        # правдоподобие усредняем по числу признаков и умножаем на scale — уверенность
+        # становится осмысленной и порог INTENT_CONFIDENCE работает
+        self.scale = scale
+
+    @classmethod
+    def fit(cls, samples: Iterable[tuple[str, str]], alpha: float = 0.5,
+            scale: float = 10.0) -> "NaiveBayesIntentClassifier":
+        counts: dict[str, Counter] = defaultdict(Counter)
+        docs: Counter = Counter()
+        for text, label in samples:
+            counts[label].update(_features(text))
+            docs[label] += 1
+        labels = sorted(docs)
+        vocab = set().union(*(counts[lb] for lb in labels)) if labels else set()
+        total_docs = sum(docs.values())
+
+        priors, denoms = [], []
+        for lb in labels:
+            denoms.append(sum(counts[lb].values()) + alpha * (len(vocab) + 1))
+            priors.append(math.log(docs[lb] / total_docs))
+        weights = {
+            f: [math.log((counts[lb][f] + alpha) / denoms[i]) for i, lb in enumerate(labels)]
+            for f in vocab
+        }
+        return cls(labels, priors, weights, scale)
+
+    def predict(self, text: str) -> tuple[Optional[str], float]:
+        """(метка, уверенность 0..1); незнакомый текст — (None, 0)."""
+        if not self.labels:
+            return None, 0.0
+        ll = [0.0] * len(self.labels)
+        known = 0
+        for f, n in _features(text).items():
+            w = self.weights.get(f)
+            if w is None:
+                continue  # признак не встречался ни в одном классе — на выбор не влияет
+            known += n
+            for i, v in enumerate(w):
+                ll[i] += n * v
+        if not known:
+            return None, 0.0
+        k = self.scale / known
+        scores = [p + k * v for p, v in zip(self.priors, ll)]
+        top = max(scores)
+        exp = [math.exp(s - top) for s in scores]
+        best = exp.index(1.0)
+        return self.labels[best], exp[best] / sum(exp)
+
+    # ---------- сериализация ----------
+
+    def to_json(self) -> dict:
+        return {
+            "labels": self.labels,
+            "priors": self.priors,
+            "scale": self.scale,
+            "weights": {f: [round(v, 5) for v in w] for f, w in self.weights.items()},
+        }
+
+    @classmethod
+    def from_json(cls, data: dict) -> "NaiveBayesIntentClassifier":
+        return cls(data["labels"], data["priors"], data["weights"], data.get("scale", 10.0))
+
+    def save(self, path: str):
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_json(), f, ensure_ascii=False)
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path: str) -> "NaiveBayesIntentClassifier":
+        with open(path, encoding="utf-8") as f:
+            return cls.from_json(json.load(f))
+
+
+# ---------- модель процесса ----------
+
+_model: Optional[NaiveBayesIntentClassifier] = None
+_model_loaded = False
+_model_lock = threading.Lock()
+
+
+def get_intent_classifier() -> Optional[NaiveBayesIntentClassifier]:
+    """Модель из INTENT_MODEL_PATH; если файла нет — None (маршрутизация идёт сразу к агенту)."""
+    global _model, _model_loaded
+    if not _model_loaded:
+        with _model_lock:
+            if not _model_loaded:
+                if os.path.exists(INTENT_MODEL_PATH):
+                    try:
+                        _model = NaiveBayesIntentClassifier.load(INTENT_MODEL_PATH)
+                        print(f"[INTENT] model loaded: {len(_model.labels)} labels, {len(_model.weights)} features")
+                    except Exception as e:
+                        print(f"[INTENT] model load error: {e}")
+                _model_loaded = True
+    return _model
+
+
+class AgentToolRecorder(BaseCallbackHandler):
+    """Запоминает первый инструмент, выбранный агентом, — метка для журнала intent_log."""
+
+    def __init__(self):
+        self.tool: Optional[str] = None
+
+    def on_agent_action(self, action, **kwargs):
+        if self.tool is None:
+            self.tool = action.tool
+
+
+# ---------- обучение ----------
+
+def load_seed(path: str = SEED_PATH) -> list[tuple[str, str]]:
+    rows = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.rstrip("\n")
+            if not line or line.startswith("#"):
+                continue
+            text, label = line.split("\t")
+            rows.append((text, label))
+    return rows
+
+
+def training_samples(seed_path: str = SEED_PATH) -> list[tuple[str, str]]:
+    from database import iter_intent_log
+
+    samples = load_seed(seed_path)
+    for text, intent, _source in iter_intent_log():
+        if not text or intent in SKIP_LABELS:
+            continue
+        samples.append((text, RULE_LABELS.get(intent, intent)))
+    return samples
+
+
+def _cv_accuracy(samples: list[tuple[str, str]], folds: int = 5) -> float:
+    """Точность k-fold кросс-валидации (на маленькой затравке одиночный сплит слишком шумный)."""
+    data = samples[:]
+    random.Random(42).shuffle(data)
+    hits = 0
+    for k in range(folds):
+        test = data[k::folds]
+        train = [row for i, row in enumerate(data) if i % folds != k]
+        model = NaiveBayesIntentClassifier.fit(train)
+        hits += sum(1 for text, label in test if model.predict(text)[0] == label)
+    return hits / len(data)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Обучение локального классификатора намерений")
+    ap.add_argument("command", choices=["train"])
+    ap.add_argument("--out", default=INTENT_MODEL_PATH)
+    ap.add_argument("--seed", default=SEED_PATH)
+    ap.add_argument("--eval", action="store_true", help="оценить точность 5-fold кросс-валидацией")
+    args = ap.parse_args()
+
+    from database import init_db
+    init_db()
+
+    samples = training_samples(args.seed)
+    print(f"samples: {len(samples)} ({dict(Counter(lb for _, lb in samples))})")
+    if args.eval:
+        print(f"5-fold accuracy: {_cv_accuracy(samples):.1%}")
+    model = NaiveBayesIntentClassifier.fit(samples)
+    model.save(args.out)
+    print(f"saved {args.out}: {len(model.labels)} labels, {len(model.weights)} features")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# intents.py - Компилируемый матчер намерений для быстрого роутинга
+
+import re
+import threading
+from collections import OrderedDict
+from typing import NamedTuple, Optional
+
+
+class Rule(NamedTuple):
+    pattern: str       # фрагмент регулярки (без именованных групп)
+    intent: str
+    priority: int      # при нескольких совпадениях побеждает больший
+    confidence: float  # насколько правилу можно верить без агента
+
+
+class IntentMatch(NamedTuple):
+    intent: str
+    confidence: float
+    priority: int
+    span: tuple[int, int]
+
+
+_NUM = r"\d+(?:[.,]\d+)?"
+
+# Порядок в списке не важен: всё решают priority и позиция совпадения.
+RULES: list[Rule] = [
+    # цель с числом: «цель 75», «похудеть на 10 кг» / «на 10кг», «скинуть 7 кг»
+    Rule(rf"цель\D{{0,20}}{_NUM}", "goal", 100, 0.95),
+    Rule(r"похуд\w*(?=.*\d\s*кг)", "goal", 100, 0.9),
+    Rule(rf"(?:скинуть|сбросить)\s+(?:на\s+)?{_NUM}\s*кг", "goal", 95, 0.85),
+
+    Rule(r"\b(?:моя|текущая|какая)\s+цель\b(?!\D{0,20}\d)", "show_goal", 90, 0.9),
+
+    Rule(r"трениров\w*", "workout", 80, 0.9),
+
+    Rule(r"\bза\s+(?:неделю|месяц)\b|\bсводк\w*", "calorie_summary", 75, 0.85),
+
+    Rule(r"прогресс\w*", "progress", 70, 0.9),
+    Rule(r"остаток|\bсколько\s+(?:ещё|еще)\s+можно\b", "get_remaining_calories", 70, 0.9),
+
+    Rule(r"\bмой\s+вес\b|\bтекущий\s+вес\b|\bвес\s*\?|\bсколько\s+я\s+вешу\b", "show_weight", 65, 0.85),
+
+    # «вес после обеда 82» — это вес, а не еда: у веса приоритет выше
+    Rule(r"взвес\w*", "log_weight", 60, 0.9),
+    Rule(rf"\bвес\b\D{{0,20}}{_NUM}", "log_weight", 60, 0.85),
+
+    Rule(r"\b(?:съел\w*|съела|выпил\w*|скушал\w*|позавтракал\w*|пообедал\w*|поужинал\w*)", "log_meal", 50, 0.8),
+    Rule(r"\b(?:завтрак|обед|ужин|перекус)\w*", "log_meal", 40, 0.6),
+]
+
+CONFIRM_WORDS = frozenset({"да", "ок", "окей", "согласен", "подтверждаю"})
+CANCEL_WORDS = frozenset({"нет", "не", "отмена", "отменить"})
+
+
+class IntentMatcher:
+    """
+    Все правила собраны в одну регулярку-альтернацию с именованными группами.
+    Один проход по тексту; среди совпадений выигрывает максимальный priority,
+    при равенстве — более раннее совпадение. Внутри одной позиции
+    альтернативы перебираются по убыванию priority, так что «мой вес» не
+    перехватывается более слабым «вес».
+    """
+
+    def __init__(self, rules: list[Rule], cache_size: int = 4096):
+        self.rules = sorted(rules, key=lambda r: -r.priority)
+        self._by_group = {f"r{i}": r for i, r in enumerate(self.rules)}
+        self._top = self.rules[0].priority if self.rules else 0
+        body = "|".join(f"(?P<r{i}>{r.pattern})" for i, r in enumerate(self.rules))
+        # дешёвый фильтр: на позициях, где не начинается ни одно правило, альтернативы не перебираются
+        starts = [_first_chars(r.pattern) for r in self.rules]
+        first = "".join(sorted(set().union(*starts))) if all(starts) else ""
+        self._re = re.compile(f"(?=[{re.escape(first)}])(?:{body})" if first else body)
+        # одни и те же короткие тексты («да», «вес 82», «мой вес») приходят постоянно;
+        # LRU, match() зовут из потоков LLM_EXECUTOR
+        self._cache: OrderedDict[str, Optional[IntentMatch]] = OrderedDict()
+        self._cache_size = cache_size
+        self._lock = threading.Lock()
+
+    def match(self, text: str) -> Optional[IntentMatch]:
+        t = (text or "").lower()
+        with self._lock:
+            if t in self._cache:
+                self._cache.move_to_end(t)
+                return self._cache[t]
+        res = self._match(t)
+        if self._cache_size and len(t) <= 200:
+            with self._lock:
+                self._cache[t] = res
+                if len(self._cache) > self._cache_size:
+                    self._cache.popitem(last=False)
+        return res
+
+    def _match(self, t: str) -> Optional[IntentMatch]:
+        best: Optional[Rule] = None
+        best_m = None
+        for m in self._re.finditer(t):
+            rule = self._by_group[m.lastgroup]
+            if best is None or rule.priority > best.priority:
+                best, best_m = rule, m
+                if rule.priority == self._top:
+                    break  # выше уже не будет
+        if best is None:
+            return None
+        return IntentMatch(best.intent, best.confidence, best.priority, best_m.span())
+
+
+def _first_chars(pattern: str) -> set[str]:
+    """Буквы, с которых может начаться совпадение правила (правила начинаются со слов)."""
+    chars = set()
+    for alt in _split_top(re.sub(r"^\\b", "", pattern)):
+        alt = re.sub(r"^\\b", "", alt)
+        if alt.startswith("(?:"):
+            inner = alt[3:alt.index(")")]
+            chars |= {re.sub(r"^\\b", "", a)[:1] for a in inner.split("|")}
+        else:
+            chars.add(alt[:1])
+    if not chars or not all(ch.isalpha() for ch in chars):
+        return set()  # не смогли разобрать — фильтр отключается целиком
+    return chars
+
+
+def _split_top(pattern: str) -> list[str]:
+    parts, depth, cur = [], 0, ""
+    for ch in pattern:
+        if ch == "(":
+            depth += 1
+        elif ch == ")":
+            depth -= 1
+        if ch == "|" and depth == 0:
+            parts.append(cur)
+            cur = ""
+        else:
+            cur += ch
+    parts.append(cur)
+    return parts
+
+
+matcher = IntentMatcher(RULES)
+
+
+def classify(text: str, engine: IntentMatcher = matcher) -> Optional[IntentMatch]:
+    """Подтверждение/отмена целым сообщением, иначе — правила."""
+    t = (text or "").lower().strip()
+    if t in CONFIRM_WORDS:
+        return IntentMatch("confirm", 1.0, 1000, (0, len(t)))
+    if t in CANCEL_WORDS:
+        return IntentMatch("cancel", 1.0, 1000, (0, len(t)))
+    return engine.match(t)
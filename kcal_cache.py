@@ -0,0 +1,114 @@
+# kcal_cache.py - Двухуровневый кэш AI-оценок калорий (LRU в памяти + SQLite)
+
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import metrics
+from config import KCAL_CACHE_SIZE, KCAL_CACHE_TTL_DAYS
+from database import (
+    get_kcal_cache,
+    put_kcal_cache,
+    upsert_kcal_cache,
+    delete_kcal_cache,
+    purge_kcal_cache,
+    count_kcal_cache,
+)
+from repository import repository
+from utils import normalize_food_text
+
+
+def make_key(description: str, qty: dict) -> str | None:
+    """
+    Ключ кэша: нормализованное описание + количество из _extract_qty.
+    «я съел 2 яйца» и «2 яйца» → «яйца|g=-|ml=-|pcs=2».
+    """
+    food = normalize_food_text(description)
+    if not food:
+        return None
+
+    def fmt(v):
+        return "-" if v is None else f"{float(v):g}"
+
+    return f"{food}|g={fmt(qty.get('grams'))}|ml={fmt(qty.get('ml'))}|pcs={fmt(qty.get('pcs'))}"
+
+
+class KcalCache:
+    """
+    L1 — OrderedDict-LRU в памяти (bounded, TTL), L2 — таблица kcal_cache в SQLite (TTL).
+    Промах L1 + попадание L2 поднимает запись в L1.
+    """
+
+    def __init__(self, max_items: int, ttl_seconds: float):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._items: OrderedDict[str, tuple[int, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _min_created_at(self) -> str:
+        return (datetime.now() - timedelta(seconds=self.ttl_seconds)).isoformat()
+
+    def _remember(self, key: str, kcal: int):
+        with self._lock:
+            self._items[key] = (kcal, time.monotonic() + self.ttl_seconds)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                metrics.inc("kcal_cache_evictions")
+
+    def get(self, key: str) -> int | None:
+        with self._lock:
+            item = self._items.get(key)
+            if item is not None:
+                kcal, expires = item
+                if expires > time.monotonic():
+                    self._items.move_to_end(key)
+                    metrics.inc("kcal_cache_hits_mem")
+                    return kcal
+                del self._items[key]
+
+        kcal = get_kcal_cache(key, self._min_created_at())
+        if kcal is not None:
+            metrics.inc("kcal_cache_hits_db")
+            self._remember(key, kcal)
+            return kcal
+
+        metrics.inc("kcal_cache_misses")
+        return None
+
+    def put(self, key: str, kcal: int):
+        self._remember(key, kcal)
+        repository.write_shared(upsert_kcal_cache, put_kcal_cache, key, kcal)
+
+    def invalidate(self, substring: str | None = None) -> int:
+        """Сбрасывает весь кэш или записи, где ключ содержит substring."""
+        with self._lock:
+            if substring:
+                for k in [k for k in self._items if substring in k]:
+                    del self._items[k]
+            else:
+                self._items.clear()
+        return delete_kcal_cache(substring)
+
+    def purge_expired(self) -> int:
+        return purge_kcal_cache(self._min_created_at())
+
+    def stats(self) -> dict:
+        hits_mem = int(metrics.get("kcal_cache_hits_mem"))
+        hits_db = int(metrics.get("kcal_cache_hits_db"))
+        misses = int(metrics.get("kcal_cache_misses"))
+        total = hits_mem + hits_db + misses
+        with self._lock:
+            mem_size = len(self._items)
+        return {
+            "mem_items": mem_size,
+            "db_items": count_kcal_cache(),
+            "hits_mem": hits_mem,
+            "hits_db": hits_db,
+            "misses": misses,
+            "hit_rate": (hits_mem + hits_db) / total if total else 0.0,
+        }
+
+
+kcal_cache = KcalCache(KCAL_CACHE_SIZE, KCAL_CACHE_TTL_DAYS * 86400)
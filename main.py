@@ -3,15 +3,35 @@ from dotenv import load_dotenv
 load_dotenv()
 
 import asyncio
+from config import BOT_MODE, BOT_SHARDS
 from database import init_db
-from telegram_bot import main as run_bot
 
-print("=" * 50)
-print("🏋️ Fitness Coach AI Bot")
-print("=" * 50)
 
-print("✓ Инициализирую БД...")
-init_db()
+def main():
+    print("=" * 50)
+    print("🏋️ Fitness Coach AI Bot")
+    print("=" * 50)
 
-print("✓ Запускаю Telegram бота...\n")
-asyncio.run(run_bot())
+    print("✓ Инициализирую БД...")
+    init_db()
+
+    if BOT_MODE == "webhook":
+        from webhook import run_webhook
+        print("✓ Запускаю webhook-приёмник и воркеры...\n")
+        run_webhook()
+        return
+
+    if BOT_SHARDS > 1:
+        from shards import run_sharded_polling
+        print(f"✓ Запускаю супервизор и {BOT_SHARDS} шардов...\n")
+        run_sharded_polling(BOT_SHARDS)
+        return
+
+    from telegram_bot import main as run_bot
+    print("✓ Запускаю Telegram бота...\n")
+    asyncio.run(run_bot())
+
+
+# guard обязателен: воркеры (шарды, webhook) стартуют через spawn и импортируют этот модуль
+if __name__ == "__main__":
+    main()
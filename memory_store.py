@@ -0,0 +1,155 @@
+# memory_store.py - Ограниченное хранилище памяти диалогов (LRU/TTL + выгрузка в SQLite)
+
+import json
+import threading
+import time
+from collections import OrderedDict
+
+from langchain.memory import ConversationBufferMemory
+from langchain.schema import messages_from_dict, messages_to_dict
+
+import metrics
+from config import MEMORY_MAX_USERS, MEMORY_TTL_SECONDS, MEMORY_MAX_MESSAGES, MEMORY_MAX_CHARS
+from database import load_conversation, save_conversation, upsert_conversation, delete_conversation
+from repository import repository
+
+
+def _new_memory() -> ConversationBufferMemory:
+    return ConversationBufferMemory(
+        memory_key="chat_history",
+        return_messages=True
+    )
+
+
+def _size(memory: ConversationBufferMemory) -> int:
+    return sum(len(str(m.content).encode("utf-8")) for m in memory.chat_memory.messages)
+
+
+class MemoryStore:
+    """
+    Память диалогов по пользователям:
+    - не больше max_users в памяти (LRU), простаивающие дольше ttl выгружаются (sweep());
+    - у каждого не больше max_messages сообщений и max_chars символов (старые отбрасываются парами);
+    - выгруженные диалоги лежат в conversation_memory и подгружаются при возвращении пользователя.
+    Под блокировкой — только словари; чтение и запись SQLite идут вне её, чтобы диск
+    одного пользователя не задерживал остальных. Вытесненная, но ещё не записанная
+    память лежит в _spilling: вернувшийся пользователь получает её, а не устаревшую строку БД.
+    """
+
+    def __init__(self, max_users: int, ttl_seconds: float, max_messages: int, max_chars: int):
+        self.max_users = max_users
+        self.ttl_seconds = ttl_seconds
+        self.max_messages = max_messages
+        self.max_chars = max_chars
+        self._items: OrderedDict[int, tuple[ConversationBufferMemory, float]] = OrderedDict()
+        self._spilling: dict[int, ConversationBufferMemory] = {}
+        self._lock = threading.RLock()
+
+    def _spill(self, user_id: int, memory: ConversationBufferMemory):
+        messages = memory.chat_memory.messages
+        if messages:
+            repository.write(upsert_conversation, save_conversation, user_id,
+                             json.dumps(messages_to_dict(messages), ensure_ascii=False))
+            metrics.inc("memory_spills")
+
+    def _spill_all(self, evicted: list[tuple[int, ConversationBufferMemory]]):
+        """Записывает вытесненных (вне блокировки) и убирает их из _spilling."""
+        for user_id, memory in evicted:
+            try:
+                self._spill(user_id, memory)
+            except Exception as e:
+                print(f"[MEMORY] spill error for {user_id}: {e}")
+            finally:
+                with self._lock:
+                    if self._spilling.get(user_id) is memory:
+                        del self._spilling[user_id]
+
+    def _evict_locked(self, ttl_only: bool = False) -> list[tuple[int, ConversationBufferMemory]]:
+        """Снимает с головы LRU лишних и простаивающих; записывать их — вызывающему, вне блокировки."""
+        now = time.monotonic()
+        evicted = []
+        while self._items:
+            user_id, (memory, last_used) = next(iter(self._items.items()))
+            if (ttl_only or len(self._items) <= self.max_users) and now - last_used < self.ttl_seconds:
+                break
+            self._items.popitem(last=False)
+            self._spilling[user_id] = memory
+            evicted.append((user_id, memory))
+        metrics.set_gauge("memory_users", len(self._items))
+        return evicted
+
+    def _trim(self, memory: ConversationBufferMemory):
+        messages = memory.chat_memory.messages
+        while len(messages) > self.max_messages or (len(messages) > 2 and _size(memory) > self.max_chars):
+            del messages[:2]  # вход + ответ
+
+    def _load(self, user_id: int) -> ConversationBufferMemory:
+        memory = _new_memory()
+        raw = load_conversation(user_id)
+        if raw:
+            memory.chat_memory.messages = messages_from_dict(json.loads(raw))
+            self._trim(memory)
+            metrics.inc("memory_reloads")
+        return memory
+
+    def get(self, user_id: int) -> ConversationBufferMemory:
+        with self._lock:
+            item = self._items.pop(user_id, None)
+            memory = item[0] if item is not None else self._spilling.get(user_id)
+        if memory is None:
+            loaded = self._load(user_id)
+            with self._lock:
+                # пока читали БД, память мог завести параллельный вызов
+                item = self._items.pop(user_id, None)
+                memory = item[0] if item is not None else loaded
+        with self._lock:
+            self._items[user_id] = (memory, time.monotonic())
+            evicted = self._evict_locked()
+        self._spill_all(evicted)
+        return memory
+
+    def save_context(self, user_id: int, user_text: str, result: str):
+        memory = self.get(user_id)
+        with self._lock:
+            memory.save_context({"input": user_text}, {"output": result})
+            self._trim(memory)
+
+    def forget(self, user_id: int):
+        with self._lock:
+            self._items.pop(user_id, None)
+            self._spilling.pop(user_id, None)
+        delete_conversation(user_id)
+
+    def sweep(self) -> int:
+        """Выгружает простаивающих дольше ttl (без sweep их вытеснил бы только следующий get)."""
+        with self._lock:
+            evicted = self._evict_locked(ttl_only=True)
+        self._spill_all(evicted)
+        if evicted:
+            metrics.inc("memory_expired", len(evicted))
+        return len(evicted)
+
+    def flush(self):
+        """Выгружает все диалоги в SQLite (при остановке процесса)."""
+        with self._lock:
+            items = [(user_id, memory) for user_id, (memory, _) in self._items.items()]
+        for user_id, memory in items:
+            self._spill(user_id, memory)
+
+    def stats(self) -> dict:
+        with self._lock:
+            memories = [m for m, _ in self._items.values()]
+        return {
+            "users": len(memories),
+            "messages": sum(len(m.chat_memory.messages) for m in memories),
+            "bytes": sum(_size(m) for m in memories),
+        }
+
+    def __contains__(self, user_id: int) -> bool:
+        return user_id in self._items
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+memory_store = MemoryStore(MEMORY_MAX_USERS, MEMORY_TTL_SECONDS, MEMORY_MAX_MESSAGES, MEMORY_MAX_CHARS)
@@ -0,0 +1,58 @@
+# metrics.py - Простые процессные счётчики и замеры
+
+import threading
+
+_lock = threading.Lock()
+_counters: dict[str, float] = {}
+_gauges: dict[str, float] = {}
+_timings: dict[str, dict] = {}
+
+
+def inc(name: str, value: float = 1) -> None:
+    """Увеличивает счётчик."""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+
+
+def set_gauge(name: str, value: float) -> None:
+    """Запоминает текущее значение (размер очереди, кэша и т.п.)."""
+    with _lock:
+        _gauges[name] = value
+
+
+def observe(name: str, value: float) -> None:
+    """Добавляет замер (латентность, токены): считаем count/sum/max."""
+    with _lock:
+        t = _timings.setdefault(name, {"count": 0, "sum": 0.0, "max": 0.0})
+        t["count"] += 1
+        t["sum"] += value
+        if value > t["max"]:
+            t["max"] = value
+
+
+def get(name: str) -> float:
+    with _lock:
+        return _counters.get(name, _gauges.get(name, 0))
+
+
+def snapshot() -> dict:
+    with _lock:
+        timings = {
+            k: {**v, "avg": (v["sum"] / v["count"]) if v["count"] else 0.0}
+            for k, v in _timings.items()
+        }
+        return {"counters": dict(_counters), "gauges": dict(_gauges), "timings": timings}
+
+
+def format_snapshot() -> str:
+    """Текстовый отчёт для админ-команды."""
+    snap = snapshot()
+    lines = []
+    for k in sorted(snap["counters"]):
+        lines.append(f"{k}: {snap['counters'][k]:g}")
+    for k in sorted(snap["gauges"]):
+        lines.append(f"{k}: {snap['gauges'][k]:g}")
+    for k in sorted(snap["timings"]):
+        t = snap["timings"][k]
+        lines.append(f"{k}: n={t['count']} avg={t['avg']:.3f} max={t['max']:.3f}")
+    return "\n".join(lines) or "Метрик пока нет."
@@ -0,0 +1,79 @@
+# middleware.py - Порядок обработки сообщений одного пользователя
+
+import asyncio
+import time
+from typing import Any, Awaitable, Callable, Dict
+
+from aiogram import BaseMiddleware
+from aiogram.types import Message, TelegramObject
+
+import metrics
+
+
+class _UserQueue:
+    __slots__ = ("lock", "depth")
+
+    def __init__(self):
+        self.lock = asyncio.Lock()
+        self.depth = 0  # сообщения в работе + ожидающие
+
+
+class UserOrderingMiddleware(BaseMiddleware):
+    """
+    Хендлеры aiogram выполняются параллельно, поэтому два быстрых сообщения
+    одного пользователя («да» сразу после плана, две еды подряд) гоняются за
+    pending-действием и дневными итогами. Здесь сообщения одного user_id
+    выстраиваются в очередь на asyncio.Lock (FIFO), разные пользователи
+    обрабатываются параллельно. Очередь пользователя живёт, пока в ней что-то есть.
+    max_queue > 0 — сообщения сверх этой глубины отбрасываются (по умолчанию
+    выключено: еду или «да» терять нельзя, глубину видно в user_queue_depth).
+    """
+
+    def __init__(self, max_queue: int = 0):
+        self.max_queue = max_queue
+        self._queues: Dict[int, _UserQueue] = {}
+        self._waiting = 0
+
+    def _publish(self):
+        metrics.set_gauge("user_queues_active", len(self._queues))
+        metrics.set_gauge("user_queue_waiting", self._waiting)
+
+    async def __call__(
+        self,
+        handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+        event: TelegramObject,
+        data: Dict[str, Any],
+    ) -> Any:
+        user = getattr(event, "from_user", None)
+        if user is None:
+            return await handler(event, data)
+
+        q = self._queues.get(user.id)
+        if q is None:
+            q = self._queues[user.id] = _UserQueue()
+        if self.max_queue and q.depth >= self.max_queue:
+            metrics.inc("user_queue_dropped")
+            if isinstance(event, Message):
+                await event.answer("⏳ Обрабатываю предыдущие сообщения, подожди немного.")
+            return None
+
+        q.depth += 1
+        metrics.observe("user_queue_depth", q.depth)
+        self._waiting += 1
+        self._publish()
+        t0 = time.perf_counter()
+        waiting = True
+        try:
+            async with q.lock:
+                waiting = False
+                self._waiting -= 1
+                self._publish()
+                metrics.observe("user_queue_wait_seconds", time.perf_counter() - t0)
+                return await handler(event, data)
+        finally:
+            if waiting:  # отменили, пока ждали своей очереди
+                self._waiting -= 1
+            q.depth -= 1
+            if q.depth == 0:
+                self._queues.pop(user.id, None)
+            self._publish()
@@ -3,19 +3,20 @@ import json
 ALLOWED_TOOLS = {
     "log_meal",
     "get_remaining_calories",
+    "calorie_summary",
     "log_weight",
     "create_plan",
     "workout",
     "progress",
     "show_weight",
+    "show_goal",
     "chat",
 }
 
-def parse_tool_call(text: str):
+def parse_tool_call_strict(text: str):
     """
-    Ожидается строгий JSON:
-    {"tool": "<one_of_allowed>", "data": "<string>", "response": "<string>"}
-    При любой ошибке — фоллбек ("chat", "", <raw_text>).
+    Строгий JSON: {"tool": "<one_of_allowed>", "data": "<string>", "response": "<string>"}.
+    Возвращает (tool, data, response) или None, если ответ не соответствует контракту.
     """
     try:
         obj = json.loads(text or "")
@@ -33,5 +34,17 @@ def parse_tool_call(text: str):
 
         return tool, data, resp
     except Exception:
+        return None
+
+
+def parse_tool_call(text: str):
+    """
+    Ожидается строгий JSON:
+    {"tool": "<one_of_allowed>", "data": "<string>", "response": "<string>"}
+    При любой ошибке — фоллбек ("chat", "", <raw_text>).
+    """
+    parsed = parse_tool_call_strict(text)
+    if parsed is None:
         # Фоллбек: обычный ответ чатом
         return "chat", "", (text or "").strip()
+    return parsed
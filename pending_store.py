@@ -0,0 +1,93 @@
+# pending_store.py - Действия, ждущие подтверждения («да»/«нет»): SQLite + TTL + кэш в памяти
+
+import json
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+
+import metrics
+from config import PENDING_TTL_SECONDS, PENDING_CACHE_SIZE
+from database import (
+    put_pending_action,
+    upsert_pending_action,
+    get_pending_action,
+    pop_pending_action,
+    take_pending_action,
+    purge_pending_actions,
+)
+from repository import repository
+
+
+class PendingStore:
+    """
+    Источник истины — таблица pending_actions (переживает рестарт, видна всем воркерам).
+    Спереди — ограниченный LRU на чтение. Забор действия (pop) всегда идёт в БД
+    одним DELETE … RETURNING, поэтому два воркера не применят один план дважды.
+    """
+
+    def __init__(self, ttl_seconds: float, cache_size: int):
+        self.ttl_seconds = ttl_seconds
+        self.cache_size = cache_size
+        self._cache: OrderedDict[int, tuple[dict, float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _cache_put(self, user_id: int, action: dict, expires_mono: float):
+        with self._lock:
+            self._cache[user_id] = (action, expires_mono)
+            self._cache.move_to_end(user_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def invalidate(self, user_id: int):
+        """Забывает кэш пользователя (строку в БД удаляет вызывающий, например сброс профиля)."""
+        with self._lock:
+            self._cache.pop(user_id, None)
+
+    def put(self, user_id: int, action: dict):
+        expires_at = (datetime.now() + timedelta(seconds=self.ttl_seconds)).isoformat()
+        repository.write(upsert_pending_action, put_pending_action, user_id,
+                         action["type"], json.dumps(action.get("payload"), ensure_ascii=False), expires_at)
+        self._cache_put(user_id, action, time.monotonic() + self.ttl_seconds)
+
+    def get(self, user_id: int) -> dict | None:
+        with self._lock:
+            item = self._cache.get(user_id)
+            if item is not None:
+                action, expires_mono = item
+                if expires_mono > time.monotonic():
+                    self._cache.move_to_end(user_id)
+                    metrics.inc("pending_cache_hits")
+                    return action
+                del self._cache[user_id]
+
+        row = get_pending_action(user_id, datetime.now().isoformat())
+        if row is None:
+            return None
+        type_, payload, expires_at = row
+        action = {"type": type_, "payload": json.loads(payload)}
+        left = (datetime.fromisoformat(expires_at) - datetime.now()).total_seconds()
+        self._cache_put(user_id, action, time.monotonic() + left)
+        return action
+
+    def pop(self, user_id: int) -> dict | None:
+        self.invalidate(user_id)
+        row = repository.write(take_pending_action, pop_pending_action, user_id, datetime.now().isoformat())
+        if row is None:
+            return None
+        type_, payload = row
+        return {"type": type_, "payload": json.loads(payload)}
+
+    def sweep(self) -> int:
+        """Удаляет протухшие действия из БД и кэша."""
+        now = time.monotonic()
+        with self._lock:
+            for uid in [u for u, (_, exp) in self._cache.items() if exp <= now]:
+                del self._cache[uid]
+        n = purge_pending_actions(datetime.now().isoformat())
+        if n:
+            metrics.inc("pending_expired", n)
+        return n
+
+
+pending_store = PendingStore(PENDING_TTL_SECONDS, PENDING_CACHE_SIZE)
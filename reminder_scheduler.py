@@ -0,0 +1,101 @@
+# reminder_scheduler.py
+"""
+Планировщик еженедельных напоминаний о взвешивании.
+
+В БД у каждого пользователя лежит settings.next_reminder_due (индексирован),
+его пересчитывают запись веса и отправка напоминания. Планировщик раз в
+refresh секунд подтягивает по индексу тех, чей срок наступает в ближайшие
+horizon секунд, держит их в min-heap и спит ровно до ближайшего срока.
+Перед отправкой кандидаты перепроверяются в БД: вес мог прийти уже после
+планирования. Стоимость цикла пропорциональна числу «созревших», а не всех.
+"""
+import asyncio
+import heapq
+import time
+from datetime import datetime, timedelta
+from typing import Dict, List, Tuple
+
+import metrics
+from executors import run_db
+from database import (
+    list_reminders_due,
+    filter_reminders_due,
+    mark_weighin_reminders_sent,
+    touch_weighin_reminders,
+    disable_weekly_reminders,
+)
+from repository import repository
+
+
+def _mark_sent(user_ids: List[int]):
+    repository.write_users(touch_weighin_reminders, mark_weighin_reminders_sent, user_ids)
+
+
+class ReminderScheduler:
+    def __init__(self, broadcaster, text: str, horizon: float = 3600.0, refresh: float = 300.0):
+        self.broadcaster = broadcaster
+        self.text = text
+        self.horizon = horizon
+        self.refresh = refresh
+        self._heap: List[Tuple[float, int]] = []
+        self._scheduled: Dict[int, float] = {}   # user_id -> актуальный due (старые записи в heap пропускаем)
+        self._next_refresh = 0.0
+
+    def schedule(self, user_id: int, due_ts: float):
+        if self._scheduled.get(user_id) == due_ts:
+            return
+        self._scheduled[user_id] = due_ts
+        heapq.heappush(self._heap, (due_ts, user_id))
+
+    def __len__(self) -> int:
+        return len(self._scheduled)
+
+    async def _refresh(self):
+        until = (datetime.now() + timedelta(seconds=self.horizon)).isoformat()
+        rows = await run_db(list_reminders_due, until)
+        for user_id, due in rows:
+            self.schedule(user_id, datetime.fromisoformat(due).timestamp())
+        self._next_refresh = time.time() + self.refresh
+        metrics.set_gauge("reminders_scheduled", len(self._scheduled))
+
+    def _pop_due(self, now: float) -> List[int]:
+        due: List[int] = []
+        while self._heap and self._heap[0][0] <= now:
+            ts, user_id = heapq.heappop(self._heap)
+            if self._scheduled.get(user_id) != ts:
+                continue  # перепланирован — устаревшая запись
+            del self._scheduled[user_id]
+            due.append(user_id)
+        return due
+
+    async def _send(self, user_ids: List[int]):
+        user_ids = await run_db(filter_reminders_due, user_ids, datetime.now().isoformat())
+        if not user_ids:
+            return
+        metrics.inc("reminders_due", len(user_ids))
+        await self.broadcaster.send_all(
+            user_ids,
+            self.text,
+            on_sent=_mark_sent,
+            on_blocked=disable_weekly_reminders,
+        )
+
+    async def run(self):
+        while True:
+            try:
+                now = time.time()
+                if now >= self._next_refresh:
+                    await self._refresh()
+                due = self._pop_due(now)
+                if due:
+                    await self._send(due)
+                    continue
+                wake = self._next_refresh
+                if self._heap:
+                    wake = min(wake, self._heap[0][0])
+                await asyncio.sleep(max(0.0, wake - time.time()))
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"[reminder] scheduler error: {e}")
+                await asyncio.sleep(5)
@@ -0,0 +1,221 @@
+# repository.py - Групповая запись в SQLite: один писатель, commit пачками
+"""
+Каждая запись database.py — своя транзакция и свой commit, а писатель в SQLite
+один: под нагрузкой запросы выстраиваются в очередь за блокировкой и fsync.
+
+Здесь все записи процесса идут через один поток-писатель с отдельным
+соединением (synchronous=FULL). Он забирает из очереди всё накопившееся —
+до REPO_BATCH_MAX операций, подождав попутчиков не дольше REPO_COMMIT_INTERVAL_MS
+после первой, — и выполняет пачку одной транзакцией: один commit и один fsync
+на всех. Каждая операция — в своём SAVEPOINT: ошибка одной откатывает только её.
+Каждый вызов получает future, которая завершается, когда запись зафиксирована
+на диске (или с исключением операции).
+
+При DB_SHARDS > 1 у каждого файла-шарда свой писатель и своя очередь: операция
+уходит писателю шарда пользователя, и пачки разных шардов коммитятся параллельно.
+
+Чтения идут мимо писателя — через соединения потоков (database.get_conn) в DB_EXECUTOR.
+
+Вызывающий код пишет через write*(op, direct, ...): op(cursor, ...) уходит писателю,
+а если писатель не запущен или поток уже внутри transaction() на этот файл —
+выполняется direct(...) своей транзакцией.
+
+    repository.write(insert_meal_entry, save_meal_entry, user_id, "яблоко", 52)
+
+Мимо писателя идут только редкие служебные записи: init_db и пересборки, очистки
+(purge_*, clear_*, delete_*), отключение напоминаний заблокировавшим бота
+и пополнение пула тренировок (одна запись на генерацию LLM).
+"""
+
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+import metrics
+from config import REPO_BATCH_MAX, REPO_COMMIT_INTERVAL_MS
+import database
+from database import open_writer_conn, all_db_paths, in_transaction, user_db, group_by_db
+
+
+class RepositoryStopped(RuntimeError):
+    pass
+
+
+class GroupCommitRepository:
+    def __init__(self, batch_max: int = REPO_BATCH_MAX, interval_ms: float = REPO_COMMIT_INTERVAL_MS):
+        self.batch_max = batch_max
+        self.interval = interval_ms / 1000.0
+        # по писателю (потоку, очереди) на файл-шард БД
+        self._queues: list[queue.Queue] = []
+        self._by_path: dict[str, queue.Queue] = {}
+        self._threads: list[threading.Thread] = []
+        self._lock = threading.Lock()
+
+    @property
+    def running(self) -> bool:
+        return bool(self._threads) and all(t.is_alive() for t in self._threads)
+
+    def start(self):
+        with self._lock:
+            if self.running:
+                return
+            paths = all_db_paths()
+            self._queues = [queue.Queue() for _ in paths]
+            self._by_path = dict(zip(paths, self._queues))
+            self._threads = [
+                threading.Thread(target=self._run, args=(q, path), name=f"db-writer-{i}", daemon=True)
+                for i, (q, path) in enumerate(zip(self._queues, paths))
+            ]
+            for t in self._threads:
+                t.start()
+        print(f"[REPO] group commit writers started: {len(self._threads)} "
+              f"(batch ≤ {self.batch_max}, window {self.interval * 1000:.0f} ms)")
+
+    def stop(self, timeout: float = 10.0):
+        """Дописывает очереди и останавливает писателей."""
+        with self._lock:
+            threads, self._threads = self._threads, []
+        if not threads:
+            return
+        for q in self._queues:
+            q.put(None)
+        for t in threads:
+            t.join(timeout)
+        # поставленное после остановки уже никто не запишет
+        for q in self._queues:
+            while True:
+                try:
+                    item = q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    item[3].set_exception(RepositoryStopped("group commit writer stopped"))
+
+    # ---------- постановка в очередь ----------
+
+    def submit(self, op, user_id: int, *args, **kwargs) -> Future:
+        """
+        op(cursor, user_id, *args, **kwargs) выполнится в следующей пачке шарда пользователя;
+        future — результат op после commit.
+        """
+        return self.submit_to(user_db(user_id), op, user_id, *args, **kwargs)
+
+    def submit_to(self, path: str | None, op, *args, **kwargs) -> Future:
+        """op(cursor, *args, **kwargs) в пачке писателя файла path (None — DB_PATH, общие таблицы)."""
+        fut: Future = Future()
+        if not self.running:
+            fut.set_exception(RepositoryStopped("group commit writer is not running"))
+            return fut
+        q = self._by_path[path or database.DB_PATH]
+        q.put((op, args, kwargs, fut, time.perf_counter()))
+        metrics.set_gauge("repo_queue", q.qsize())
+        return fut
+
+    # ---------- синхронная запись из потоков пулов (не из event loop) ----------
+
+    def write_to(self, path: str | None, op, direct, *args, **kwargs):
+        """
+        Через писателя файла path, дождавшись фиксации пачки; иначе direct(*args) своей
+        транзакцией. Внутри уже открытой transaction() на этот файл пишем в неё же:
+        она должна зафиксироваться целиком, а писатель ждал бы её блокировку.
+        """
+        if self.running and not in_transaction(path):
+            return self.submit_to(path, op, *args, **kwargs).result()
+        return direct(*args, **kwargs)
+
+    def write(self, op, direct, user_id: int, *args, **kwargs):
+        """Запись данных пользователя — в его шард."""
+        return self.write_to(user_db(user_id), op, direct, user_id, *args, **kwargs)
+
+    def write_shared(self, op, direct, *args, **kwargs):
+        """Запись в общие таблицы (DB_PATH)."""
+        return self.write_to(None, op, direct, *args, **kwargs)
+
+    def write_users(self, op, direct, user_ids: list[int], *args, **kwargs):
+        """op(cursor, user_ids_шарда, ...) — по одной операции на каждый затронутый шард."""
+        for path, uids in group_by_db(user_ids).items():
+            self.write_to(path, op, direct, uids, *args, **kwargs)
+
+    # ---------- писатель ----------
+
+    def _next_batch(self, q: queue.Queue, first) -> tuple[list, bool]:
+        batch, stop = [first], False
+        deadline = time.monotonic() + self.interval
+        while len(batch) < self.batch_max:
+            try:
+                timeout = deadline - time.monotonic()
+                item = q.get(timeout=timeout) if timeout > 0 else q.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                stop = True
+                break
+            batch.append(item)
+        return batch, stop
+
+    def _run(self, q: queue.Queue, path: str):
+        conn = open_writer_conn(path)
+        try:
+            stop = False
+            while not stop:
+                first = q.get()
+                if first is None:
+                    break
+                batch, stop = self._next_batch(q, first)
+                self._commit(conn, batch)
+            # остановка: всё, что успели поставить, тоже записываем
+            rest = []
+            while True:
+                try:
+                    item = q.get_nowait()
+                except queue.Empty:
+                    break
+                if item is not None:
+                    rest.append(item)
+            for i in range(0, len(rest), self.batch_max):
+                self._commit(conn, rest[i:i + self.batch_max])
+        finally:
+            conn.close()
+
+    def _commit(self, conn, batch: list):
+        t0 = time.perf_counter()
+        c = conn.cursor()
+        results = []
+        try:
+            c.execute("BEGIN IMMEDIATE")
+            for op, args, kwargs, fut, _ in batch:
+                c.execute("SAVEPOINT op")
+                try:
+                    results.append((fut, op(c, *args, **kwargs), None))
+                    c.execute("RELEASE op")
+                except Exception as e:
+                    c.execute("ROLLBACK TO op")
+                    c.execute("RELEASE op")
+                    results.append((fut, None, e))
+            c.execute("COMMIT")
+        except Exception as e:
+            # не удалось зафиксировать пачку (диск, блокировка) — ошибка у всех её операций
+            if conn.in_transaction:
+                conn.rollback()
+            print(f"[REPO] batch of {len(batch)} failed: {e}")
+            metrics.inc("repo_batch_errors")
+            for _, _, _, fut, _ in batch:
+                fut.set_exception(e)
+            return
+        finally:
+            c.close()
+
+        done = time.perf_counter()
+        metrics.observe("repo_commit_seconds", done - t0)
+        metrics.observe("repo_batch_size", len(batch))
+        metrics.inc("repo_ops", len(batch))
+        for (fut, result, error), item in zip(results, batch):
+            metrics.observe("repo_op_latency_seconds", done - item[4])
+            if error is not None:
+                fut.set_exception(error)
+            else:
+                fut.set_result(result)
+
+
+repository = GroupCommitRepository()
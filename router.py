@@ -1,15 +1,30 @@
 # router.py - LangChain Agent Router
 
+import random
 import re
-from typing import Dict
+import threading
+from contextvars import ContextVar
 from langchain.agents import AgentExecutor, create_react_agent
 from langchain.memory import ConversationBufferMemory
 from langchain.prompts import PromptTemplate
+from langchain.tools import Tool
 
-from config import get_llm
+import metrics
+from agent import call_ai
+from config import get_llm, INTENT_CONFIDENCE, INTENT_LOG, INTENT_LOG_SAMPLE, ROUTER_MODE, RULE_CONFIDENCE
+from parse import parse_tool_call_strict
+from database import log_intent, insert_intent
+from repository import repository
+from executors import LLMSlotCallback, run_llm
+from memory_store import memory_store
+from context import context_assembler, PromptTokenCounter
+from intents import classify as classify_intent
+from intent_classifier import get_intent_classifier, AgentToolRecorder
+from streaming import current_sink, FinalAnswerStreamer
 from tools import (
     log_meal,
     get_remaining_calories,
+    show_calorie_summary,
     log_weight_entry,
     generate_workout,
     analyze_progress,
@@ -19,20 +34,20 @@ from tools import (
     propose_weight_loss_plan,
     confirm_pending_action,
     cancel_pending_action,
-    get_all_tools,
 )
 
 # ==================== Memory для каждого пользователя ====================
-user_memories: Dict[int, ConversationBufferMemory] = {}
+# Ограниченное хранилище: LRU/TTL по пользователям, лимит сообщений, выгрузка в SQLite
+user_memories = memory_store
 
 def get_or_create_memory(user_id: int) -> ConversationBufferMemory:
     """Получает или создает память для пользователя"""
-    if user_id not in user_memories:
-        user_memories[user_id] = ConversationBufferMemory(
-            memory_key="chat_history",
-            return_messages=True
-        )
-    return user_memories[user_id]
+    return user_memories.get(user_id)
+
+
+def remember(user_id: int, user_text: str, result: str):
+    """Сохраняет реплику в память пользователя (с обрезкой по лимитам)."""
+    user_memories.save_context(user_id, user_text, result)
 
 
 # ==================== LangChain Agent ====================
@@ -73,83 +88,90 @@ Final Answer: окончательный ответ на исходный вхо
 - План/цель (цель X, похудеть на X) → create_plan
 - Тренировка (создай/дай тренировку) → workout
 - Остаток калорий (сколько осталось, остаток) → get_remaining_calories
+- Сводка за неделю/месяц (сколько съел за неделю, итоги месяца) → calorie_summary
 - Прогресс (мой прогресс, как дела) → progress или show_weight
 
 Начнем!
 
+История диалога (учитывай контекст, но отвечай на последний вопрос):
+{chat_history}
+
 Question: {input}
 Thought:{agent_scratchpad}"""
 
-def create_fitness_agent(user_id: int) -> AgentExecutor:
-    """Создает LangChain агента для конкретного пользователя"""
-    llm = get_llm()
-    tools = get_all_tools()
-    
-    # Оборачиваем tools чтобы передавать user_id автоматически
-    def wrap_tool(tool_func, tool_name, tool_description):
-        """Обертка для передачи user_id в tool"""
-        from langchain.tools import Tool
-        
-        def wrapped_func(input_str: str) -> str:
-            # Парсим вход - может быть просто строка или user_id + данные
-            return tool_func(user_id, input_str)
-        
-        return Tool(
-            name=tool_name,
-            func=wrapped_func,
-            description=tool_description
-        )
-    
-    # Создаем обернутые tools с user_id
-    from langchain.tools import Tool
-    
-    wrapped_tools = [
-        Tool(
-            name="log_meal",
-            func=lambda desc: log_meal(user_id, desc),
-            description="Логирует приём пищи. Вход: описание еды (например: '2 яйца', 'борщ 300 мл')"
-        ),
-        Tool(
-            name="get_remaining_calories",
-            func=lambda _: get_remaining_calories(user_id),
-            description="Показывает остаток калорий на сегодня. Вход: пустая строка или любой текст"
-        ),
-        Tool(
-            name="log_weight",
-            func=lambda weight_str: log_weight_entry(user_id, float(re.search(r'\d+(?:[.,]\d+)?', weight_str).group().replace(',', '.')) if re.search(r'\d+(?:[.,]\d+)?', weight_str) else 0),
-            description="Сохраняет вес пользователя. Вход: вес в кг (число)"
-        ),
-        Tool(
-            name="create_plan",
-            func=lambda goal_text: propose_weight_loss_plan(user_id, goal_text),
-            description="Создает план похудения. Вход: описание цели ('цель 75', 'на 10 кг за 12 недель')"
-        ),
-        Tool(
-            name="workout",
-            func=lambda prefs: generate_workout(user_id, prefs),
-            description="Генерирует тренировку. Вход: предпочтения ('60 минут', 'кардио', 'для начинающих')"
-        ),
-        Tool(
-            name="progress",
-            func=lambda _: analyze_progress(user_id),
-            description="Показывает прогресс по весу. Вход: пустая строка"
-        ),
-        Tool(
-            name="show_weight",
-            func=lambda _: show_current_weight(user_id),
-            description="Показывает текущий вес. Вход: пустая строка"
-        ),
-        Tool(
-            name="show_goal",
-            func=lambda _: show_current_goal(user_id),
-            description="Показывает текущую цель по калориям. Вход: пустая строка"
-        ),
+
+# Текущий пользователь агента: выставляется из входа invoke_agent на время вызова,
+# поэтому один общий AgentExecutor обслуживает всех пользователей.
+_agent_user_id: ContextVar[int] = ContextVar("agent_user_id")
+
+
+def _uid() -> int:
+    return _agent_user_id.get()
+
+
+def _log_weight_from_text(user_id: int, weight_str: str) -> str:
+    m = re.search(r'\d+(?:[.,]\d+)?', weight_str or "")
+    return log_weight_entry(user_id, float(m.group().replace(',', '.')) if m else 0)
+
+
+# Общая таблица инструментов: имя (= parse.ALLOWED_TOOLS) → (функция(user_id, вход), описание).
+# По ней строятся и tools ReAct-агента, и прямой вызов в структурированном роутере.
+TOOL_DISPATCH = {
+    "log_meal": (
+        lambda uid, desc: log_meal(uid, desc),
+        "Логирует приём пищи. Вход: описание еды (например: '2 яйца', 'борщ 300 мл')",
+    ),
+    "get_remaining_calories": (
+        lambda uid, _: get_remaining_calories(uid),
+        "Показывает остаток калорий на сегодня. Вход: пустая строка или любой текст",
+    ),
+    "calorie_summary": (
+        lambda uid, period: show_calorie_summary(uid, period),
+        "Сводка калорий за период. Вход: 'неделя' или 'месяц'",
+    ),
+    "log_weight": (
+        _log_weight_from_text,
+        "Сохраняет вес пользователя. Вход: вес в кг (число)",
+    ),
+    "create_plan": (
+        lambda uid, goal_text: propose_weight_loss_plan(uid, goal_text),
+        "Создает план похудения. Вход: описание цели ('цель 75', 'на 10 кг за 12 недель')",
+    ),
+    "workout": (
+        lambda uid, prefs: generate_workout(uid, prefs),
+        "Генерирует тренировку. Вход: предпочтения ('60 минут', 'кардио', 'для начинающих')",
+    ),
+    "progress": (
+        lambda uid, _: analyze_progress(uid),
+        "Показывает прогресс по весу. Вход: пустая строка",
+    ),
+    "show_weight": (
+        lambda uid, _: show_current_weight(uid),
+        "Показывает текущий вес. Вход: пустая строка",
+    ),
+    "show_goal": (
+        lambda uid, _: show_current_goal(uid),
+        "Показывает текущую цель по калориям. Вход: пустая строка",
+    ),
+}
+
+
+def _build_agent_tools() -> list[Tool]:
+    """Tools агента; user_id берётся из контекста вызова, а не из замыкания."""
+    return [
+        Tool(name=name, func=lambda arg, fn=fn: fn(_uid(), arg), description=description)
+        for name, (fn, description) in TOOL_DISPATCH.items()
     ]
-    
+
+
+def create_fitness_agent(streaming: bool = False) -> AgentExecutor:
+    """Собирает LangChain агента (LLM, prompt, tools). Вызывается один раз на процесс и режим."""
+    llm = get_llm(streaming)
+    wrapped_tools = _build_agent_tools()
     prompt = PromptTemplate.from_template(AGENT_PROMPT)
-    
+
     agent = create_react_agent(llm, wrapped_tools, prompt)
-    
+
     agent_executor = AgentExecutor(
         agent=agent,
         tools=wrapped_tools,
@@ -158,116 +180,213 @@ def create_fitness_agent(user_id: int) -> AgentExecutor:
         handle_parsing_errors=True,
         return_intermediate_steps=False,
     )
-    
+
     return agent_executor
 
 
+_agent_executors: dict[bool, AgentExecutor] = {}
+_agent_lock = threading.Lock()
+
+
+def get_fitness_agent(streaming: bool = False) -> AgentExecutor:
+    """Общий агент: AgentExecutor не хранит состояние запроса, его можно вызывать из разных потоков."""
+    executor = _agent_executors.get(streaming)
+    if executor is None:
+        with _agent_lock:
+            executor = _agent_executors.get(streaming)
+            if executor is None:
+                executor = _agent_executors[streaming] = create_fitness_agent(streaming)
+    return executor
+
+
+_llm_slot_callback = LLMSlotCallback()
+
+
+def invoke_agent(user_text: str, user_id: int, chat_history: str = "", callbacks: list | None = None) -> dict:
+    """Вызывает общий агент; user_id передаётся во входе и виден tools через контекст."""
+    inputs = {"input": user_text, "user_id": user_id, "chat_history": chat_history or "(пусто)"}
+    counter = PromptTokenCounter()
+    callbacks = [counter, _llm_slot_callback, *(callbacks or [])]
+    sink = current_sink()
+    if sink is not None:
+        callbacks.append(FinalAnswerStreamer(sink))
+    token = _agent_user_id.set(inputs["user_id"])
+    try:
+        return get_fitness_agent(streaming=sink is not None).invoke(inputs, config={"callbacks": callbacks})
+    finally:
+        _agent_user_id.reset(token)
+        counter.report()
+        print(f"[AGENT] tokens: prompt={counter.prompt_tokens} completion={counter.completion_tokens} calls={counter.calls}")
+
+
+# ==================== Структурированный роутер (один вызов LLM) ====================
+
+STRUCTURED_ROUTER_PROMPT = """Ты фитнес-ассистент: помогаешь с питанием, весом и тренировками.
+Выбери ОДИН инструмент для последнего сообщения пользователя.
+
+Инструменты:
+{tools}
+- chat: совет, вопрос, разговор (ответ напишет отдельный вызов)
+
+Правила:
+- Советы («дай пример завтрака», «что поесть», «рецепт», «идеи для перекуса») → chat.
+- log_meal ТОЛЬКО если еда уже съедена: «я съел X», «выпил X», «на завтрак было X».
+- Вес (взвесился X, вес X кг) → log_weight; цель/план (цель X, похудеть на X) → create_plan.
+- Сводка за неделю/месяц → calorie_summary; остаток на сегодня → get_remaining_calories.
+
+Ответь строго JSON-объектом без пояснений:
+{{"tool": "<имя>", "data": "<вход инструмента или пустая строка>"}}"""
+
+
+def _structured_system() -> str:
+    tools = "\n".join(f"- {name}: {description}" for name, (_, description) in TOOL_DISPATCH.items())
+    return STRUCTURED_ROUTER_PROMPT.format(tools=tools)
+
+
+def structured_route(user_text: str, user_id: int, chat_history: str = "") -> tuple[str, str] | None:
+    """
+    Выбор инструмента одним вызовом LLM в JSON mode (контракт parse.parse_tool_call)
+    и прямой вызов функции из TOOL_DISPATCH. Возвращает (tool, ответ) или None —
+    ответ не прошёл проверку, пусть разбирается ReAct-агент.
+    JSON-вызов (temperature=0) только выбирает инструмент; ответ для chat пишет
+    small_talk с историей — с обычной температурой и потоково, если есть приёмник.
+    """
+    prompt = f"История диалога:\n{chat_history or '(пусто)'}\n\nСообщение: {user_text}"
+    resp = call_ai(user_id, prompt, system=_structured_system(), temperature=0, json_mode=True)
+    parsed = parse_tool_call_strict(resp.get("response", ""))
+    if parsed is None:
+        metrics.inc("structured_router_invalid")
+        return None
+    tool, data, _ = parsed
+    if tool == "chat":
+        return tool, small_talk(user_id, user_text, chat_history, temperature=None)
+    fn, _ = TOOL_DISPATCH[tool]
+    return tool, fn(user_id, data or user_text)
+
+
 # ==================== Основной роутер ====================
 
-# Прямые триггеры команд (до агента)
-INTENT_RULES = [
-    ("трениров", "workout"),
-    ("прогресс", "progress"),
-    ("остаток", "get_remaining_calories"),
-    ("мой вес", "show_weight"),
-    ("вес?", "show_weight"),
-    ("моя цель", "show_goal"),
-    ("текущая цель", "show_goal"),
-    ("я съел", "log_meal"),
-    ("съел", "log_meal"),
-    ("я выпил", "log_meal"),
-    ("выпил", "log_meal"),
-    ("завтрак", "log_meal"),
-    ("обед", "log_meal"),
-    ("ужин", "log_meal"),
-    ("перекус", "log_meal"),
-    ("взвес", "log_weight"),
-    ("вес ", "log_weight"),
-]
-
-def _rule_intent(text: str) -> str | None:
-    t = (text or "").lower()
-    for needle, tool in INTENT_RULES:
-        if needle in t:
-            return tool
+def _run_intent(intent: str, user_id: int, user_text: str) -> str | None:
+    """Выполняет намерение напрямую, без агента. None — намерение нельзя выполнить по этому тексту."""
+    if intent in ("goal", "create_plan"):
+        return propose_weight_loss_plan(user_id, user_text)
+    if intent == "workout":
+        return generate_workout(user_id, user_text)
+    if intent == "progress":
+        return analyze_progress(user_id)
+    if intent == "get_remaining_calories":
+        return get_remaining_calories(user_id)
+    if intent == "calorie_summary":
+        return show_calorie_summary(user_id, user_text)
+    if intent == "show_weight":
+        return show_current_weight(user_id)
+    if intent == "show_goal":
+        return show_current_goal(user_id)
+    if intent == "log_weight":
+        m = re.search(r"(\d+(?:[.,]\d+)?)", user_text or "")
+        if m:
+            return log_weight_entry(user_id, float(m.group(1).replace(",", ".")))
+        return None
+    if intent == "log_meal":
+        return log_meal(user_id, user_text)
     return None
 
 
+def _log_intent(user_id: int, user_text: str, intent: str, source: str):
+    if not INTENT_LOG or random.random() >= INTENT_LOG_SAMPLE:
+        return
+    try:
+        repository.write(insert_intent, log_intent, user_id, user_text, intent, source)
+    except Exception as e:
+        print(f"[INTENT] log error: {e}")
+
+
 def llm_route(user_text: str, user_id: int) -> str:
     """
     Главная функция маршрутизации с использованием LangChain Agent.
     Сохраняет совместимость с текущей логикой.
     """
-    t = (user_text or "").lower().strip()
+    # Одна компилированная регулярка: подтверждение/отмена, цель и жёсткие правила
+    # с явными приоритетами (см. intents.RULES)
+    intent = classify_intent(user_text)
+    forced = None
+    if intent is not None:
+        if intent.confidence >= RULE_CONFIDENCE:
+            forced = intent.intent
+        else:
+            # слабое правило («обед …») не решает само — дальше классификатор и агент
+            metrics.inc("intent_rule_low_confidence")
 
     # ——— Подтверждение/отмена (высший приоритет) ———
-    if t in {"да", "ок", "окей", "согласен", "подтверждаю"}:
+    if forced == "confirm":
         result = confirm_pending_action(user_id)
-        memory = get_or_create_memory(user_id)
-        memory.save_context({"input": user_text}, {"output": result})
+        remember(user_id, user_text, result)
         return result
-        
-    if t in {"нет", "не", "отмена", "отменить"}:
+
+    if forced == "cancel":
         result = cancel_pending_action(user_id)
-        memory = get_or_create_memory(user_id)
-        memory.save_context({"input": user_text}, {"output": result})
+        remember(user_id, user_text, result)
         return result
 
-    # ——— Быстрая цель (второй приоритет) ———
-    # Проверяем "цель X" или "похудеть на X кг"
-    if ("цель" in t and re.search(r"(\d+(?:[.,]\d+)?)", t)) or \
-       ("похуд" in t and "кг" in t and re.search(r"(\d+(?:[.,]\d+)?)", t)):
+    # ——— Быстрая цель: «цель 75», «похудеть на 10 кг» ———
+    if forced == "goal":
         result = propose_weight_loss_plan(user_id, user_text)
-        memory = get_or_create_memory(user_id)
-        memory.save_context({"input": user_text}, {"output": result})
+        _log_intent(user_id, user_text, forced, "rule")
+        remember(user_id, user_text, result)
         return result
 
     # ——— Жёсткие правила (третий приоритет) ———
-    forced = _rule_intent(user_text)
     if forced:
-        if forced == "workout":
-            result = generate_workout(user_id, user_text)
-        elif forced == "progress":
-            result = analyze_progress(user_id)
-        elif forced == "get_remaining_calories":
-            result = get_remaining_calories(user_id)
-        elif forced == "show_weight":
-            result = show_current_weight(user_id)
-        elif forced == "show_goal":
-            result = show_current_goal(user_id)
-        elif forced == "log_weight":
-            m = re.search(r"(\d+(?:[.,]\d+)?)", user_text or "")
-            if m:
-                result = log_weight_entry(user_id, float(m.group(1).replace(",", ".")))
-            else:
-                result = "Не смог распознать вес. Пример: «взвесился 85.4»"
-        elif forced == "log_meal":
-            result = log_meal(user_id, user_text)
-        else:
+        result = _run_intent(forced, user_id, user_text)
+        if result is None and forced == "log_weight":
+            result = "Не смог распознать вес. Пример: «взвесился 85.4»"
+        elif result is None:
             result = small_talk(user_id, user_text)
-        
-        memory = get_or_create_memory(user_id)
-        memory.save_context({"input": user_text}, {"output": result})
+        _log_intent(user_id, user_text, forced, "rule")
+        remember(user_id, user_text, result)
         return result
 
+    # ——— Локальный классификатор (четвёртый приоритет) ———
+    model = get_intent_classifier()
+    if model is not None:
+        label, confidence = model.predict(user_text)
+        if label and label != "chat" and confidence >= INTENT_CONFIDENCE:
+            result = _run_intent(label, user_id, user_text)
+            if result is not None:
+                print(f"[INTENT] {label} ({confidence:.2f}) without agent")
+                metrics.inc("intent_classifier_hits")
+                remember(user_id, user_text, result)
+                return result
+        metrics.inc("intent_classifier_misses")
+
     # ——— LangChain Agent (последний приоритет) ———
     try:
-        print(f"[AGENT] Calling LangChain agent for user {user_id}: {user_text}")
-        
-        agent_executor = create_fitness_agent(user_id)
         memory = get_or_create_memory(user_id)
         
-        # Получаем историю из memory
-        history = memory.load_memory_variables({})
-        
-        response = agent_executor.invoke({
-            "input": user_text,
-        })
+        # История из memory, ужатая до бюджета токенов
+        history, history_tokens = context_assembler.build(user_id, list(memory.chat_memory.messages))
+        print(f"[AGENT] history tokens: {history_tokens}")
+
+        # Один структурированный вызов вместо цикла Thought/Action/Observation
+        if ROUTER_MODE == "structured":
+            routed = structured_route(user_text, user_id, history)
+            if routed is not None:
+                tool, result = routed
+                print(f"[ROUTER] structured → {tool}")
+                metrics.inc("structured_router_hits")
+                _log_intent(user_id, user_text, tool, "router")
+                remember(user_id, user_text, result)
+                return result
+
+        print(f"[AGENT] Calling LangChain agent for user {user_id}: {user_text}")
+        recorder = AgentToolRecorder()
+        response = invoke_agent(user_text, user_id, history, callbacks=[recorder])
         
         result = response.get("output", "")
+        _log_intent(user_id, user_text, recorder.tool or "chat", "agent")
         
         # Сохраняем в память
-        memory.save_context({"input": user_text}, {"output": result})
+        remember(user_id, user_text, result)
         
         print(f"[AGENT] Response: {result}")
         return result
@@ -276,6 +395,13 @@ def llm_route(user_text: str, user_id: int) -> str:
         print(f"[AGENT ERROR] {e}")
         # Fallback на старую логику
         result = small_talk(user_id, user_text)
-        memory = get_or_create_memory(user_id)
-        memory.save_context({"input": user_text}, {"output": result})
-        return result
\ No newline at end of file
+        remember(user_id, user_text, result)
+        return result
+
+
+async def allm_route(user_text: str, user_id: int) -> str:
+    """
+    Асинхронная точка входа для бота: синхронный роутер (LangChain, OpenAI, SQLite)
+    выполняется в ограниченном пуле потоков, event loop остаётся свободным.
+    """
+    return await run_llm(llm_route, user_text, user_id)
@@ -0,0 +1,153 @@
+# sessions.py - Кэш пользовательских сессий в памяти с записью насквозь в SQLite
+
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from datetime import datetime
+
+import metrics
+from config import SESSION_CACHE_SIZE, SESSION_TTL_SECONDS
+from database import (
+    create_user_if_not_exists,
+    get_user_data,
+    get_today_calories,
+    save_user_weight,
+    save_meal_entry,
+    save_meal_entries,
+    save_goal,
+    insert_user_if_not_exists,
+    insert_user_weight,
+    insert_meal_entry,
+    insert_meal_entries,
+    insert_goal,
+)
+from repository import repository
+
+
+@dataclass
+class UserSession:
+    """Горячие данные пользователя: профиль, цель, съедено за сегодня."""
+    user_id: int
+    exists: bool = False
+    profile: dict = field(default_factory=dict)
+    day: str = ""
+    calories_today: int = 0
+    expires_at: float = 0.0
+
+    @property
+    def goal_calories(self) -> int | None:
+        return self.profile.get("goal_calories")
+
+    def data(self) -> dict:
+        """Тот же формат, что database.get_user_data()."""
+        if not self.exists:
+            return {}
+        return {**self.profile, "calories_today": self.calories_today}
+
+
+def _today() -> str:
+    return datetime.now().date().isoformat()
+
+
+class SessionCache:
+    """
+    LRU + TTL кэш сессий. Чтения отдаются из памяти, записи идут в database.py
+    и сразу отражаются в сессии — повторные запросы в диалоге не трогают БД.
+    """
+
+    def __init__(self, max_items: int, ttl_seconds: float):
+        self.max_items = max_items
+        self.ttl_seconds = ttl_seconds
+        self._items: OrderedDict[int, UserSession] = OrderedDict()
+        self._lock = threading.RLock()
+
+    def _load(self, user_id: int) -> UserSession:
+        data = get_user_data(user_id)
+        calories_today = data.pop("calories_today", 0) if data else 0
+        s = UserSession(
+            user_id=user_id,
+            exists=bool(data),
+            profile=data,
+            day=_today(),
+            calories_today=int(calories_today or 0),
+            expires_at=time.monotonic() + self.ttl_seconds,
+        )
+        metrics.inc("session_loads")
+        with self._lock:
+            self._items[user_id] = s
+            self._items.move_to_end(user_id)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+                metrics.inc("session_evictions")
+            metrics.set_gauge("sessions_cached", len(self._items))
+        return s
+
+    def get(self, user_id: int) -> UserSession:
+        with self._lock:
+            s = self._items.get(user_id)
+            if s is not None and s.expires_at > time.monotonic():
+                self._items.move_to_end(user_id)
+                if s.day != _today():
+                    # новые сутки — сбрасываем счётчик из дневных итогов
+                    s.day = _today()
+                    s.calories_today = get_today_calories(user_id)
+                metrics.inc("session_hits")
+                return s
+        return self._load(user_id)
+
+    def user_data(self, user_id: int) -> dict:
+        return self.get(user_id).data()
+
+    def invalidate(self, user_id: int):
+        with self._lock:
+            self._items.pop(user_id, None)
+            metrics.set_gauge("sessions_cached", len(self._items))
+
+    # ---------- запись насквозь ----------
+
+    def ensure_user(self, user_id: int, name=None, age=None, weight=None, height=None) -> UserSession:
+        """Известный пользователь без новых данных профиля — ни одного запроса к БД."""
+        profile_given = any(v is not None for v in (name, age, weight, height))
+        s = self.get(user_id)
+        if s.exists and not profile_given:
+            return s
+        repository.write(insert_user_if_not_exists, create_user_if_not_exists, user_id,
+               name=name, age=age, weight=weight, height=height)
+        return self._load(user_id)
+
+    def add_meal(self, user_id: int, description: str, calories: int) -> UserSession:
+        # сессию берём до записи: иначе свежая загрузка уже включит этот приём пищи
+        s = self.get(user_id)
+        repository.write(insert_meal_entry, save_meal_entry, user_id, description, calories)
+        with self._lock:
+            s.calories_today += int(calories)
+        return s
+
+    def add_meals(self, user_id: int, items: list[tuple[str, int]]) -> UserSession:
+        s = self.get(user_id)
+        repository.write(insert_meal_entries, save_meal_entries, user_id, items)
+        with self._lock:
+            s.calories_today += sum(int(calories) for _, calories in items)
+        return s
+
+    def save_weight(self, user_id: int, weight: float) -> UserSession:
+        repository.write(insert_user_weight, save_user_weight, user_id, weight)
+        s = self.get(user_id)
+        with self._lock:
+            if s.exists:
+                s.profile["weight"] = weight
+        return s
+
+    def save_goal(self, user_id: int, goal_text: str, calories: int, proteins: int,
+                  carbs: int, fats: int, weeks: int) -> UserSession:
+        repository.write(insert_goal, save_goal, user_id, goal_text=goal_text, calories=calories,
+               proteins=proteins, carbs=carbs, fats=fats, weeks=weeks)
+        s = self.get(user_id)
+        with self._lock:
+            if s.exists:
+                s.profile["goal_calories"] = calories
+        return s
+
+
+sessions = SessionCache(SESSION_CACHE_SIZE, SESSION_TTL_SECONDS)
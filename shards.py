@@ -0,0 +1,318 @@
+# shards.py - Процессы-воркеры по пользователям: hash(user_id) % K, супервизор с перезапуском
+"""
+Всё состояние бота — по пользователю (sessions, memory_store, pending, строки
+в SQLite по user_id), поэтому обработку легко разделить на K процессов:
+обновление уходит в воркер hash(user_id) % K, и пользователь всегда
+обслуживается одним процессом. Кэши в памяти остаются локальными для шарда,
+порядок сообщений держит UserOrderingMiddleware внутри воркера, а синхронный
+код LangChain/LLM (GIL) раскладывается по ядрам.
+
+Родительский процесс — только приёмник и супервизор: раскладывает обновления
+(из polling или webhook) по очередям шардов и перезапускает упавших воркеров.
+Перезапущенный воркер получает новую очередь: убитый процесс мог умереть внутри
+get() с захваченной блокировкой чтения старой. Обновления, которые шард
+обрабатывал или не успел забрать в момент падения, теряются (считаются в
+shard_lost_updates).
+
+    BOT_SHARDS=4 python main.py                 # polling + 4 воркера
+    BOT_MODE=webhook WEBHOOK_WORKERS=4 python main.py
+"""
+
+import asyncio
+import multiprocessing as mp
+import os
+import queue
+import signal
+import time
+import traceback
+
+from aiogram.exceptions import TelegramConflictError
+
+import metrics
+from config import BOT_SHARDS, SHARD_QUEUE_SIZE, SHARD_CHECK_SECONDS, create_bot
+
+ALLOWED_UPDATES = ["message"]
+POLL_TIMEOUT = 30
+# воркер, проживший меньше, считаем «падающим в цикле» — перезапуск с нарастающей паузой
+CRASH_LOOP_SECONDS = 30.0
+RESTART_MAX_BACKOFF = 60.0
+# виды обновлений, из которых достаём пользователя для выбора шарда
+_UPDATE_KINDS = ("message", "edited_message", "callback_query", "inline_query", "my_chat_member")
+
+
+def update_user_id(data: dict) -> int | None:
+    for kind in _UPDATE_KINDS:
+        obj = data.get(kind)
+        if isinstance(obj, dict):
+            who = obj.get("from") or obj.get("chat") or {}
+            if "id" in who:
+                return int(who["id"])
+    return None
+
+
+def shard_of(data: dict, n: int) -> int:
+    """Номер шарда: по пользователю, а если его нет — по update_id."""
+    key = update_user_id(data)
+    if key is None:
+        key = int(data.get("update_id") or 0)
+    return hash(key) % n
+
+
+def _qsize(q) -> int | None:
+    try:
+        return q.qsize()
+    except NotImplementedError:  # macOS
+        return None
+
+
+# ---------- Воркер ----------
+
+def worker_main(index: int, updates, background: bool):
+    """Точка входа процесса-воркера (spawn: модули бота импортируются уже в нём)."""
+    # Ctrl+C приходит всей группе процессов; останавливает воркеров супервизор
+    # (None в очередь), чтобы начатые обновления успели обработаться
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_worker_loop(index, updates, background))
+
+
+async def _worker_loop(index: int, updates, background: bool):
+    from aiogram.types import Update
+    from telegram_bot import bot, dp, startup
+    from memory_store import memory_store
+    from repository import repository
+    from executors import shutdown as shutdown_executors
+
+    await startup(background)
+    print(f"[shards] worker {index} ready (pid={os.getpid()}, background={background})")
+
+    loop = asyncio.get_running_loop()
+    tasks: set[asyncio.Task] = set()
+
+    async def process(data: dict):
+        try:
+            await dp.feed_update(bot, Update.model_validate(data, context={"bot": bot}))
+        except Exception as e:
+            print(f"[shards] worker {index} update error: {e}\n{traceback.format_exc()}")
+
+    try:
+        while True:
+            try:
+                # с таймаутом: поток executor'а не должен навсегда зависнуть в get() при остановке
+                data = await loop.run_in_executor(None, updates.get, True, 1.0)
+            except queue.Empty:
+                parent = mp.parent_process()
+                if parent is not None and not parent.is_alive():
+                    print(f"[shards] worker {index}: supervisor is gone, exiting")
+                    break
+                continue
+            if data is None:  # сигнал остановки
+                break
+            # как polling: каждое обновление — своя задача, порядок в рамках
+            # пользователя держит UserOrderingMiddleware
+            task = asyncio.create_task(process(data))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+    finally:
+        shutdown_executors()
+        memory_store.flush()
+        repository.stop()
+        await bot.session.close()
+        print(f"[shards] worker {index} stopped")
+
+
+# ---------- Пул шардов ----------
+
+class ShardPool:
+    """K процессов-воркеров со своими очередями; фоновые задачи бота — только в шарде 0."""
+
+    def __init__(self, n: int, queue_size: int, name: str = "bot-shard"):
+        self.name = name
+        self.queue_size = queue_size
+        self._ctx = mp.get_context("spawn")  # fork после запуска пулов потоков и SQLite небезопасен
+        self.queues = [self._ctx.Queue(queue_size) for _ in range(n)]
+        self.procs: list = [None] * n
+        self._started = [0.0] * n
+        self._backoff = [0.0] * n
+        self._restart_at: list[float | None] = [None] * n
+        self._stopping = False
+
+    def __len__(self) -> int:
+        return len(self.queues)
+
+    def _spawn(self, i: int):
+        p = self._ctx.Process(target=worker_main, args=(i, self.queues[i], i == 0), name=f"{self.name}-{i}")
+        p.start()
+        self.procs[i] = p
+        self._started[i] = time.monotonic()
+
+    def start(self):
+        for i in range(len(self)):
+            self._spawn(i)
+
+    def put_nowait(self, data: dict) -> int:
+        """Кладёт обновление в очередь его шарда; queue.Full — шард перегружен."""
+        i = shard_of(data, len(self))
+        self.queues[i].put_nowait(data)
+        return i
+
+    def check(self) -> int:
+        """Перезапускает упавших воркеров (с паузой при падениях в цикле). Возвращает число перезапусков."""
+        if self._stopping:
+            return 0
+        now = time.monotonic()
+        restarted = 0
+        for i, p in enumerate(self.procs):
+            if p is None or p.is_alive():
+                continue
+            if self._restart_at[i] is None:
+                uptime = now - self._started[i]
+                if uptime < CRASH_LOOP_SECONDS:
+                    self._backoff[i] = min(RESTART_MAX_BACKOFF, max(1.0, self._backoff[i] * 2))
+                else:
+                    self._backoff[i] = 0.0
+                self._restart_at[i] = now + self._backoff[i]
+                metrics.inc("shard_deaths")
+                print(f"[shards] {p.name} exited (code {p.exitcode}) after {uptime:.0f}s, "
+                      f"restart in {self._backoff[i]:.0f}s")
+            if now >= self._restart_at[i]:
+                self._restart_at[i] = None
+                self._replace_queue(i)
+                self._spawn(i)
+                metrics.inc("shard_restarts")
+                restarted += 1
+        metrics.set_gauge("shards_alive", sum(1 for p in self.procs if p is not None and p.is_alive()))
+        return restarted
+
+    def _replace_queue(self, i: int):
+        old = self.queues[i]
+        self.queues[i] = self._ctx.Queue(self.queue_size)
+        lost = _qsize(old) or 0
+        if lost:
+            metrics.inc("shard_lost_updates", lost)
+            print(f"[shards] shard {i}: lost {lost} queued updates")
+        old.close()
+        old.cancel_join_thread()  # читателя больше нет — не ждём досылки буфера при выходе
+
+    async def supervise(self, interval: float = SHARD_CHECK_SECONDS):
+        while True:
+            await asyncio.sleep(interval)
+            try:
+                self.check()
+            except Exception as e:
+                print(f"[shards] supervise error: {e}")
+
+    def stop(self, timeout: float = 30.0):
+        self._stopping = True
+        for q in self.queues:
+            try:
+                q.put(None, timeout=1.0)
+            except queue.Full:
+                pass
+        for p in self.procs:
+            if p is None:
+                continue
+            p.join(timeout)
+            if p.is_alive():
+                print(f"[shards] {p.name} did not stop, terminating")
+                p.terminate()
+
+    def health(self) -> list[dict]:
+        return [
+            {"shard": i, "pid": p.pid if p else None, "alive": bool(p and p.is_alive()), "queued": _qsize(q)}
+            for i, (p, q) in enumerate(zip(self.procs, self.queues))
+        ]
+
+
+# ---------- Polling-приёмник ----------
+
+async def _enqueue(pool: ShardPool, data: dict):
+    # polling сам задаёт темп: при полной очереди шарда ждём, а не отбрасываем
+    while True:
+        try:
+            pool.put_nowait(data)
+            return
+        except queue.Full:
+            metrics.inc("shard_backpressure")
+            await asyncio.sleep(0.1)
+
+
+async def poll_into(pool: ShardPool):
+    """getUpdates в родительском процессе; обновления — в очереди шардов как JSON."""
+    bot = create_bot()
+    try:
+        try:
+            await bot.delete_webhook(drop_pending_updates=True)
+            print("✓ Webhook удалён. Перехожу на polling.")
+        except Exception as e:
+            print(f"[shards] delete_webhook warn: {e}")
+
+        offset = None
+        backoff = 1.0
+        while True:
+            try:
+                updates = await bot.get_updates(
+                    offset=offset,
+                    timeout=POLL_TIMEOUT,
+                    allowed_updates=ALLOWED_UPDATES,
+                    request_timeout=POLL_TIMEOUT + 10,
+                )
+                backoff = 1.0
+            except TelegramConflictError as e:
+                print(f"Failed to fetch updates - TelegramConflictError: {e}")
+                print(f"Sleep for {backoff:.6f} seconds and try again...")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 1.5, 10.0)
+                continue
+            except Exception as e:
+                print(f"[shards] polling error: {e}")
+                await asyncio.sleep(2.0)
+                continue
+
+            for update in updates:
+                await _enqueue(pool, update.model_dump(mode="json", by_alias=True, exclude_none=True))
+                offset = update.update_id + 1
+                metrics.inc("shard_updates")
+    finally:
+        await bot.session.close()
+
+
+# ---------- Супервизор ----------
+
+async def _until_signal(main):
+    """Выполняет main до SIGTERM/SIGINT (systemd, docker stop, Ctrl+C)."""
+    task = asyncio.ensure_future(main)
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(sig, task.cancel)
+    try:
+        await task
+    except asyncio.CancelledError:
+        print("[shards] stopping...")
+
+
+def run_supervised(pool: ShardPool, ingress):
+    """Запускает воркеров, приёмник ingress(pool) и супервизор; по сигналу — мягкая остановка пула."""
+    pool.start()
+
+    async def main():
+        supervisor = asyncio.create_task(pool.supervise())
+        try:
+            await ingress(pool)
+        finally:
+            supervisor.cancel()
+
+    try:
+        asyncio.run(_until_signal(main()))
+    finally:
+        pool.stop()
+
+
+async def _polling_ingress(pool: ShardPool):
+    print(f"🤖 Bot polling, шардов {len(pool)}...")
+    await poll_into(pool)
+
+
+def run_sharded_polling(shards: int = BOT_SHARDS):
+    run_supervised(ShardPool(shards, SHARD_QUEUE_SIZE), _polling_ingress)
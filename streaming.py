@@ -0,0 +1,181 @@
+# streaming.py - Потоковые ответы: токены LLM → редактирование сообщения в Telegram
+
+import asyncio
+import time
+from contextvars import ContextVar
+from typing import Optional
+
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
+from aiogram.types import Message
+from langchain.callbacks.base import BaseCallbackHandler
+
+import metrics
+
+TELEGRAM_TEXT_LIMIT = 4096
+
+
+class StreamSink:
+    """
+    Мост из рабочего потока (call_ai, AgentExecutor в LLM_EXECUTOR) в event loop:
+    push() можно вызывать из любого потока, текст копится в очереди бота.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self._loop = loop
+        self.queue: asyncio.Queue[str] = asyncio.Queue()
+
+    def push(self, delta: str):
+        if delta:
+            self._loop.call_soon_threadsafe(self.queue.put_nowait, delta)
+
+
+# Выставляется хендлером на время обработки сообщения; run_llm переносит contextvars
+# в поток пула, поэтому call_ai видит приёмник своего сообщения.
+_stream_sink: ContextVar[Optional[StreamSink]] = ContextVar("stream_sink", default=None)
+
+
+def current_sink() -> Optional[StreamSink]:
+    return _stream_sink.get()
+
+
+class FinalAnswerStreamer(BaseCallbackHandler):
+    """
+    Для ReAct-агента: Thought/Action пользователю не показываем, в приёмник
+    уходит только текст после «Final Answer:» текущего шага.
+    """
+
+    MARKER = "Final Answer:"
+
+    def __init__(self, sink: StreamSink):
+        self.sink = sink
+        self._buf = ""
+        self._streaming = False
+
+    def on_llm_start(self, *args, **kwargs):
+        self._buf = ""
+        self._streaming = False
+
+    def on_chat_model_start(self, *args, **kwargs):
+        self.on_llm_start()
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        if self._streaming:
+            self.sink.push(token)
+            return
+        self._buf += token
+        i = self._buf.find(self.MARKER)
+        if i >= 0:
+            self._streaming = True
+            self.sink.push(self._buf[i + len(self.MARKER):].lstrip())
+
+
+class MessageStreamer:
+    """
+    Показывает ответ по мере генерации. Заглушка отправляется, как только пришёл
+    первый токен или прошло placeholder_delay секунд; дальше — edit_message_text
+    не чаще edit_interval (лимиты Telegram на редактирование), с учётом RetryAfter.
+    Если ответ готов раньше заглушки — обычный message.answer, без лишних запросов.
+    """
+
+    def __init__(self, message: Message, edit_interval: float = 1.0, placeholder_delay: float = 0.5,
+                 placeholder: str = "⏳ Думаю…"):
+        self.message = message
+        self.edit_interval = edit_interval
+        self.placeholder_delay = placeholder_delay
+        self.placeholder = placeholder
+        self.sink = StreamSink(asyncio.get_running_loop())
+        self._sent: Optional[Message] = None
+        self._placeholder: Optional[asyncio.Future] = None
+        self._shown = ""
+        self._text = ""
+        self._next_edit = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    def __enter__(self):
+        self._token = _stream_sink.set(self.sink)
+        self._task = asyncio.create_task(self._pump())
+        return self
+
+    def __exit__(self, *exc):
+        _stream_sink.reset(self._token)
+        if self._task:
+            self._task.cancel()
+
+    def _drain(self):
+        while not self.sink.queue.empty():
+            self._text += self.sink.queue.get_nowait()
+
+    async def _pump(self):
+        try:
+            self._text += await asyncio.wait_for(self.sink.queue.get(), self.placeholder_delay)
+        except asyncio.TimeoutError:
+            pass
+        await self._ensure_placeholder()
+        while True:
+            wait = self._next_edit - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            self._drain()  # всё накопленное за интервал — одним редактированием
+            if self._text:
+                await self._edit(self._text.rstrip() + " ▌", markdown=False)
+            self._text += await self.sink.queue.get()
+
+    async def _ensure_placeholder(self):
+        if self._placeholder is None:
+            # shield: отмена насоса в finish() не должна оставить «висящую» заглушку
+            self._placeholder = asyncio.ensure_future(self.message.answer(self.placeholder, parse_mode=None))
+            metrics.inc("stream_placeholders")
+        self._sent = await asyncio.shield(self._placeholder)
+        self._shown = self.placeholder
+        self._next_edit = time.monotonic() + self.edit_interval
+
+    async def _edit(self, text: str, markdown: bool, final: bool = False):
+        # промежуточный текст — без разметки: оборванный Markdown Telegram не примет
+        text = text[:TELEGRAM_TEXT_LIMIT]
+        if not text.strip() or text == self._shown:
+            return
+        while True:
+            try:
+                if markdown:
+                    await self._sent.edit_text(text)
+                else:
+                    await self._sent.edit_text(text, parse_mode=None)
+                self._shown = text
+                self._next_edit = time.monotonic() + self.edit_interval
+                metrics.inc("stream_edits")
+                return
+            except TelegramRetryAfter as e:
+                if not final:
+                    self._next_edit = time.monotonic() + e.retry_after
+                    return
+                await asyncio.sleep(e.retry_after)
+            except TelegramBadRequest as e:
+                if "not modified" in str(e):
+                    return
+                if not markdown:
+                    raise
+                markdown = False  # разметка невалидна — показываем как есть
+
+    async def finish(self, result: str):
+        """Итоговый текст: правка заглушки (или обычный ответ, если заглушки не было)."""
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            except Exception as e:
+                print(f"[stream] pump error: {e}")
+        if self._sent is None and self._placeholder is not None:
+            try:
+                self._sent = await self._placeholder
+            except Exception as e:
+                print(f"[stream] placeholder error: {e}")
+        if self._sent is None:
+            await self.message.answer(result)
+            return
+        head, tail = result[:TELEGRAM_TEXT_LIMIT], result[TELEGRAM_TEXT_LIMIT:]
+        await self._edit(head, markdown=True, final=True)
+        while tail:
+            await self.message.answer(tail[:TELEGRAM_TEXT_LIMIT])
+            tail = tail[TELEGRAM_TEXT_LIMIT:]
@@ -2,30 +2,58 @@
 import asyncio
 import re
 import traceback
-from aiogram import Bot, Dispatcher, F
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from aiogram import Dispatcher, F
 from aiogram.types import Message
-from aiogram.enums import ParseMode
-from aiogram.client.default import DefaultBotProperties
 from aiogram.exceptions import TelegramConflictError
 
-from config import TELEGRAM_BOT_TOKEN
-from router import llm_route
+import metrics
+from config import (
+    create_bot,
+    ADMIN_IDS,
+    PENDING_SWEEP_SECONDS,
+    INTENT_LOG_RETENTION_DAYS,
+    MEMORY_SWEEP_SECONDS,
+    BROADCAST_RATE,
+    BROADCAST_CONCURRENCY,
+    BROADCAST_BATCH,
+    REMINDER_HORIZON_SECONDS,
+    REMINDER_REFRESH_SECONDS,
+    USER_QUEUE_LIMIT,
+    STREAM_REPLIES,
+    STREAM_EDIT_INTERVAL,
+    STREAM_PLACEHOLDER_DELAY,
+    REPO_GROUP_COMMIT,
+)
+from broadcast import Broadcaster
+from reminder_scheduler import ReminderScheduler
+from middleware import UserOrderingMiddleware
+from streaming import MessageStreamer
+from kcal_cache import kcal_cache
+from workout_cache import workout_cache
+from food_density import food_density
+from router import allm_route
+from executors import run_db, shutdown as shutdown_executors
+from sessions import sessions
+from memory_store import memory_store
+from context import context_assembler
+from pending_store import pending_store
+from repository import repository
 from database import (
     init_db,
-    create_user_if_not_exists,
     delete_user_by_id,
-    save_user_weight,
     set_remind_weekly,
-    list_users_for_weekly_reminder,
-    update_last_weighin_reminder,
+    upsert_remind_weekly,
+    check_daily_totals,
+    purge_intent_log,
 )
 
 # --- Бот ---
-bot = Bot(
-    token=TELEGRAM_BOT_TOKEN,
-    default=DefaultBotProperties(parse_mode=ParseMode.MARKDOWN)
-)
+bot = create_bot()
 dp = Dispatcher()
+# сообщения одного пользователя — строго по очереди, разных — параллельно
+dp.message.outer_middleware(UserOrderingMiddleware(USER_QUEUE_LIMIT))
 
 
 # ---------- Вспомогательные ----------
@@ -47,8 +75,8 @@ async def _parse_and_save_profile(message: Message) -> bool:
         if name and re.search(r"\d", name):
             name = None
 
-        create_user_if_not_exists(user_id, name=name, age=age, weight=weight, height=height)
-        save_user_weight(user_id, weight)
+        await run_db(sessions.ensure_user, user_id, name=name, age=age, weight=weight, height=height)
+        await run_db(sessions.save_weight, user_id, weight)
 
         who = f"{name}, " if name else ""
         await message.answer(
@@ -92,19 +120,71 @@ async def cmd_help(message: Message):
 @dp.message(F.text == "/remind_on")
 async def cmd_remind_on(message: Message):
     user_id = message.from_user.id
-    create_user_if_not_exists(user_id)
-    set_remind_weekly(user_id, True)
+    await run_db(sessions.ensure_user, user_id)
+    await run_db(repository.write, upsert_remind_weekly, set_remind_weekly, user_id, True)
     await message.answer("🔔 Еженедельное напоминание о взвешивании включено.")
 
 
 @dp.message(F.text == "/remind_off")
 async def cmd_remind_off(message: Message):
     user_id = message.from_user.id
-    create_user_if_not_exists(user_id)
-    set_remind_weekly(user_id, False)
+    await run_db(sessions.ensure_user, user_id)
+    await run_db(repository.write, upsert_remind_weekly, set_remind_weekly, user_id, False)
     await message.answer("🔕 Еженедельное напоминание о взвешивании отключено.")
 
 
+# ---------- Служебные команды (только ADMIN_IDS) ----------
+
+@dp.message(F.text == "/cache_stats", F.from_user.id.in_(ADMIN_IDS))
+async def cmd_cache_stats(message: Message):
+    st = await run_db(kcal_cache.stats)
+    wk = await run_db(workout_cache.stats)
+    await message.answer(
+        "🗄️ Кэш калорий\n"
+        f"• в памяти: {st['mem_items']}, в БД: {st['db_items']}\n"
+        f"• попадания: память {st['hits_mem']}, БД {st['hits_db']}; промахи {st['misses']}\n"
+        f"• hit rate: {st['hit_rate']:.0%}\n\n"
+        "🏋️ Кэш тренировок\n"
+        f"• вариантов: {wk['variants']}, ключей: {wk['keys']}/{wk['combinations']}\n"
+        f"• попадания {wk['hits']:g}, устаревшие {wk['stale']:g}, промахи {wk['misses']:g}",
+        parse_mode=None,
+    )
+
+
+@dp.message(F.text.startswith("/cache_clear"), F.from_user.id.in_(ADMIN_IDS))
+async def cmd_cache_clear(message: Message):
+    # «/cache_clear» — всё, «/cache_clear халва» — только ключи с «халва»
+    arg = (message.text or "")[len("/cache_clear"):].strip().lower() or None
+    n = await run_db(kcal_cache.invalidate, arg)
+    await message.answer(f"🧹 Удалено записей кэша: {n}", parse_mode=None)
+
+
+@dp.message(F.text == "/density_rebuild", F.from_user.id.in_(ADMIN_IDS))
+async def cmd_density_rebuild(message: Message):
+    n = await run_db(food_density.rebuild_from_meals)
+    await message.answer(f"📐 Модель плотности переобучена на {n} записях.", parse_mode=None)
+
+
+@dp.message(F.text == "/rollup_check", F.from_user.id.in_(ADMIN_IDS))
+async def cmd_rollup_check(message: Message):
+    bad = await run_db(check_daily_totals, True)
+    if not bad:
+        await message.answer("✅ daily_totals совпадает с meals.", parse_mode=None)
+    else:
+        users = len({u for u, _ in bad})
+        await message.answer(f"🛠️ Исправлено расхождений: {len(bad)} (пользователей: {users})", parse_mode=None)
+
+
+@dp.message(F.text == "/stats", F.from_user.id.in_(ADMIN_IDS))
+async def cmd_stats(message: Message):
+    mem = await run_db(memory_store.stats)
+    await message.answer(
+        f"{metrics.format_snapshot()}\n\n"
+        f"memory: users={mem['users']} messages={mem['messages']} bytes={mem['bytes']}",
+        parse_mode=None,
+    )
+
+
 # ---------- Общий хендлер ----------
 
 @dp.message()
@@ -114,7 +194,11 @@ async def handle_message(message: Message):
 
     # Сброс профиля
     if user_text.lower() in {"сброс", "/reset", "удали профиль"}:
-        delete_user_by_id(user_id)
+        await run_db(delete_user_by_id, user_id)
+        sessions.invalidate(user_id)
+        pending_store.invalidate(user_id)
+        await run_db(memory_store.forget, user_id)
+        context_assembler.forget(user_id)
         await message.answer("🗑️ Профиль удалён. Начни заново командой /start.")
         return
 
@@ -126,54 +210,107 @@ async def handle_message(message: Message):
     low = user_text.lower()
     if low in {"да", "ок", "подтверждаю"}:
         from tools import confirm_pending_action
-        await message.answer(confirm_pending_action(user_id))
+        await message.answer(await run_db(confirm_pending_action, user_id))
         return
     if low in {"нет", "отмена"}:
         from tools import cancel_pending_action
-        await message.answer(cancel_pending_action(user_id))
+        await message.answer(await run_db(cancel_pending_action, user_id))
         return
 
-    # Остальное — через роутер
+    # Остальное — через роутер; ответы LLM показываем по мере генерации
+    streamer = MessageStreamer(message, STREAM_EDIT_INTERVAL, STREAM_PLACEHOLDER_DELAY) if STREAM_REPLIES else None
+    reply = streamer.finish if streamer else message.answer
     try:
-        create_user_if_not_exists(user_id)
-        result = llm_route(user_text, user_id)
+        await run_db(sessions.ensure_user, user_id)
+        with streamer or nullcontext():
+            result = await allm_route(user_text, user_id)
         if result.strip().startswith("{") and '"tool"' in result:
             result = "Не понял. Пример: «цель 75» или «на 7 кг за 12 недель»."
-        await message.answer(result)
+        await reply(result)
     except Exception as e:
         print(f"[bot] handle_message error: {e}\n{traceback.format_exc()}")
-        await message.answer("Ошибка обработки. Попробуй ещё раз.")
+        await reply("Ошибка обработки. Попробуй ещё раз.")
 
 
 # ---------- Напоминания (фоновая задача) ----------
 
+WEEKLY_REMINDER_TEXT = "🔔 Еженедельное напоминание: взвесься сегодня и пришли сообщение: «взвесился 85.4»"
+
+
 async def _weekly_reminder_loop():
     """
-    Раз в ~час проверяем, кого пора пинговать:
-    - remind_weekly=1
-    - последний вес ≥ 7 дней назад или его нет
-    - последнее напоминание ≥ ~6.5 дней назад
+    Напоминания о взвешивании: планировщик спит до ближайшего next_reminder_due
+    (remind_weekly=1, вес ≥ 7 дней назад или его нет, напоминание ≥ ~6.5 дней назад).
     """
     await asyncio.sleep(5)
+    broadcaster = Broadcaster(bot, BROADCAST_RATE, BROADCAST_CONCURRENCY, batch_size=BROADCAST_BATCH)
+    scheduler = ReminderScheduler(
+        broadcaster,
+        WEEKLY_REMINDER_TEXT,
+        horizon=REMINDER_HORIZON_SECONDS,
+        refresh=REMINDER_REFRESH_SECONDS,
+    )
+    await scheduler.run()
+
+
+async def _pending_sweeper_loop():
+    """Периодически удаляем истёкшие действия на подтверждении и старые записи журнала намерений."""
+    while True:
+        await asyncio.sleep(PENDING_SWEEP_SECONDS)
+        try:
+            n = await run_db(pending_store.sweep)
+            if n:
+                print(f"[pending] expired {n}")
+        except Exception as e:
+            print(f"[pending] sweep error: {e}")
+        try:
+            older = (datetime.now() - timedelta(days=INTENT_LOG_RETENTION_DAYS)).isoformat()
+            n = await run_db(purge_intent_log, older)
+            if n:
+                print(f"[intent] purged {n} old log rows")
+        except Exception as e:
+            print(f"[intent] purge error: {e}")
+
+
+async def _memory_sweeper_loop():
+    """Выгружаем в SQLite диалоги, простаивающие дольше MEMORY_TTL_SECONDS (в каждом процессе)."""
     while True:
+        await asyncio.sleep(MEMORY_SWEEP_SECONDS)
         try:
-            user_ids = list_users_for_weekly_reminder()
-            for uid in user_ids:
-                try:
-                    await bot.send_message(
-                        uid,
-                        "🔔 Еженедельное напоминание: взвесься сегодня и пришли сообщение: «взвесился 85.4»"
-                    )
-                    update_last_weighin_reminder(uid)
-                except Exception as e:
-                    print(f"[reminder] send failed for {uid}: {e}")
+            n = await run_db(memory_store.sweep)
+            if n:
+                print(f"[memory] spilled {n} idle dialogs")
         except Exception as e:
-            print(f"[reminder] loop error: {e}")
-        await asyncio.sleep(3600)
+            print(f"[memory] sweep error: {e}")
 
 
 # ---------- Точка входа ----------
 
+async def startup(background: bool = True):
+    """Прогрев кэшей и фоновые задачи. background=False — для воркеров webhook-режима, кроме одного."""
+    if REPO_GROUP_COMMIT:
+        repository.start()
+
+    try:
+        purged = await run_db(kcal_cache.purge_expired)
+        print(f"✓ Кэш калорий: удалено протухших записей {purged}")
+    except Exception as e:
+        print(f"[bot] kcal_cache purge warn: {e}")
+
+    try:
+        learned = await run_db(food_density.bootstrap_if_empty)
+        if learned:
+            print(f"✓ Модель плотности калорий обучена на {learned} записях meals")
+    except Exception as e:
+        print(f"[bot] food_density bootstrap warn: {e}")
+
+    # память диалогов своя у каждого процесса — её чистим всегда
+    asyncio.create_task(_memory_sweeper_loop())
+    if background:
+        asyncio.create_task(_weekly_reminder_loop())
+        asyncio.create_task(_pending_sweeper_loop())
+
+
 async def main():
     try:
         await bot.delete_webhook(drop_pending_updates=True)
@@ -181,9 +318,20 @@ async def main():
     except Exception as e:
         print(f"[bot] delete_webhook warn: {e}")
 
-    asyncio.create_task(_weekly_reminder_loop())
+    await startup()
 
     print("🤖 Bot polling...")
+    try:
+        await _poll_forever()
+    finally:
+        # сначала дожидаемся начатой работы пулов (она ещё пишет в память и БД), затем
+        # выгружаем память диалогов, чтобы продолжить разговор после рестарта
+        shutdown_executors()
+        memory_store.flush()
+        repository.stop()
+
+
+async def _poll_forever():
     backoff = 1.0
     while True:
         try:
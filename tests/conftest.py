@@ -0,0 +1,30 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("TELEGRAM_BOT_TOKEN", "123:test")
+
+import database  # noqa: E402
+
+
+@pytest.fixture
+def make_db(tmp_path, monkeypatch):
+    """make_db(shards) — свежая БД во временном каталоге с DB_SHARDS=shards (можно вызывать повторно)."""
+    monkeypatch.setattr(database, "DB_PATH", str(tmp_path / "fitness.db"))
+
+    def make(shards: int = 1):
+        database.close_conn()
+        monkeypatch.setattr(database, "DB_SHARDS", shards)
+        database.init_db()
+        return database
+
+    yield make
+    database.close_conn()
+
+
+@pytest.fixture
+def db(make_db):
+    return make_db(1)
@@ -0,0 +1,32 @@
+from uuid import uuid4
+
+from langchain_community.chat_models.fake import FakeListChatModel
+from langchain_core.outputs import Generation, LLMResult
+
+from context import PromptTokenCounter, count_tokens
+
+PROMPT = "Сколько калорий в тарелке борща со сметаной?"
+ANSWER = "Около 250 ккал на 300 мл."
+
+
+def test_counts_tokens_without_usage_on_streaming_path():
+    counter = PromptTokenCounter()
+    llm = FakeListChatModel(responses=[ANSWER])
+    chunks = list(llm.stream(PROMPT, config={"callbacks": [counter]}))
+
+    assert "".join(c.content for c in chunks) == ANSWER
+    assert counter.calls == 1
+    assert counter.prompt_tokens == count_tokens(PROMPT) > 0
+    assert counter.completion_tokens == count_tokens(ANSWER) > 0
+
+
+def test_prefers_reported_usage():
+    counter = PromptTokenCounter()
+    run_id = uuid4()
+    counter.on_llm_start({}, [PROMPT], run_id=run_id)
+    counter.on_llm_end(
+        LLMResult(generations=[[Generation(text=ANSWER)]],
+                  llm_output={"token_usage": {"prompt_tokens": 120, "completion_tokens": 7}}),
+        run_id=run_id,
+    )
+    assert (counter.prompt_tokens, counter.completion_tokens, counter.calls) == (120, 7, 1)
@@ -0,0 +1,75 @@
+from datetime import datetime, timedelta
+
+
+def _totals(db, user_id: int) -> list[tuple[str, int, int]]:
+    with db.cursor(db.user_db(user_id)) as c:
+        c.execute("SELECT day, kcal, meal_count FROM daily_totals WHERE user_id=? ORDER BY day", (user_id,))
+        return c.fetchall()
+
+
+def test_meals_update_today_total(db):
+    today = datetime.now().date().isoformat()
+    assert db.get_today_calories(1) == 0
+
+    db.save_meal_entry(1, "яблоко", 52)
+    db.save_meal_entries(1, [("гречка", 300), ("котлета", 250)])
+    db.save_meal_entries(1, [])
+    db.save_meal_entry(2, "банан", 90)
+
+    assert db.get_today_calories(1) == 602
+    assert db.get_today_calories(2) == 90
+    assert _totals(db, 1) == [(today, 602, 3)]
+    assert db.check_daily_totals() == []
+
+
+def test_calorie_summary_reads_rollup(db):
+    today = datetime.now().date()
+    with db.transaction() as c:
+        for days_ago, kcal in ((0, 500), (3, 1200), (10, 2000)):
+            day = (today - timedelta(days=days_ago)).isoformat()
+            c.execute(
+                "INSERT INTO meals (user_id, description, calories, created_at) VALUES (1, 'еда', ?, ?)",
+                (kcal, f"{day}T12:00:00")
+            )
+    db.rebuild_daily_totals(1)
+
+    week = db.get_calorie_summary(1, 7)
+    assert week["total"] == 1700
+    assert week["meals"] == 2
+    assert week["logged_days"] == 2
+    assert [d for d, _, _ in week["days"]] == sorted(d for d, _, _ in week["days"])
+    assert db.get_calorie_summary(1, 30)["total"] == 3700
+
+
+def test_check_and_repair_mismatches(db):
+    today = datetime.now().date().isoformat()
+    db.save_meal_entry(1, "суп", 200)
+    db.save_meal_entry(2, "салат", 150)
+    with db.transaction() as c:
+        # meal без итога, итог без meals, неверная сумма
+        c.execute(
+            "INSERT INTO meals (user_id, description, calories, created_at) VALUES (1, 'чай', 30, '2024-01-01T09:00:00')"
+        )
+        c.execute("INSERT INTO daily_totals (user_id, day, kcal, meal_count) VALUES (3, '2024-01-02', 999, 1)")
+        c.execute("UPDATE daily_totals SET kcal = 1 WHERE user_id = 2")
+
+    assert sorted(db.check_daily_totals()) == [(1, "2024-01-01"), (2, today), (3, "2024-01-02")]
+    db.check_daily_totals(repair=True)
+
+    assert db.check_daily_totals() == []
+    assert _totals(db, 1) == [("2024-01-01", 30, 1), (today, 200, 1)]
+    assert db.get_today_calories(2) == 150
+    assert _totals(db, 3) == []
+
+
+def test_rebuild_all(db):
+    db.save_meal_entry(1, "суп", 200)
+    db.save_meal_entry(2, "салат", 150)
+    with db.transaction() as c:
+        c.execute("DELETE FROM daily_totals")
+    assert db.get_today_calories(1) == 0
+
+    db.rebuild_daily_totals()
+
+    assert (db.get_today_calories(1), db.get_today_calories(2)) == (200, 150)
+    assert db.check_daily_totals() == []
@@ -0,0 +1,68 @@
+import os
+from datetime import datetime, timedelta
+
+USERS = range(1, 41)
+
+
+def _user_ids_in(database, path: str) -> set[int]:
+    with database.cursor(path) as c:
+        c.execute("SELECT DISTINCT user_id FROM meals")
+        return {r[0] for r in c.fetchall()}
+
+
+def test_single_shard_is_db_path(db):
+    assert db.all_db_paths() == [db.DB_PATH]
+    assert all(db.user_db(uid) == db.DB_PATH for uid in USERS)
+
+
+def test_users_are_spread_by_hash(make_db):
+    db = make_db(4)
+    root, ext = os.path.splitext(db.DB_PATH)
+    assert db.all_db_paths() == [db.DB_PATH, f"{root}.1{ext}", f"{root}.2{ext}", f"{root}.3{ext}"]
+    for uid in USERS:
+        assert db.shard_of_user(uid) == hash(uid) % 4
+        db.save_meal_entry(uid, "яблоко", uid)
+
+    for path in db.all_db_paths():
+        assert _user_ids_in(db, path) == {uid for uid in USERS if db.user_db(uid) == path}
+    assert [db.get_today_calories(uid) for uid in USERS] == list(USERS)
+
+
+def test_reshard_moves_users_and_keeps_data(make_db):
+    db = make_db(1)
+    for uid in USERS:
+        db.save_meal_entry(uid, "каша", 100 + uid)
+        db.save_user_weight(uid, 70 + uid)
+
+    for shards in (4, 2, 1):
+        db = make_db(shards)
+        for path in db.all_db_paths():
+            assert _user_ids_in(db, path) == {uid for uid in USERS if db.user_db(uid) == path}
+        assert [db.get_today_calories(uid) for uid in USERS] == [100 + uid for uid in USERS]
+        assert db.check_daily_totals() == []
+        with db.cursor() as c:
+            c.execute("SELECT value FROM db_meta WHERE key='shards'")
+            assert c.fetchone() == (str(shards),)
+
+    # файлы выбывших шардов опустели
+    root, ext = os.path.splitext(db.DB_PATH)
+    for i in (1, 2, 3):
+        assert _user_ids_in(db, f"{root}.{i}{ext}") == set()
+
+
+def test_list_reminders_due_merges_shards_in_due_order(make_db):
+    db = make_db(4)
+    base = datetime(2024, 5, 1)
+    due = {uid: (base + timedelta(hours=(uid * 7) % 40)).isoformat() for uid in USERS}
+    for uid in USERS:
+        with db.transaction(db.user_db(uid)) as c:
+            c.execute(
+                "INSERT INTO settings (user_id, remind_weekly, next_reminder_due) VALUES (?, 1, ?)",
+                (uid, due[uid])
+            )
+    expected = sorted(due.items(), key=lambda r: r[1])
+
+    assert db.list_reminders_due(base.replace(year=2025).isoformat()) == expected
+    assert db.list_reminders_due(base.replace(year=2025).isoformat(), limit=5) == expected[:5]
+    until = expected[9][1]
+    assert db.list_reminders_due(until) == expected[:10]
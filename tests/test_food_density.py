@@ -0,0 +1,18 @@
+from food_density import FALLBACK_KCAL, FoodDensityModel
+from utils import extract_qty
+
+
+def test_rebuild_skips_fallback_meals(db):
+    for description, kcal in (("халва 40 г", 216), ("халва 50 г", 270), ("борщ 300 мл", FALLBACK_KCAL)):
+        db.save_meal_entry(1, description, kcal)
+    model = FoodDensityModel()
+
+    assert model.rebuild_from_meals() == 2
+    assert db.get_food_density("халва")["kcal_100g"] == 540
+    assert db.get_food_density("борщ") is None
+
+
+def test_learn_ignores_fallback(db):
+    model = FoodDensityModel()
+    assert not model.learn("суп 200 мл", extract_qty("суп 200 мл"), FALLBACK_KCAL)
+    assert model.learn("суп 200 мл", extract_qty("суп 200 мл"), 120)
@@ -0,0 +1,116 @@
+import pytest
+
+from config import INTENT_CONFIDENCE, RULE_CONFIDENCE
+from intent_classifier import NaiveBayesIntentClassifier, load_seed
+from intents import RULES, IntentMatcher, classify
+
+# текст, ожидаемое намерение (none — уходит агенту); его же меряет benchmarks/bench_intents.py
+CORPUS = [
+    ("да", "confirm"),
+    ("Ок", "confirm"),
+    ("подтверждаю", "confirm"),
+    ("согласен", "confirm"),
+    ("нет", "cancel"),
+    ("отмена", "cancel"),
+    ("отменить", "cancel"),
+    ("цель 75", "goal"),
+    ("моя цель 72 кг", "goal"),
+    ("хочу цель 68", "goal"),
+    ("похудеть на 10 кг за 12 недель", "goal"),
+    ("хочу похудеть на 5 кг", "goal"),
+    ("похудеть на 10кг", "goal"),
+    ("хочу похудеть на 10 кг", "goal"),
+    ("скинуть 7 кг к лету", "goal"),
+    ("сбросить на 4 кг", "goal"),
+    ("моя цель", "show_goal"),
+    ("какая цель у меня?", "show_goal"),
+    ("текущая цель", "show_goal"),
+    ("создай тренировку", "workout"),
+    ("тренировка на 60 минут", "workout"),
+    ("хочу тренировку для начинающих", "workout"),
+    ("дай тренировку дома без инвентаря", "workout"),
+    ("покажи прогресс", "progress"),
+    ("какой у меня прогресс?", "progress"),
+    ("остаток калорий", "get_remaining_calories"),
+    ("какой остаток на сегодня", "get_remaining_calories"),
+    ("сколько еще можно съесть", "get_remaining_calories"),
+    ("сводка за неделю", "calorie_summary"),
+    ("сколько я съел за неделю", "calorie_summary"),
+    ("калории за месяц", "calorie_summary"),
+    ("покажи сводку", "calorie_summary"),
+    ("мой вес", "show_weight"),
+    ("какой мой вес?", "show_weight"),
+    ("текущий вес", "show_weight"),
+    ("вес?", "show_weight"),
+    ("сколько я вешу", "show_weight"),
+    ("взвесился 85.4", "log_weight"),
+    ("взвесилась утром 62,3", "log_weight"),
+    ("вес 82", "log_weight"),
+    ("вес после обеда 82.5", "log_weight"),
+    ("сегодня вес 79", "log_weight"),
+    ("взвесился", "log_weight"),
+    ("я съел 2 яйца", "log_meal"),
+    ("съел борщ 300 мл", "log_meal"),
+    ("съела халву 40 г", "log_meal"),
+    ("выпил кофе с сахаром", "log_meal"),
+    ("я выпила стакан кефира", "log_meal"),
+    ("скушал банан", "log_meal"),
+    ("на завтрак овсянка 200 г", "log_meal"),
+    ("на обед гречка с курицей", "log_meal"),
+    ("ужин: салат и рыба", "log_meal"),
+    ("перекус яблоко", "log_meal"),
+    ("пообедал пельменями", "log_meal"),
+    ("я съел 2 яйца, хлеб и кофе с сахаром", "log_meal"),
+    ("на ужин съел пасту", "log_meal"),
+    ("привет", "none"),
+    ("как дела?", "none"),
+    ("что ты умеешь", "none"),
+    ("помоги составить меню", "none"),
+    ("спасибо!", "none"),
+    ("почему я не худею", "none"),
+    ("сколько калорий в банане", "none"),
+    ("посоветуй полезный перекус", "none"),
+    ("какую воду лучше пить", "none"),
+    ("победа!", "none"),
+    ("обеденный перерыв скоро", "none"),
+    ("хочу есть", "none"),
+]
+
+_nb = NaiveBayesIntentClassifier.fit(load_seed())
+_NB_TO_RULE = {"create_plan": "goal", "chat": "none"}
+
+
+def route(text: str) -> str:
+    """Решение router.llm_route до агента: правило с RULE_CONFIDENCE, затем классификатор."""
+    m = classify(text)
+    if m and m.confidence >= RULE_CONFIDENCE:
+        return m.intent
+    label, confidence = _nb.predict(text)
+    if label and confidence >= INTENT_CONFIDENCE:
+        return _NB_TO_RULE.get(label, label)
+    return "none"
+
+
+@pytest.mark.parametrize("text, expected", CORPUS)
+def test_corpus(text, expected):
+    assert route(text) == expected
+
+
+@pytest.mark.parametrize("text", ["похудеть на 10кг", "хочу похудеть на 10 кг", "Похудеть на 3,5 кг к лету"])
+def test_goal_rule_matches_both_spellings(text):
+    m = classify(text)
+    assert m is not None and m.intent == "goal"
+    assert m.confidence >= RULE_CONFIDENCE
+
+
+def test_goal_rule_needs_number_and_kg():
+    assert classify("хочу похудеть") is None
+    assert classify("похудеть на 10 недель") is None
+
+
+def test_cache_does_not_change_result():
+    cold = IntentMatcher(RULES, cache_size=0)
+    warm = IntentMatcher(RULES, cache_size=4)
+    for text, _ in CORPUS * 2:
+        a, b = classify(text, cold), classify(text, warm)
+        assert (a and a.intent) == (b and b.intent)
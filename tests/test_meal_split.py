@@ -0,0 +1,16 @@
+import pytest
+
+from utils import split_meal_items
+
+
+@pytest.mark.parametrize("text, items", [
+    ("я съел 2 яйца, хлеб и кофе с сахаром", ["2 яйца", "хлеб", "кофе с сахаром"]),
+    ("ужин: салат и рыба", ["салат", "рыба"]),
+    ("гречка с курицей и овощами", ["гречка с курицей и овощами"]),
+    ("кофе со сливками и сахаром, и булка", ["кофе со сливками и сахаром", "булка"]),
+    ("яблоко и банан плюс чай с лимоном", ["яблоко", "банан", "чай с лимоном"]),
+    ("выпил 1,5 л воды; съел творог", ["1,5 л воды", "творог"]),
+    ("", []),
+])
+def test_split_meal_items(text, items):
+    assert split_meal_items(text) == items
@@ -0,0 +1,70 @@
+import time
+
+from pending_store import PendingStore
+
+PLAN = {"type": "save_plan", "payload": {"calories": 1800, "weeks": 12}}
+
+
+def _rows(db) -> int:
+    with db.cursor() as c:
+        c.execute("SELECT COUNT(*) FROM pending_actions")
+        return c.fetchone()[0]
+
+
+def test_put_get_pop(db):
+    store = PendingStore(ttl_seconds=60, cache_size=10)
+    store.put(1, PLAN)
+
+    assert store.get(1) == PLAN
+    assert store.get(2) is None
+    assert store.pop(1) == PLAN
+    assert store.pop(1) is None
+    assert store.get(1) is None
+
+
+def test_get_reads_db_after_cache_miss(db):
+    PendingStore(ttl_seconds=60, cache_size=10).put(1, PLAN)
+    other = PendingStore(ttl_seconds=60, cache_size=10)  # другой воркер: кэш пуст
+    assert other.get(1) == PLAN
+    assert other.pop(1) == PLAN
+
+
+def test_expired_action_is_not_returned(db):
+    store = PendingStore(ttl_seconds=0.2, cache_size=10)
+    store.put(1, PLAN)
+    store.put(2, PLAN)
+    assert store.get(1) == PLAN
+
+    time.sleep(0.3)
+
+    assert store.get(1) is None
+    assert store.pop(2) is None
+
+
+def test_sweep_purges_expired_only(db):
+    short = PendingStore(ttl_seconds=0.2, cache_size=10)
+    short.put(1, PLAN)
+    PendingStore(ttl_seconds=60, cache_size=10).put(2, PLAN)
+    time.sleep(0.3)
+
+    assert short.sweep() == 1
+    assert _rows(db) == 1
+    assert short.get(2) == PLAN
+
+
+def test_cache_is_bounded(db):
+    store = PendingStore(ttl_seconds=60, cache_size=2)
+    for uid in (1, 2, 3):
+        store.put(uid, {"type": "t", "payload": uid})
+    assert list(store._cache) == [2, 3]
+    assert store.get(1) == {"type": "t", "payload": 1}  # вытеснен из кэша, но есть в БД
+
+
+def test_profile_reset_drops_cached_action(db):
+    store = PendingStore(ttl_seconds=60, cache_size=10)
+    store.put(1, PLAN)
+    db.delete_user_by_id(1)
+    assert store.get(1) == PLAN  # кэш ещё помнит
+
+    store.invalidate(1)
+    assert store.get(1) is None
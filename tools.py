@@ -1,62 +1,65 @@
 # tools.py - LangChain Tools для фитнес-бота
 
 import re
+import json
 from typing import Optional, Dict, Any
-from langchain.tools import tool
 
 from agent import call_ai
-from database import (
-    create_user_if_not_exists,
-    get_user_data,
-    get_today_calories,
-    save_user_weight,
-    save_meal_entry,
-    save_goal,
-)
+from kcal_cache import kcal_cache, make_key
+from food_density import FALLBACK_KCAL, food_density
+from utils import extract_qty as _extract_qty, split_meal_items
+from database import get_calorie_summary, transaction, user_db
+from sessions import sessions
+from pending_store import pending_store
+from workout_cache import workout_cache
 
-# -------------------- In-memory pending --------------------
-PENDING: dict[int, dict] = {}
 
+# -------------------- AI-оценка калорий --------------------
 
-# -------------------- Утилиты --------------------
+KCAL_ITEM_MIN = 5
+KCAL_ITEM_MAX = 1200  # границы на одну позицию, а не на весь приём пищи
 
-def _extract_qty(text: str) -> dict:
-    """Извлекает количество (г/мл/шт) из текста."""
-    t = (text or "").lower()
-    grams = None
-    ml = None
-    pcs = None
-
-    m = re.search(r"(\d+(?:[.,]\d+)?)\s*(?:г|гр|грам|грамм)\b", t)
-    if m:
-        grams = float(m.group(1).replace(",", "."))
-
-    m = re.search(r"(\d+(?:[.,]\d+)?)\s*(?:мл|миллилитр[а-я]*)\b", t)
-    if m:
-        ml = float(m.group(1).replace(",", "."))
-
-    m = re.search(r"(\d+(?:[.,]\d+)?)\s*(?:шт|штук|кус(?:ок|ка)|яйц[ао]?)\b", t)
-    if m:
-        pcs = float(m.group(1).replace(",", "."))
-
-    # словесные числа для яиц
-    words = {"одно":1,"один":1,"одна":1,"две":2,"два":2,"три":3,"четыре":4,"пять":5,
-             "шесть":6,"семь":7,"восемь":8,"девять":9,"десять":10}
-    for w, n in words.items():
-        if re.search(rf"\b{w}\b.*\bяйц", t):
-            pcs = float(n)
-            break
 
-    return {"grams": grams, "ml": ml, "pcs": pcs}
+def _clamp_kcal(val: int) -> int:
+    return min(max(val, KCAL_ITEM_MIN), KCAL_ITEM_MAX)
 
 
-# -------------------- AI-оценка калорий --------------------
+def _known_calories(meal_description: str) -> tuple[Optional[str], dict, Optional[int]]:
+    """Кэш, затем модель плотности. Возвращает (ключ кэша, количество, ккал или None)."""
+    q = _extract_qty(meal_description)
+    key = make_key(meal_description, q)
+    if key:
+        cached = kcal_cache.get(key)
+        if cached is not None:
+            print(f"[AI-KCAL cache] {key} → {cached}")
+            return key, q, cached
+
+    # известный продукт в новой порции — считаем по плотности, без LLM
+    local = food_density.estimate(meal_description, q)
+    if local is not None:
+        print(f"[AI-KCAL density] {meal_description} → {local}")
+        if key:
+            kcal_cache.put(key, local)
+    return key, q, local
+
+
+def _remember_calories(meal_description: str, key: Optional[str], q: dict, val: int) -> int:
+    food_density.learn(meal_description, q, val)
+    val = _clamp_kcal(val)  # мягкие границы
+    if key:
+        kcal_cache.put(key, val)
+    return val
+
 
 def ai_estimate_calories(user_id: int, meal_description: str) -> Optional[int]:
     """
     Просим LLM вернуть одно целое число (ккал). Учитывает г/мл/шт. Фильтрует нереалистичные ответы.
+    Сначала кэш, затем модель плотности: LLM нужен только для незнакомых продуктов.
     """
-    q = _extract_qty(meal_description)
+    key, q, known = _known_calories(meal_description)
+    if known is not None:
+        return known
+
     system = (
         "Ты нутрициолог и калькулятор калорий. Верни только одно целое число — общие килокалории блюда.\n"
         "Если блюдо низкокалорийное (овощи, несладкие фрукты, вода/чай/кофе без сахара), не превышай 50 ккал/100 г.\n"
@@ -77,159 +80,108 @@ def ai_estimate_calories(user_id: int, meal_description: str) -> Optional[int]:
         m = re.search(r"(-?\d+)", txt)
         if not m:
             return None
-        val = int(m.group(1))
-
-        # мягкие границы
-        if val < 5:
-            val = 5
-        if val > 1200:
-            val = 1200
-        return val
+        return _remember_calories(meal_description, key, q, int(m.group(1)))
 
     except Exception as e:
         print(f"[AI-KCAL ERR] {e}")
         return None
 
 
-# ==================== LangChain Tools ====================
-
-@tool
-def log_meal_tool(user_id: int, description: str) -> str:
-    """
-    Логирует приём пищи пользователя. Автоматически оценивает калории через AI.
-    
-    Args:
-        user_id: ID пользователя в Telegram
-        description: Описание еды (например: "2 яйца", "борщ 300 мл", "халва 40 г")
-    
-    Returns:
-        Сообщение с подтверждением и статистикой калорий за день
-    """
-    return log_meal(user_id, description)
-
-@tool  
-def get_remaining_calories_tool(user_id: int) -> str:
-    """
-    Показывает остаток калорий на сегодня для пользователя.
-    
-    Args:
-        user_id: ID пользователя в Telegram
-        
-    Returns:
-        Статистику потребленных и оставшихся калорий
-    """
-    return get_remaining_calories(user_id)
-
-@tool
-def log_weight_tool(user_id: int, weight: float) -> str:
-    """
-    Сохраняет вес пользователя.
-    
-    Args:
-        user_id: ID пользователя в Telegram
-        weight: Вес в килограммах
-        
-    Returns:
-        Подтверждение сохранения веса
-    """
-    return log_weight_entry(user_id, weight)
-
-@tool
-def create_plan_tool(user_id: int, goal_text: str) -> str:
-    """
-    Создает план похудения с целевым весом. Показывает превью плана для подтверждения.
-    
-    Args:
-        user_id: ID пользователя в Telegram
-        goal_text: Описание цели (например: "цель 75", "на 10 кг за 12 недель", "похудеть на 7 кг за 2 месяца")
-        
-    Returns:
-        Превью плана питания с калориями и макросами
-    """
-    return create_weight_loss_plan(user_id, goal_text)
-
-@tool
-def generate_workout_tool(user_id: int, preferences: str = "") -> str:
-    """
-    Генерирует персональную программу тренировки.
-    
-    Args:
-        user_id: ID пользователя в Telegram
-        preferences: Предпочтения (например: "60 минут", "кардио", "для начинающих")
-        
-    Returns:
-        План тренировки с разминкой, основной частью и заминкой
-    """
-    return generate_workout(user_id, preferences)
-
-@tool
-def show_progress_tool(user_id: int) -> str:
+def _parse_kcal_list(txt: str, n: int) -> list[Optional[int]]:
+    """Ответ вида [{"i": 1, "kcal": 155}, ...] или [155, 80, ...] → список длины n."""
+    out: list[Optional[int]] = [None] * n
+    m = re.search(r"\[.*\]", txt or "", re.S)
+    if not m:
+        return out
+    try:
+        data = json.loads(m.group(0))
+    except ValueError:
+        return out
+    for pos, el in enumerate(data):
+        idx, val = pos, el
+        if isinstance(el, dict):
+            idx = int(el.get("i", pos + 1)) - 1
+            val = el.get("kcal")
+        if isinstance(val, (int, float)) and 0 <= idx < n:
+            out[idx] = int(val)
+    return out
+
+
+def ai_estimate_meal_items(user_id: int, items: list[str]) -> list[Optional[int]]:
     """
-    Показывает прогресс пользователя по весу.
-    
-    Args:
-        user_id: ID пользователя в Telegram
-        
-    Returns:
-        Информацию о текущем весе и прогрессе
+    Оценка нескольких позиций одного приёма пищи. Известные (кэш/плотность) считаются
+    локально, остальные — одним JSON-запросом к LLM; границы применяются к каждой позиции.
     """
-    return analyze_progress(user_id)
+    known = [_known_calories(item) for item in items]
+    result: list[Optional[int]] = [k[2] for k in known]
+    todo = [i for i, val in enumerate(result) if val is None]
+    if not todo:
+        return result
+    if len(todo) == 1:
+        i = todo[0]
+        result[i] = ai_estimate_calories(user_id, items[i])
+        return result
 
-@tool
-def show_weight_tool(user_id: int) -> str:
-    """
-    Показывает текущий вес пользователя из профиля.
-    
-    Args:
-        user_id: ID пользователя в Telegram
-        
-    Returns:
-        Текущий вес пользователя
-    """
-    return show_current_weight(user_id)
+    system = (
+        "Ты нутрициолог и калькулятор калорий. Для каждой позиции оцени общие килокалории.\n"
+        "Низкокалорийное (овощи, несладкие фрукты, вода/чай/кофе без сахара) — не больше 50 ккал/100 г.\n"
+        "Сладости/масла/орехи/жареное/хлеб обычно 250–700 ккал/100 г. Без количества — обычная порция.\n"
+        'Ответ — только JSON-массив: [{"i": <номер>, "kcal": <целое>}, ...]'
+    )
+    user = "\n".join(f"{n}. {items[i]}" for n, i in enumerate(todo, 1))
+    try:
+        print(f"[AI-KCAL→] uid={user_id} {len(todo)} items")
+        resp = call_ai(user_id, user, system=system, temperature=0)
+        txt = (resp or {}).get("response", "") if isinstance(resp, dict) else str(resp)
+        print(f"[AI-KCAL←] {txt}")
+        values = _parse_kcal_list(txt, len(todo))
+    except Exception as e:
+        print(f"[AI-KCAL ERR] {e}")
+        return result
 
-@tool
-def show_goal_tool(user_id: int) -> str:
-    """
-    Показывает текущую цель по калориям пользователя.
-    
-    Args:
-        user_id: ID пользователя в Telegram
-        
-    Returns:
-        Текущая дневная цель по калориям
-    """
-    return show_current_goal(user_id)
+    for i, val in zip(todo, values):
+        if val is not None:
+            key, q, _ = known[i]
+            result[i] = _remember_calories(items[i], key, q, val)
+    return result
 
 
 # ==================== Основные функции (без изменений) ====================
 
 def log_meal(user_id: int, description: str, assistant_hint: str = "", meal_type: str = "generic") -> str:
-    """Логирует приём пищи, калории считает AI."""
-    create_user_if_not_exists(user_id)
+    """Логирует приём пищи, калории считает AI. Составной приём делится на позиции."""
+    sessions.ensure_user(user_id)
     clean = (description or "").strip().lower()
 
+    items = split_meal_items(clean)
+    if len(items) > 1:
+        return _log_meal_items(user_id, items)
+
     kcals = ai_estimate_calories(user_id, clean)
     if kcals is None:
-        kcals = 150  # фолбэк
+        kcals = FALLBACK_KCAL
 
-    save_meal_entry(user_id, clean, kcals)
+    s = sessions.add_meal(user_id, clean, kcals)
+    return f"✅ Сохранено: {clean}\n📊 Калории: ~{kcals} ккал\n" + _day_line(s)
 
-    data = get_user_data(user_id) or {}
-    goal = int(data.get("goal_calories") or 2000)
-    eaten = int(get_today_calories(user_id) or 0)
-    remaining = max(goal - eaten, 0)
 
-    return (
-        f"✅ Сохранено: {clean}\n"
-        f"📊 Калории: ~{kcals} ккал\n"
-        f"📈 Сегодня: ~{eaten}/{goal} ккал. Остаток: ~{remaining} ккал"
-    )
+def _log_meal_items(user_id: int, items: list[str]) -> str:
+    kcals = [k if k is not None else FALLBACK_KCAL for k in ai_estimate_meal_items(user_id, items)]
+    s = sessions.add_meals(user_id, list(zip(items, kcals)))
+    lines = "\n".join(f"• {item} — ~{k} ккал" for item, k in zip(items, kcals))
+    return f"✅ Сохранено:\n{lines}\n📊 Всего: ~{sum(kcals)} ккал\n" + _day_line(s)
+
+
+def _day_line(s) -> str:
+    goal = int(s.goal_calories or 2000)
+    eaten = int(s.calories_today or 0)
+    remaining = max(goal - eaten, 0)
+    return f"📈 Сегодня: ~{eaten}/{goal} ккал. Остаток: ~{remaining} ккал"
 
 def get_remaining_calories(user_id: int) -> str:
-    data = get_user_data(user_id) or {}
-    goal = int(data.get("goal_calories") or 2000)
-    eaten = int(get_today_calories(user_id) or 0)
+    s = sessions.get(user_id)
+    goal = int(s.goal_calories or 2000)
+    eaten = int(s.calories_today or 0)
     remaining = max(goal - eaten, 0)
     used_pct = int(eaten / goal * 100) if goal else 0
     return (
@@ -239,6 +191,22 @@ def get_remaining_calories(user_id: int) -> str:
     )
 
 
+def show_calorie_summary(user_id: int, text: str = "") -> str:
+    """Сводка за неделю/месяц из дневных итогов (без агрегации по meals)."""
+    days = 30 if "месяц" in (text or "").lower() else 7
+    s = get_calorie_summary(user_id, days)
+    if not s["logged_days"]:
+        return f"За последние {days} дн. записей о еде нет."
+    data = sessions.user_data(user_id)
+    goal = int(data.get("goal_calories") or 2000)
+    avg = int(s["total"] / s["logged_days"])
+    return (
+        f"🗓️ За {days} дн.: ~{s['total']} ккал, приёмов пищи: {s['meals']}\n"
+        f"📊 В среднем: ~{avg} ккал/день (дней с записями: {s['logged_days']})\n"
+        f"🎯 Цель: {goal} ккал/день"
+    )
+
+
 # -------------------- Вес / Прогресс --------------------
 
 def update_weight(user_id: int, text: str) -> str:
@@ -246,7 +214,7 @@ def update_weight(user_id: int, text: str) -> str:
     if not nums:
         return "Не вижу числа веса."
     w = float(nums[0].replace(",", "."))
-    save_user_weight(user_id, w)
+    sessions.save_weight(user_id, w)
     return f"💾 Вес сохранён: {w:.1f} кг"
 
 def log_weight_entry(user_id: int, weight: float) -> str:
@@ -255,25 +223,25 @@ def log_weight_entry(user_id: int, weight: float) -> str:
         w = float(str(weight).replace(",", "."))
     except Exception:
         return "Не смог распознать вес."
-    save_user_weight(user_id, w)
+    sessions.save_weight(user_id, w)
     return f"💾 Вес сохранён: {w:.1f} кг"
 
 def analyze_progress(user_id: int) -> str:
-    data = get_user_data(user_id) or {}
+    data = sessions.user_data(user_id)
     w = data.get("weight")
     if w is None:
         return "Пока нет данных по прогрессу."
     return f"Текущий вес: {float(w):.1f} кг"
 
 def show_current_weight(user_id: int) -> str:
-    data = get_user_data(user_id) or {}
+    data = sessions.user_data(user_id)
     w = data.get("weight")
     if w is None:
         return "Пока не знаю. Отправь: «взвесился 88»."
     return f"Текущий вес в профиле: {float(w):.1f} кг"
 
 def show_current_goal(user_id: int) -> str:
-    data = get_user_data(user_id) or {}
+    data = sessions.user_data(user_id)
     goal_cals = int(data.get("goal_calories") or 0)
     if goal_cals <= 0:
         return "Цель пока не установлена."
@@ -398,7 +366,7 @@ def create_weight_loss_plan(user_id: int, text: str = "") -> str:
     Делаем детерминированный превью-план (без сохранения) и кладём в pending.
     Подтверждение — «да», отмена — «нет».
     """
-    data = get_user_data(user_id) or {}
+    data = sessions.user_data(user_id)
     current = float(data.get("weight") or 0)
     if current <= 0:
         return "Сначала пришли текущий вес: «взвесился 88»."
@@ -432,7 +400,7 @@ def create_weight_loss_plan(user_id: int, text: str = "") -> str:
         "fats": int(plan["fats"]),
         "weeks": int(plan["weeks"]),
     }
-    PENDING[user_id] = {"type": "plan", "payload": payload}
+    pending_store.put(user_id, {"type": "plan", "payload": payload})
 
     safety = ""
     if plan["adjusted"]:
@@ -448,21 +416,25 @@ def create_weight_loss_plan(user_id: int, text: str = "") -> str:
     )
 
 def confirm_pending_action(user_id: int) -> str:
-    p = PENDING.get(user_id)
-    if not p or p.get("type") != "plan":
+    if not pending_store.get(user_id):
         return "Нет действий для подтверждения."
-    d = p["payload"]
-
-    save_goal(
-        user_id,
-        goal_text=f"Цель {d['target_weight']:.1f} кг",
-        calories=int(d["daily_calories"]),
-        proteins=int(d["protein"]),
-        carbs=int(d["carbs"]),
-        fats=int(d["fats"]),
-        weeks=int(d["weeks"]),
-    )
-    PENDING.pop(user_id, None)
+    # забор плана и сохранение цели — одна транзакция (оба в шарде пользователя):
+    # при ошибке план остаётся в pending
+    with transaction(user_db(user_id)):
+        p = pending_store.pop(user_id)
+        if not p or p.get("type") != "plan":
+            return "Нет действий для подтверждения."
+        d = p["payload"]
+
+        sessions.save_goal(
+            user_id,
+            goal_text=f"Цель {d['target_weight']:.1f} кг",
+            calories=int(d["daily_calories"]),
+            proteins=int(d["protein"]),
+            carbs=int(d["carbs"]),
+            fats=int(d["fats"]),
+            weeks=int(d["weeks"]),
+        )
     return (
         "✅ План применён!\n\n"
         f"🎯 Цель: {float(d['target_weight']):.1f} кг\n"
@@ -472,15 +444,15 @@ def confirm_pending_action(user_id: int) -> str:
     )
 
 def cancel_pending_action(user_id: int) -> str:
-    if PENDING.pop(user_id, None):
+    if pending_store.pop(user_id):
         return "❎ Отменено. Ничего не сохранено."
     return "Отменять нечего."
 
 
 # -------------------- Тренировки / Болтовня --------------------
 
-def generate_workout(user_id: int, text: str = "") -> str:
-    """Генерация тренировки через LLM."""
+def _workout_params(text: str) -> tuple[int, str, str]:
+    """Сводит запрос к (длительность, уровень, цель) — ключу кэша тренировок."""
     t = (text or "").lower()
     duration = 45
     for d in [90, 75, 60, 45, 30]:
@@ -501,14 +473,16 @@ def generate_workout(user_id: int, text: str = "") -> str:
         goal = "набор силы"
     elif "кардио" in t:
         goal = "кардио"
+    return duration, level, goal
 
-    system = "Ты тренер. Дай чёткий план тренировки: Разминка/Основная часть/Заминка. Коротко, пунктами, без Markdown."
-    user = f"Составь тренировку на {duration} минут. Уровень: {level}. Цель: {goal}."
+
+def generate_workout(user_id: int, text: str = "") -> str:
+    """Тренировка из пула готовых вариантов; LLM — только при пустом пуле или в фоне."""
+    duration, level, goal = _workout_params(text)
     try:
-        resp = call_ai(user_id, user, system=system, temperature=0.2)
-        txt = (resp or {}).get("response", "") if isinstance(resp, dict) else str(resp)
-        return txt.strip() or _fallback_workout()
-    except Exception:
+        return workout_cache.get(user_id, duration, level, goal) or _fallback_workout()
+    except Exception as e:
+        print(f"[WORKOUT ERR] {e}")
         return _fallback_workout()
 
 def _fallback_workout() -> str:
@@ -518,10 +492,11 @@ def _fallback_workout() -> str:
         "Заминка (5 мин): растяжка ног и спины"
     )
 
-def small_talk(user_id: int, text: str) -> str:
-    """Свободный ответ через LLM."""
+def small_talk(user_id: int, text: str, history: str = "", temperature: float | None = 0.3) -> str:
+    """Свободный ответ через LLM (history — история диалога для промпта; temperature=None — OPENAI_TEMPERATURE)."""
+    prompt = f"История диалога:\n{history}\n\nСообщение: {text}" if history else text
     try:
-        resp = call_ai(user_id, text, system="Отвечай кратко и по делу.", temperature=0.3)
+        resp = call_ai(user_id, prompt, system="Отвечай кратко и по делу.", temperature=temperature, stream=True)
         msg = (resp or {}).get("response", "").strip()
         return msg if msg else "Попробуй: «цель 75», «взвесился 88», «я съел 2 яйца»."
     except Exception:
@@ -537,19 +512,3 @@ def propose_weight_loss_plan(user_id: int, text: str = "") -> str:
 def propose_plan(user_id: int, text: str = "") -> str:
     """Аналог старого имени."""
     return create_weight_loss_plan(user_id, text)
-
-
-# ==================== Список всех LangChain tools для агента ====================
-
-def get_all_tools():
-    """Возвращает список всех LangChain tools для использования в агенте"""
-    return [
-        log_meal_tool,
-        get_remaining_calories_tool,
-        log_weight_tool,
-        create_plan_tool,
-        generate_workout_tool,
-        show_progress_tool,
-        show_weight_tool,
-        show_goal_tool,
-    ]
\ No newline at end of file
@@ -1,3 +1,6 @@
+import re
+
+
 def calc_daily_target(user: dict | None) -> int:
     """
     Грубая оценка дневного калоража (BMR Миффлин + активность 1.3 − дефицит 500).
@@ -12,3 +15,101 @@ def calc_daily_target(user: dict | None) -> int:
     bmr = 10 * weight + 6.25 * height - 5 * age + 5
     tdee = int(bmr * 1.3)
     return max(tdee - 500, 1200)
+
+
+# ---------- разбор описаний еды ----------
+
+def extract_qty(text: str) -> dict:
+    """Извлекает количество (г/мл/шт) из текста."""
+    t = (text or "").lower()
+    grams = None
+    ml = None
+    pcs = None
+
+    m = re.search(r"(\d+(?:[.,]\d+)?)\s*(?:г|гр|грам|грамм)\b", t)
+    if m:
+        grams = float(m.group(1).replace(",", "."))
+
+    m = re.search(r"(\d+(?:[.,]\d+)?)\s*(?:мл|миллилитр[а-я]*)\b", t)
+    if m:
+        ml = float(m.group(1).replace(",", "."))
+
+    m = re.search(r"(\d+(?:[.,]\d+)?)\s*(?:шт|штук|кус(?:ок|ка)|яйц[ао]?)\b", t)
+    if m:
+        pcs = float(m.group(1).replace(",", "."))
+
+    # словесные числа для яиц
+    words = {"одно":1,"один":1,"одна":1,"две":2,"два":2,"три":3,"четыре":4,"пять":5,
+             "шесть":6,"семь":7,"восемь":8,"девять":9,"десять":10}
+    for w, n in words.items():
+        if re.search(rf"\b{w}\b.*\bяйц", t):
+            pcs = float(n)
+            break
+
+    return {"grams": grams, "ml": ml, "pcs": pcs}
+
+
+_FOOD_FILLER_RE = re.compile(
+    r"\b(?:я|мы|съел[аи]?|съела|поел[аи]?|ел[аи]?|выпил[аи]?|скушал[аи]?|"
+    r"позавтракал[аи]?|пообедал[аи]?|поужинал[аи]?|"
+    r"на|завтрак|обед|ужин|перекус|было|был|была|сегодня)\b"
+)
+_FOOD_QTY_RE = re.compile(
+    r"\d+(?:[.,]\d+)?\s*(?:граммов|грамм|грам|гр|г|мл|миллилитр[а-я]*|штук[аи]?|шт|кус(?:ок|ка))?\b"
+)
+_FOOD_NUM_WORDS_RE = re.compile(
+    r"\b(?:одно|один|одна|две|два|три|четыре|пять|шесть|семь|восемь|девять|десять)\b"
+)
+
+
+def normalize_food_text(text: str) -> str:
+    """
+    Приводит описание еды к каноническому виду для ключей кэша:
+    нижний регистр, ё→е, без глаголов «съел/выпил», без чисел и единиц (их учитывает _extract_qty).
+    «Я съел 2 яйца!» → «яйца».
+    """
+    t = (text or "").lower().replace("ё", "е")
+    t = _FOOD_QTY_RE.sub(" ", t)
+    t = _FOOD_NUM_WORDS_RE.sub(" ", t)
+    t = re.sub(r"[^\w\s]", " ", t)
+    t = _FOOD_FILLER_RE.sub(" ", t)
+    return " ".join(t.split())
+
+
+_MEAL_SPLIT_RE = re.compile(
+    r"\s*(?:[;\n+]|(?<!\d),|,(?!\d)|\s(?:плюс|а также|а ещё|а еще|потом)\s)\s*"
+)
+# «и» делит позиции, только если слева не блюдо с гарниром: «гречка с курицей и овощами» — одно блюдо
+_MEAL_AND_RE = re.compile(r"\s+и\s+")
+_WITH_RE = re.compile(r"\sсо?\s")
+_MEAL_LEAD_RE = re.compile(
+    r"^(?:(?:и|я|мы|сегодня|ещё|еще|на|завтрак|обед|ужин|перекус|съел[аи]?|поел[аи]?|"
+    r"выпил[аи]?|скушал[аи]?|позавтракал[аи]?|пообедал[аи]?|поужинал[аи]?)[\s:,]+)+"
+)
+
+
+def split_meal_items(text: str) -> list[str]:
+    """
+    Делит составной приём пищи на позиции:
+    «я съел 2 яйца, хлеб и кофе с сахаром» → ["2 яйца", "хлеб", "кофе с сахаром"].
+    Запятая между цифрами («1,5 л») не делит, «кофе с сахаром» остаётся одной позицией,
+    «гречка с курицей и овощами» — тоже (после «с/со» «и» не делит).
+    """
+    t = (text or "").strip().lower()
+    items = []
+    for chunk in _MEAL_SPLIT_RE.split(t):
+        for part in _split_and(chunk):
+            part = _MEAL_LEAD_RE.sub("", part.strip(" .!")).strip(" .!")
+            if part:
+                items.append(part)
+    return items
+
+
+def _split_and(chunk: str) -> list[str]:
+    parts = []
+    for piece in _MEAL_AND_RE.split(chunk):
+        if parts and _WITH_RE.search(f" {parts[-1]} "):
+            parts[-1] += " и " + piece
+        else:
+            parts.append(piece)
+    return parts
@@ -0,0 +1,111 @@
+# webhook.py - Webhook-режим: aiohttp-приёмник → очереди → процессы-воркеры
+"""
+Telegram присылает обновления POST-запросами на WEBHOOK_PATH. Приёмник только
+проверяет секрет (X-Telegram-Bot-Api-Secret-Token), выбирает воркер по user_id
+и кладёт JSON в его очередь; 200 уходит сразу, не дожидаясь LLM.
+
+Воркеры — процессы shards.ShardPool: обновления одного пользователя всегда
+попадают в один воркер, упавший воркер перезапускается супервизором.
+
+    BOT_MODE=webhook WEBHOOK_SECRET=... WEBHOOK_URL=https://host/telegram/webhook python main.py
+
+Офлайн-нагрузка: fake_telegram.py.
+"""
+
+import asyncio
+import hmac
+import queue
+
+from aiohttp import web
+
+import metrics
+from config import (
+    WEBHOOK_URL,
+    WEBHOOK_PATH,
+    WEBHOOK_SECRET,
+    WEBHOOK_HOST,
+    WEBHOOK_PORT,
+    WEBHOOK_WORKERS,
+    WEBHOOK_QUEUE_SIZE,
+    create_bot,
+)
+from shards import ShardPool, ALLOWED_UPDATES, run_supervised
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+# ---------- Приёмник ----------
+
+class WebhookIngress:
+    def __init__(self, pool: ShardPool, secret: str, path: str = WEBHOOK_PATH):
+        self.pool = pool
+        self.secret = secret
+        self.path = path
+
+    async def handle(self, request: web.Request) -> web.Response:
+        if self.secret and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret):
+            metrics.inc("webhook_unauthorized")
+            return web.Response(status=401)
+        try:
+            data = await request.json()
+        except ValueError:
+            metrics.inc("webhook_bad_request")
+            return web.Response(status=400)
+        if not isinstance(data, dict):
+            return web.Response(status=400)
+
+        try:
+            self.pool.put_nowait(data)
+        except queue.Full:
+            # не теряем обновление: Telegram повторит доставку после не-2xx ответа
+            metrics.inc("webhook_rejected")
+            return web.Response(status=503)
+        metrics.inc("webhook_updates")
+        return web.Response()
+
+    async def health(self, request: web.Request) -> web.Response:
+        return web.json_response({
+            "shards": self.pool.health(),
+            "updates": metrics.get("webhook_updates"),
+            "rejected": metrics.get("webhook_rejected"),
+            "restarts": metrics.get("shard_restarts"),
+        })
+
+    def app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        app.router.add_get("/healthz", self.health)
+        return app
+
+
+# ---------- Запуск ----------
+
+async def _register_webhook():
+    if not WEBHOOK_URL:
+        print("[webhook] WEBHOOK_URL не задан — setWebhook пропущен")
+        return
+    bot = create_bot()
+    try:
+        await bot.set_webhook(WEBHOOK_URL, secret_token=WEBHOOK_SECRET or None, allowed_updates=ALLOWED_UPDATES)
+        print(f"✓ Webhook: {WEBHOOK_URL}")
+    finally:
+        await bot.session.close()
+
+
+async def _serve(ingress: WebhookIngress):
+    await _register_webhook()
+    runner = web.AppRunner(ingress.app(), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    print(f"🤖 Webhook: http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}, воркеров {len(ingress.pool)}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+
+def run_webhook(workers: int = WEBHOOK_WORKERS):
+    if not WEBHOOK_SECRET:
+        print("⚠️ WEBHOOK_SECRET не задан — эндпоинт примет обновления от кого угодно")
+    pool = ShardPool(workers, WEBHOOK_QUEUE_SIZE, name="bot-worker")
+    run_supervised(pool, lambda p: _serve(WebhookIngress(p, WEBHOOK_SECRET, WEBHOOK_PATH)))
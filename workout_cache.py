@@ -0,0 +1,174 @@
+#!/usr/bin/env python3
+# workout_cache.py - Пул готовых тренировок по (длительность, уровень, цель)
+"""
+generate_workout сводит любой запрос к одной из 5×3×4 = 60 комбинаций параметров,
+поэтому тренировки можно не генерировать на каждый запрос, а держать по каждому
+ключу пул из нескольких вариантов (для разнообразия) в SQLite + памяти.
+
+- есть свежий вариант → отдаём случайный мгновенно;
+- пул неполный или есть устаревшие (старше WORKOUT_TTL_DAYS) → отдаём что есть,
+  новый вариант догенерируется в фоне;
+- пул пуст → генерируем синхронно (промах).
+
+Прогрев всех ключей офлайн:
+
+    python workout_cache.py warm [--variants 3]
+"""
+
+import argparse
+import random
+import threading
+import time
+from datetime import datetime
+from itertools import product
+
+import metrics
+from agent import call_ai
+from config import WORKOUT_POOL_SIZE, WORKOUT_TTL_DAYS
+from database import get_workouts, add_workout, clear_workouts, count_workouts
+from executors import LLM_EXECUTOR
+
+DURATIONS = (30, 45, 60, 75, 90)
+LEVELS = ("начинающий", "средний", "продвинутый")
+GOALS = ("общая физическая форма", "похудение", "набор силы", "кардио")
+
+WORKOUT_SYSTEM = "Ты тренер. Дай чёткий план тренировки: Разминка/Основная часть/Заминка. Коротко, пунктами, без Markdown."
+# чуть выше прежних 0.2: варианты в одном пуле должны отличаться
+WORKOUT_TEMPERATURE = 0.6
+
+
+def make_key(duration: int, level: str, goal: str) -> str:
+    return f"{duration}|{level}|{goal}"
+
+
+def workout_prompt(duration: int, level: str, goal: str) -> str:
+    return f"Составь тренировку на {duration} минут. Уровень: {level}. Цель: {goal}."
+
+
+def generate_variant(user_id: int, duration: int, level: str, goal: str, stream: bool = False) -> str:
+    resp = call_ai(user_id, workout_prompt(duration, level, goal), system=WORKOUT_SYSTEM,
+                   temperature=WORKOUT_TEMPERATURE, stream=stream)
+    txt = (resp or {}).get("response", "") if isinstance(resp, dict) else str(resp)
+    return txt.strip()
+
+
+class WorkoutCache:
+    def __init__(self, pool_size: int, ttl_seconds: float):
+        self.pool_size = pool_size
+        self.ttl_seconds = ttl_seconds
+        self._pools: dict[str, list[tuple[str, float]]] = {}  # ключ → [(текст, created_ts)]
+        self._refilling: set[str] = set()
+        self._lock = threading.Lock()
+
+    def _pool(self, key: str) -> list[tuple[str, float]]:
+        with self._lock:
+            pool = self._pools.get(key)
+        if pool is None:
+            pool = [(text, datetime.fromisoformat(ts).timestamp()) for text, ts in get_workouts(key)]
+            with self._lock:
+                pool = self._pools.setdefault(key, pool)
+        return pool
+
+    def _add(self, key: str, text: str):
+        created = datetime.fromisoformat(add_workout(key, text, self.pool_size)).timestamp()
+        with self._lock:
+            pool = [(text, created)] + self._pools.get(key, [])
+            self._pools[key] = pool[:self.pool_size]
+
+    def get(self, user_id: int, duration: int, level: str, goal: str) -> str | None:
+        """Вариант из пула (с фоновой догенерацией) или синхронная генерация при пустом пуле."""
+        key = make_key(duration, level, goal)
+        pool = self._pool(key)
+        if pool:
+            fresh = [text for text, ts in pool if time.time() - ts < self.ttl_seconds]
+            if len(fresh) < self.pool_size:
+                self._refill_async(user_id, key, duration, level, goal)
+            metrics.inc("workout_cache_hits" if fresh else "workout_cache_stale")
+            return random.choice(fresh or [text for text, _ in pool])
+
+        metrics.inc("workout_cache_misses")
+        text = generate_variant(user_id, duration, level, goal, stream=True)  # пользователь ждёт — показываем по мере генерации
+        if text:
+            self._add(key, text)
+        return text or None
+
+    def _refill_async(self, user_id: int, key: str, duration: int, level: str, goal: str):
+        with self._lock:
+            if key in self._refilling:
+                return
+            self._refilling.add(key)
+
+        def job():
+            try:
+                text = generate_variant(user_id, duration, level, goal)
+                if text:
+                    self._add(key, text)
+                    metrics.inc("workout_cache_refills")
+            except Exception as e:
+                print(f"[WORKOUT] refill error {key}: {e}")
+            finally:
+                with self._lock:
+                    self._refilling.discard(key)
+
+        LLM_EXECUTOR.submit(job)
+
+    def warm(self, variants: int | None = None) -> int:
+        """Заполняет пулы всех комбинаций до variants свежих вариантов. Возвращает число сгенерированных."""
+        variants = min(variants or self.pool_size, self.pool_size)
+        generated = 0
+        for duration, level, goal in product(DURATIONS, LEVELS, GOALS):
+            key = make_key(duration, level, goal)
+            have = sum(1 for _, ts in self._pool(key) if time.time() - ts < self.ttl_seconds)
+            while have < variants:
+                try:
+                    text = generate_variant(0, duration, level, goal)
+                except Exception as e:
+                    print(f"[WORKOUT] warm error {key}: {e}")
+                    break
+                if not text:
+                    break
+                self._add(key, text)
+                have += 1
+                generated += 1
+            print(f"[WORKOUT] {key}: {have} fresh")
+        return generated
+
+    def clear(self) -> int:
+        with self._lock:
+            self._pools.clear()
+        return clear_workouts()
+
+    def stats(self) -> dict:
+        n, keys = count_workouts()
+        return {
+            "variants": n,
+            "keys": keys,
+            "combinations": len(DURATIONS) * len(LEVELS) * len(GOALS),
+            "hits": metrics.get("workout_cache_hits"),
+            "stale": metrics.get("workout_cache_stale"),
+            "misses": metrics.get("workout_cache_misses"),
+        }
+
+
+workout_cache = WorkoutCache(WORKOUT_POOL_SIZE, WORKOUT_TTL_DAYS * 86400)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Прогрев кэша тренировок")
+    ap.add_argument("command", choices=["warm", "stats", "clear"])
+    ap.add_argument("--variants", type=int, default=None, help=f"вариантов на ключ (≤ {WORKOUT_POOL_SIZE})")
+    args = ap.parse_args()
+
+    from database import init_db
+    init_db()
+
+    if args.command == "warm":
+        n = workout_cache.warm(args.variants)
+        print(f"generated: {n}")
+    elif args.command == "clear":
+        print(f"deleted: {workout_cache.clear()}")
+    print(workout_cache.stats())
+
+
+if __name__ == "__main__":
+    main()